@@ -1 +1,4 @@
 from . import monkeypatch
+
+
+default_app_config = 'api.apps.ApiConfig'
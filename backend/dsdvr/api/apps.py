@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        # Imported for its side effect, it connects the signal receivers
+        # that publish events.
+        from api import events  # noqa: F401
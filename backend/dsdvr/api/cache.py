@@ -0,0 +1,151 @@
+'''
+In process cache for expensive lookups.
+
+    @cached(30, stale=300)
+    def get_stats():
+        ...
+
+Results are kept for ttl seconds, the least recently used are evicted beyond
+maxsize entries. Concurrent callers of an uncached key share one computation.
+For stale seconds after a result expires it is still returned, while it is
+recomputed by a background thread, so only the first caller ever waits.
+'''
+
+import time
+import logging
+import threading
+
+from collections import OrderedDict
+from functools import wraps
+
+from django.db import connection
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+
+def _freeze(value):
+    # Lists and dicts are accepted as arguments, but are not hashable.
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+
+    elif isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+
+    return value
+
+
+class _Flight(object):
+    '''
+    A computation in progress.
+    '''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache(object):
+    def __init__(self, ttl, stale=0, maxsize=128):
+        self.ttl = ttl
+        self.stale = stale
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # key: (value, expires)
+        self._values = OrderedDict()
+        self._flights = {}
+
+    def get(self, key, compute):
+        '''
+        Return the cached value of key, calling compute() to obtain it.
+        '''
+        with self._lock:
+            now = time.monotonic()
+            cached = self._values.get(key)
+
+            if cached is not None:
+                value, expires = cached
+                if now < expires:
+                    self._values.move_to_end(key)
+                    return value
+
+                if now < expires + self.stale:
+                    if key not in self._flights:
+                        flight = self._flights[key] = _Flight()
+                        thread = threading.Thread(
+                            target=self._refresh, args=(key, compute, flight))
+                        thread.daemon = True
+                        thread.start()
+                    return value
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if leader:
+            self._compute(key, compute, flight)
+
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+
+        return flight.value
+
+    def _compute(self, key, compute, flight):
+        try:
+            flight.value = compute()
+
+        except Exception as e:
+            flight.error = e
+
+        with self._lock:
+            if flight.error is None:
+                self._values[key] = (
+                    flight.value, time.monotonic() + self.ttl)
+                self._values.move_to_end(key)
+                while len(self._values) > self.maxsize:
+                    self._values.popitem(last=False)
+
+            del self._flights[key]
+
+        flight.done.set()
+
+    def _refresh(self, key, compute, flight):
+        try:
+            self._compute(key, compute, flight)
+            if flight.error is not None:
+                # The stale value is kept, the next caller tries again.
+                LOGGER.warning(
+                    'Could not refresh %s: %s', key, flight.error,
+                    exc_info=flight.error)
+
+        finally:
+            connection.close()
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+def cached(ttl, stale=0, maxsize=128):
+    '''
+    Decorator, caches results by the function's arguments in a TTLCache.
+    '''
+    def decorator(fn):
+        cache = TTLCache(ttl, stale=stale, maxsize=maxsize)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (_freeze(args), _freeze(kwargs))
+            return cache.get(key, lambda: fn(*args, **kwargs))
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
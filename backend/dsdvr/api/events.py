@@ -0,0 +1,260 @@
+'''
+Event bus.
+
+Tasks, recordings and streams publish events as their state changes. Clients
+subscribe to them via /api/events/ (see api.views.events) instead of polling
+the status and task endpoints.
+
+Events are only built when someone is subscribed. Each subscriber has a
+bounded buffer, a client that falls behind loses its oldest events rather
+than holding up the publisher.
+
+Subscribers only receive events published in their process. When tasks run in
+a separate worker service (settings.TASK_MODE), web processes poll the
+database for the changes it makes instead.
+'''
+
+import time
+import queue
+import logging
+import threading
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.models import Recording, Stream
+from main.models import Job
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+# Events buffered per subscriber.
+BUFFER_SIZE = 256
+# Minimum seconds between progress events of a Task.
+PROGRESS_INTERVAL = 1.0
+# Seconds between polls for changes made by other processes.
+POLL_INTERVAL = 2
+
+
+class Subscription(object):
+    def __init__(self, bus):
+        self.bus = bus
+        self.queue = queue.Queue(maxsize=BUFFER_SIZE)
+
+    def put(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        '''
+        Returns a (type, data) tuple, raises queue.Empty on timeout.
+        '''
+        return self.queue.get(timeout=timeout)
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class Poller(object):
+    '''
+    Publishes changes made by other processes. Task progress is persisted
+    periodically by the process running the Task (see main.taskqueue), so
+    it is relayed at that rate.
+    '''
+
+    # Model, fields whose change is published, event type.
+    WATCH = (
+        (Recording, ('status', 'pid'), 'recording'),
+        (Stream, ('pid', ), 'stream'),
+    )
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.thread = None
+        self._since = None
+        self._states = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(POLL_INTERVAL)
+            if not self.bus.wants():
+                # Start over with the next subscriber.
+                self._since = None
+                self._states = {}
+                continue
+
+            try:
+                self.poll()
+
+            except Exception as e:
+                LOGGER.exception(e)
+
+    def poll(self):
+        from api.serializers import (
+            TaskSerializer, RecordingSerializer, StreamSerializer,
+        )
+
+        serializers = {
+            'recording': RecordingSerializer,
+            'stream': StreamSerializer,
+        }
+
+        if self._since is None:
+            self._since = timezone.now()
+
+        jobs = Job.objects.filter(background=False, modified__gt=self._since)
+        for job in jobs.order_by('modified'):
+            self.bus.publish('task', TaskSerializer(job).data)
+            self._since = job.modified
+
+        for model, fields, type in self.WATCH:
+            states = {
+                str(row[0]): row[1:]
+                for row in model.objects.values_list('id', *fields)
+            }
+            last, self._states[type] = self._states.get(type), states
+            if last is None:
+                continue
+
+            changed = [
+                id for id, state in states.items() if last.get(id) != state]
+            for obj in model.objects.filter(id__in=changed):
+                self.bus.publish(type, serializers[type](obj).data)
+
+            for id in set(last) - set(states):
+                self.bus.publish('%s.deleted' % type, {'id': id})
+
+
+class EventBus(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._sent = {}
+        self._poller = None
+
+    def subscribe(self, limit=None):
+        '''
+        Returns a new Subscription, or None when there are `limit`
+        subscribers already.
+        '''
+        subscription = Subscription(self)
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                return None
+
+            self._subscribers.add(subscription)
+
+            if settings.TASK_MODE != 'embedded' and self._poller is None:
+                self._poller = Poller(self)
+                self._poller.start()
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def wants(self, key=None, interval=0):
+        '''
+        Returns True if an event should be published. False if there are no
+        subscribers, or if an event with the same key was published less than
+        interval seconds ago.
+        '''
+        if not self._subscribers:
+            return False
+
+        if key is None:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            if now - self._sent.get(key, 0) < interval:
+                return False
+
+            self._sent[key] = now
+
+        return True
+
+    def forget(self, key):
+        with self._lock:
+            self._sent.pop(key, None)
+
+    def publish(self, type, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            subscription.put((type, data))
+
+
+EVENTS = EventBus()
+
+
+@receiver(post_save, sender=Recording)
+def recording_saved(sender, instance, created, update_fields, **kwargs):
+    if not created and update_fields is not None and \
+       'status' not in update_fields and 'pid' not in update_fields:
+        return
+
+    if not EVENTS.wants():
+        return
+
+    from api.serializers import RecordingSerializer
+
+    try:
+        EVENTS.publish('recording', RecordingSerializer(instance).data)
+
+    except Exception as e:
+        LOGGER.exception(e)
+
+
+@receiver(post_delete, sender=Recording)
+def recording_deleted(sender, instance, **kwargs):
+    if EVENTS.wants():
+        EVENTS.publish('recording.deleted', {'id': str(instance.id)})
+
+
+@receiver(post_save, sender=Stream)
+def stream_saved(sender, instance, created, update_fields, **kwargs):
+    # Cursor updates are frequent, only publish lifecycle changes.
+    if not created and update_fields is not None and \
+       'pid' not in update_fields:
+        return
+
+    if not EVENTS.wants():
+        return
+
+    from api.serializers import StreamSerializer
+
+    try:
+        EVENTS.publish('stream', StreamSerializer(instance).data)
+
+    except Exception as e:
+        LOGGER.exception(e)
+
+
+@receiver(post_delete, sender=Stream)
+def stream_deleted(sender, instance, **kwargs):
+    if EVENTS.wants():
+        EVENTS.publish('stream.deleted', {'id': str(instance.id)})
@@ -1,9 +1,39 @@
+import time
+import atexit
+import random
+import logging
+import threading
+
+from collections import OrderedDict
+from functools import lru_cache
+
 from ua_parser import user_agent_parser
 
+from django.conf import settings
+from django.middleware import gzip
 from django.utils import timezone
 from django.db.transaction import atomic
 
 from api.models import Device
+from main.profiling import PROFILES, QueryCounter
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+# How often (seconds) device use is written.
+DEVICE_FLUSH = 5
+# Devices kept in memory.
+DEVICE_CACHE_SIZE = 1024
+# Responses compressed by GZipMiddleware.
+GZIP_CONTENT_TYPES = (
+    'application/json',
+    'application/vnd.dsdvr.columnar+json',
+)
+# Names of the URLs whose responses are never compressed. They carry secrets
+# (tokens, event tickets) and would allow BREACH.
+GZIP_EXEMPT_URLS = ('token_obtain_pair', 'token_refresh', 'events-ticket')
 
 
 def flatten(d):
@@ -18,25 +48,172 @@ def flatten(d):
     return flat
 
 
+@lru_cache(maxsize=256)
+def _parse(user_agent):
+    flat = flatten(user_agent_parser.Parse(user_agent))
+    return {k: v for k, v in flat.items() if k != 'string'}
+
+
+def device_exempt(view):
+    '''
+    Marks a view that does not need request.device, DeviceMiddleware then
+    skips the request.
+    '''
+    view.device_exempt = True
+    return view
+
+
+class DeviceTracker(object):
+    '''
+    Devices by user agent, kept in memory. Only a device seen for the first
+    time is written right away, its address and last use are written in
+    batches, every DEVICE_FLUSH seconds.
+    '''
+
+    def __init__(self, interval=DEVICE_FLUSH, maxsize=DEVICE_CACHE_SIZE):
+        self.interval = interval
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        # user agent: Device
+        self.devices = OrderedDict()
+        # Device id: (address, time)
+        self.pending = {}
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+
+            self.thread = threading.Thread(target=self._loop)
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.flush)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+
+            except Exception as e:
+                LOGGER.exception(e)
+
+    def _get(self, user_agent):
+        with self.lock:
+            device = self.devices.get(user_agent)
+            if device is not None:
+                self.devices.move_to_end(user_agent)
+                return device
+
+        with atomic(immediate='devices'):
+            device, _ = Device.objects.get_or_create(
+                user_agent=user_agent, defaults=_parse(user_agent))
+
+        with self.lock:
+            self.devices[user_agent] = device
+            while len(self.devices) > self.maxsize:
+                self.devices.popitem(last=False)
+
+        return device
+
+    def seen(self, user_agent, ip_address):
+        '''
+        Returns the Device for user_agent, and records it was used.
+        '''
+        device, now = self._get(user_agent), timezone.now()
+        device.last_ip_address, device.modified = ip_address, now
+
+        with self.lock:
+            self.pending[device.pk] = (ip_address, now)
+
+        self.start()
+        return device
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        if not pending:
+            return
+
+        with atomic(immediate='devices'):
+            for pk, (ip_address, modified) in pending.items():
+                if not Device.objects.filter(pk=pk).update(
+                        last_ip_address=ip_address, modified=modified):
+                    self.forget(pk)
+
+    def forget(self, pk):
+        '''
+        Drop a deleted device.
+        '''
+        with self.lock:
+            for user_agent, device in list(self.devices.items()):
+                if device.pk == pk:
+                    del self.devices[user_agent]
+
+
+DEVICES = DeviceTracker()
+
+
 class DeviceMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'device_exempt', False):
+            return
+
         user_agent = request.META.get('HTTP_USER_AGENT', None)
         if user_agent is not None:
-            flat = flatten(user_agent_parser.Parse(user_agent))
-            defaults = {k: v for k, v in flat.items() if k != 'string'}
+            request.device = DEVICES.seen(
+                user_agent, request.META.get('REMOTE_ADDR', None))
+
 
-            with atomic(immediate=True):
-                device, created = Device.objects.get_or_create(
-                    user_agent=user_agent, defaults=defaults)
+class ProfilingMiddleware:
+    '''
+    Times a sample of requests (settings.PROFILE_REQUESTS), by view and
+    method. Streaming responses are timed until they start streaming. See
+    main.profiling.
+    '''
 
-                if not created:
-                    device.update(
-                        last_ip_address=request.META.get('REMOTE_ADDR', None),
-                        modified=timezone.now())  # Not sure this is necessary.
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = settings.PROFILE_REQUESTS
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
 
-            setattr(request, 'device', device)
+        started = time.perf_counter()
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+        wall = time.perf_counter() - started
 
-        return self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+        PROFILES.add_request('%s %s' % (request.method, view), wall, counter)
+
+        return response
+
+
+class GZipMiddleware(gzip.GZipMiddleware):
+    '''
+    Compresses API responses, for clients that accept gzip. Not streaming
+    responses: events must be sent as they happen, and video does not
+    compress. Nor responses of GZIP_EXEMPT_URLS.
+    '''
+
+    def process_response(self, request, response):
+        if response.streaming or not response.get(
+                'Content-Type', '').startswith(GZIP_CONTENT_TYPES):
+            return response
+
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.url_name in GZIP_EXEMPT_URLS:
+            return response
+
+        return super().process_response(request, response)
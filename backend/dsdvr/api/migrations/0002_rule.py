@@ -0,0 +1,46 @@
+# Generated by Django 2.1.7 on 2026-10-19 01:51
+
+import api.models
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recording',
+            name='channel',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='recordings', to='api.Channel'),
+        ),
+        migrations.CreateModel(
+            name='Rule',
+            fields=[
+                ('created', models.DateTimeField(editable=False)),
+                ('modified', models.DateTimeField(editable=False)),
+                ('id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=256)),
+                ('series_id', models.CharField(max_length=32, null=True)),
+                ('title', models.CharField(max_length=256, null=True)),
+                ('start_time', models.TimeField(null=True)),
+                ('stop_time', models.TimeField(null=True)),
+                ('new_only', models.BooleanField(default=False)),
+                ('enabled', models.BooleanField(default=True)),
+                ('channel', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rules', to='api.Channel')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(api.models.UpdateMixin, models.Model),
+        ),
+        migrations.AddField(
+            model_name='recording',
+            name='rule',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recordings', to='api.Rule'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1.7 on 2026-10-19 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_rule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recording',
+            name='padding_start',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recording',
+            name='padding_stop',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='padding_start',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='padding_stop',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.1.7 on 2026-10-19 02:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_padding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='rule',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='media', to='api.Rule'),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='keep_episodes',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 2.1.7 on 2026-10-19 02:54
+
+import logging
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def create_index(apps, schema_editor):
+    # The full text index is SQLite only, see api.search.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE api_search USING fts5(title, subtitle, "
+            "description, actors, categories, "
+            "tokenize='unicode61 remove_diacritics 1', prefix='2 3')")
+
+    except OperationalError as e:
+        LOGGER.warning('Search will be slow, no full text index: %s', e)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS api_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.SmallIntegerField(choices=[(0, 'program'), (1, 'media')])),
+                ('object_id', models.UUIDField()),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-19 03:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_eventticket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recording',
+            name='health',
+            field=models.TextField(null=True),
+        ),
+    ]
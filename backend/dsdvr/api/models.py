@@ -5,6 +5,7 @@ import signal
 import logging
 import pathlib
 import random
+import secrets
 import string
 
 from os.path import join as pathjoin
@@ -367,6 +368,8 @@ class Media(UpdateMixin, CreatedModifiedModel):
     rating = models.ForeignKey(Rating, on_delete=models.CASCADE, null=True)
     year = models.SmallIntegerField(null=True)
     actors = models.ManyToManyField(Person, through='MediaActor')
+    rule = models.ForeignKey(
+        'Rule', null=True, on_delete=models.SET_NULL, related_name='media')
 
     objects = MediaManager()
 
@@ -464,6 +467,17 @@ class Program(UpdateMixin, CreatedModifiedModel):
     objects = ProgramManager()
 
 
+class ScheduleManager(models.Manager):
+    def get_upcoming(self, window=timedelta(hours=2)):
+        start_time = timezone.now()
+
+        queryset = self.filter(
+            Q(start__lte=start_time + window) & Q(stop__gte=start_time))
+        queryset = queryset.order_by('channel__number', 'start')
+
+        return queryset
+
+
 class Schedule(UpdateMixin, models.Model):
     class Meta:
         unique_together = (
@@ -481,6 +495,8 @@ class Schedule(UpdateMixin, models.Model):
     stop = models.DateTimeField()
     duration = models.IntegerField()
 
+    objects = ScheduleManager()
+
 
 class ShowManager(DefaultTypeManager):
     DEFAULT_TYPE = Media.TYPE_SHOW
@@ -568,6 +584,73 @@ class DeviceCursor(UpdateMixin, models.Model):
     cursor = models.DecimalField(max_digits=12, decimal_places=6, default=0.0)
 
 
+class Rule(UpdateMixin, CreatedModifiedModel):
+    '''
+    A standing request to record every Schedule matching the given criteria.
+
+    All criteria are optional, those that are provided must all match. Rules
+    are evaluated when the guide is imported, so new airings are picked up
+    without user intervention.
+    '''
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    name = models.CharField(max_length=256)
+    # Matched as a prefix of Program.program_id, for Schedules Direct data
+    # this is the series portion of the id (ex: EP00004422).
+    series_id = models.CharField(max_length=32, null=True)
+    title = models.CharField(max_length=256, null=True)
+    channel = models.ForeignKey(
+        Channel, null=True, on_delete=models.CASCADE, related_name='rules')
+    # Time of day window, may wrap midnight.
+    start_time = models.TimeField(null=True)
+    stop_time = models.TimeField(null=True)
+    new_only = models.BooleanField(default=False)
+    enabled = models.BooleanField(default=True)
+    # Seconds to record before start and after stop.
+    padding_start = models.PositiveIntegerField(default=0)
+    padding_stop = models.PositiveIntegerField(default=0)
+    # Number of recorded episodes to keep, None keeps all of them.
+    keep_episodes = models.PositiveSmallIntegerField(null=True)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return 'Rule: %s' % str(self)
+
+    def get_query(self):
+        '''
+        Returns a Q object that filters Schedules matched by this Rule. The
+        time of day window is not expressed here, see is_in_window().
+        '''
+        q = Q()
+
+        if self.series_id:
+            q &= Q(program__program_id__startswith=self.series_id)
+
+        if self.title:
+            q &= Q(program__title__iexact=self.title)
+
+        if self.channel_id:
+            q &= Q(channel_id=self.channel_id)
+
+        if self.new_only:
+            q &= Q(program__previously_shown=False)
+
+        return q
+
+    def is_in_window(self, start):
+        if self.start_time is None or self.stop_time is None:
+            return True
+
+        start = timezone.localtime(start).time()
+
+        if self.start_time <= self.stop_time:
+            return self.start_time <= start < self.stop_time
+
+        # Window wraps midnight.
+        return start >= self.start_time or start < self.stop_time
+
+
 class Recording(UpdateMixin, CreatedModifiedModel):
     STATUS_NONE = 0
     STATUS_RECORDING = 1
@@ -586,11 +669,22 @@ class Recording(UpdateMixin, CreatedModifiedModel):
     stop = models.DateTimeField()
     program = models.OneToOneField(
         Program, on_delete=models.CASCADE, related_name='recording')
+    channel = models.ForeignKey(
+        Channel, null=True, on_delete=models.CASCADE,
+        related_name='recordings')
+    rule = models.ForeignKey(
+        Rule, null=True, on_delete=models.SET_NULL, related_name='recordings')
     media = models.OneToOneField(
         Media, null=True, on_delete=models.CASCADE, related_name='recording')
     status = models.SmallIntegerField(
         choices=STATUS_NAMES.items(), default=STATUS_NONE)
     pid = models.IntegerField(null=True)
+    # Seconds, already applied to start and stop.
+    padding_start = models.PositiveIntegerField(default=0)
+    padding_stop = models.PositiveIntegerField(default=0)
+    # Output metrics sampled by the recording watchdog (JSON), it runs in
+    # another process than the API.
+    health = models.TextField(null=True)
 
     def is_now(self, now=None):
         if now is None:
@@ -608,7 +702,12 @@ class Recording(UpdateMixin, CreatedModifiedModel):
         return now >= self.stop
 
     def delete(self, *args, **kwargs):
-        if self.pid:
+        # Back-to-back recordings may share a capture process.
+        shared = Recording.objects.filter(
+            pid=self.pid, status=Recording.STATUS_RECORDING) \
+            .exclude(pk=self.pk).exists()
+
+        if self.pid and not shared:
             try:
                 os.kill(self.pid, signal.SIGINT)
 
@@ -645,3 +744,63 @@ class Movie(Media):
 
     def subtype(self):
         return self
+
+
+class SearchDocument(models.Model):
+    '''
+    A Program or Media in the search index, its id is the row id in the full
+    text index (see api.search).
+    '''
+    class Meta:
+        unique_together = (
+            ('kind', 'object_id'),
+        )
+
+    KIND_PROGRAM = 0
+    KIND_MEDIA = 1
+
+    KIND_NAMES = {
+        KIND_PROGRAM: 'program',
+        KIND_MEDIA: 'media',
+    }
+
+    kind = models.SmallIntegerField(choices=list(KIND_NAMES.items()))
+    object_id = models.UUIDField()
+
+
+class EventTicketManager(models.Manager):
+    def issue(self, user, ttl=timedelta(seconds=30)):
+        now = timezone.now()
+        self.filter(expires__lte=now).delete()
+        return self.create(
+            key=secrets.token_urlsafe(32), user=user, expires=now + ttl)
+
+    def redeem(self, key):
+        '''
+        Returns the User a ticket was issued to, or None if it is not valid.
+        A ticket may only be used once.
+        '''
+        try:
+            ticket = self.select_related('user').get(
+                key=key, expires__gt=timezone.now())
+
+        except self.model.DoesNotExist:
+            return None
+
+        # Of concurrent requests, only the one deleting the ticket wins.
+        deleted, _ = self.filter(key=key).delete()
+        return ticket.user if deleted else None
+
+
+class EventTicket(models.Model):
+    '''
+    Short lived, single use credentials for /api/events/ (see
+    api.views.events). EventSource can not send an Authorization header, and
+    an access token in the URL would be logged.
+    '''
+    key = models.CharField(max_length=64, primary_key=True)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='event_tickets')
+    expires = models.DateTimeField()
+
+    objects = EventTicketManager()
@@ -1,5 +1,44 @@
-from django.db import connection, DEFAULT_DB_ALIAS
+'''
+atomic(immediate=...) begins a transaction holding a write lock, rather than
+taking one when the transaction first writes. Transactions that read, then
+write what they read, are then serialized instead of failing (SQLite) or
+racing (PostgreSQL).
+
+ - SQLite has a single writer, BEGIN IMMEDIATE takes the database write lock.
+ - PostgreSQL writers only conflict on the rows they write. immediate may
+   name a lock (True is DEFAULT_LOCK), a transaction level advisory lock of
+   that name is taken, so only transactions using the same lock are
+   serialized.
+
+Waiting for the lock is limited by the database timeout (settings.DATABASES).
+'''
+
+import time
+import zlib
+
+from django.db import DEFAULT_DB_ALIAS
 from django.db import transaction
+from django.db.utils import OperationalError
+
+from main.metrics import DB_LOCK_WAIT, DB_LOCKED
+
+
+DEFAULT_LOCK = 'default'
+
+
+def _lock_key(name):
+    return zlib.crc32(name.encode('utf8'))
+
+
+def _begin_immediate(connection, lock):
+    if connection.vendor == 'sqlite':
+        connection.cursor().execute('BEGIN IMMEDIATE')
+
+    elif connection.vendor == 'postgresql':
+        if lock is True:
+            lock = DEFAULT_LOCK
+        connection.cursor().execute(
+            'SELECT pg_advisory_xact_lock(%s)', [_lock_key(lock)])
 
 
 def _monkey_patch_atomic():
@@ -43,7 +82,17 @@ def _monkey_patch_atomic():
         else:
             if self.immediate:
                 connection.set_autocommit(False)
-                connection.cursor().execute('BEGIN IMMEDIATE')
+                # Waits up to the timeout for other writers.
+                started = time.perf_counter()
+                try:
+                    _begin_immediate(connection, self.immediate)
+
+                except OperationalError:
+                    DB_LOCKED.inc()
+                    raise
+
+                finally:
+                    DB_LOCK_WAIT.observe(time.perf_counter() - started)
 
             else:
                 connection.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
@@ -0,0 +1,36 @@
+'''
+Pagination of the API's large lists.
+
+Lists that grow with the guide or the library (programs, media...) are paged,
+their viewsets set `pagination_class`. Other lists are returned whole, as a
+plain list.
+
+Lists are paged with an opaque cursor rather than an offset, so a page costs
+the same however deep into the list it is, and rows added while a client
+pages (a guide import) do not shift the pages:
+
+    {"next": "...?cursor=cD0y", "previous": null, "results": [...]}
+
+Pages are ordered by the view's `ordering` (most recent first by default).
+Clients choose a page size with ?page_size=, up to MAX_PAGE_SIZE.
+'''
+
+from rest_framework import pagination
+
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class CursorPagination(pagination.CursorPagination):
+    page_size = PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+    ordering = '-created'
+
+    def get_ordering(self, request, queryset, view):
+        # Not every model has created.
+        ordering = getattr(view, 'ordering', self.ordering)
+        if isinstance(ordering, str):
+            return (ordering, )
+        return tuple(ordering)
@@ -0,0 +1,128 @@
+'''
+Columnar JSON, a compact encoding of API responses.
+
+Clients ask for it with `Accept: application/vnd.dsdvr.columnar+json`, or
+?format=columnar. Lists of objects (the guide, the library) repeat every
+field name in every object, and many values (channel names, categories,
+ratings, image ids) in many objects. Columnar JSON sends each field name once,
+the values of a field together, and repeated strings once:
+
+    {"strings": ["TV-G", "Comedy"], "data": ...}
+
+data is the response, with values encoded as follows:
+
+ - a list of objects is a table, {"$rows": 2, "$columns": {name: column}}.
+   Fields absent from some objects are null in those rows, and the rows are
+   listed in "$absent": {name: [1]} (omitted when all objects have all
+   fields).
+ - an object is an object, with its values encoded.
+ - anything else is itself.
+
+A column is a list of the field's values, one per row, unless it is one of:
+
+ - {"$strings": [0, 1, 0]}, indexes into strings (null stays null). Used for
+   columns of strings that repeat.
+ - {"$table": table}, a column of objects.
+ - {"$lengths": [2, 0, 1], "$items": column}, a column of lists. $items is
+   a column of the items of all lists, one after the other.
+
+For example, [{"rating": "TV-G", "categories": ["Comedy"]}, {"rating":
+"TV-G", "categories": []}]:
+
+    {"$rows": 2, "$columns": {
+        "rating": {"$strings": [0, 0]},
+        "categories": {"$lengths": [1, 0], "$items": ["Comedy"]}}}
+'''
+
+from rest_framework.renderers import JSONRenderer
+
+
+class _Encoder(object):
+    def __init__(self):
+        self.strings = []
+        self.indexes = {}
+
+    def _string(self, value):
+        index = self.indexes.get(value)
+        if index is None:
+            index = self.indexes[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def table(self, rows):
+        names = {}
+        for row in rows:
+            names.update(dict.fromkeys(row))
+
+        table = {
+            '$rows': len(rows),
+            '$columns': {
+                name: self.column([row.get(name) for row in rows])
+                for name in names},
+        }
+
+        absent = {}
+        for name in names:
+            indexes = [i for i, row in enumerate(rows) if name not in row]
+            if indexes:
+                absent[name] = indexes
+        if absent:
+            table['$absent'] = absent
+
+        return table
+
+    def column(self, values):
+        present = [value for value in values if value is not None]
+
+        if not present:
+            return values
+
+        if all(isinstance(value, dict) for value in present) and \
+           len(present) == len(values):
+            return {'$table': self.table(values)}
+
+        if all(isinstance(value, list) for value in present) and \
+           len(present) == len(values):
+            return {
+                '$lengths': [len(value) for value in values],
+                '$items': self.column(
+                    [item for value in values for item in value]),
+            }
+
+        if all(isinstance(value, str) for value in present):
+            # Unique strings are smaller as they are.
+            if len(set(present)) * 2 <= len(present):
+                return {'$strings': [
+                    None if value is None else self._string(value)
+                    for value in values]}
+
+        return [self.value(value) for value in values]
+
+    def value(self, value):
+        if isinstance(value, list):
+            if value and all(isinstance(item, dict) for item in value):
+                return self.table(value)
+            return [self.value(item) for item in value]
+
+        elif isinstance(value, dict):
+            return {name: self.value(item) for name, item in value.items()}
+
+        return value
+
+
+def encode(data):
+    encoder = _Encoder()
+    data = encoder.value(data)
+    return {'strings': encoder.strings, 'data': data}
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    media_type = 'application/vnd.dsdvr.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return super().render(
+            encode(data), accepted_media_type, renderer_context)
@@ -0,0 +1,282 @@
+'''
+Full text search over Programs and Media.
+
+Each indexed Program and Media has a SearchDocument. Its title, subtitle,
+description, actors and categories are kept in the api_search FTS5 table,
+under the document's id. Documents are indexed by the code that changes
+them:
+
+ - guide imports, the Programs they touched (api.tasks.guide).
+ - recordings, the Media they create (api.tasks.recordings).
+ - metadata fetches (api.tasks.metadata).
+
+Bulk deletes remove the documents of what they delete (retention, see
+api.tasks.retention). TaskSearchIndex (api.tasks.search) removes those of
+anything else deleted, indexes what is missing, or rebuilds the index. Search
+results skip objects deleted meanwhile.
+
+FTS5 is an SQLite extension. Other databases, or an SQLite without FTS5, fall
+back to matching titles with LIKE, which is slow.
+'''
+
+import re
+import uuid
+import logging
+
+from django.db import connection
+from django.db.models import Q
+from django.db.transaction import atomic
+
+from api.models import (
+    Program, Media, ProgramActor, MediaActor, SearchDocument,
+)
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+TABLE = 'api_search'
+COLUMNS = ('title', 'subtitle', 'description', 'actors', 'categories')
+# Created by migration 0005_search. bm25() weight of each column.
+WEIGHTS = (10.0, 5.0, 1.0, 3.0, 2.0)
+# Rows per query, below SQLite's limit of 999 variables.
+CHUNK_SIZE = 500
+
+KINDS = {
+    name: kind for kind, name in SearchDocument.KIND_NAMES.items()
+}
+
+_available = False
+
+
+def chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def available():
+    '''
+    Is the full text index in this database?
+    '''
+    global _available
+
+    if not _available and connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND "
+                "name = %s", [TABLE])
+            _available = cursor.fetchone() is not None
+
+    return _available
+
+
+def match_query(text):
+    '''
+    An FTS5 query matching documents with all the words of text, the last
+    may be incomplete (as typed). Returns None if text has no words.
+    '''
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+
+    return ' '.join('"%s"' % word for word in words) + '*'
+
+
+def _names(through, field, name, pks):
+    names = {}
+    for pk, value in through.objects.filter(**{
+            '%s__in' % field: pks}).values_list(field, name):
+        names.setdefault(pk, []).append(value)
+    return names
+
+
+def _program_rows(pks):
+    actors = _names(ProgramActor, 'program_id', 'person__name', pks)
+    categories = _names(
+        Program.categories.through, 'program_id', 'category__name', pks)
+
+    for pk, title, subtitle, desc in Program.objects.filter(
+            pk__in=pks).values_list('pk', 'title', 'subtitle', 'desc'):
+        yield pk, (
+            title, subtitle, desc, ' '.join(actors.get(pk, ())),
+            ' '.join(categories.get(pk, ())))
+
+
+def _media_rows(pks):
+    actors = _names(MediaActor, 'media_id', 'person__name', pks)
+    categories = _names(
+        Media.categories.through, 'media_id', 'category__name', pks)
+
+    for pk, title, subtitle, desc in Media.objects.filter(
+            pk__in=pks).values_list('pk', 'title', 'subtitle', 'desc'):
+        yield pk, (
+            title, subtitle, desc, ' '.join(actors.get(pk, ())),
+            ' '.join(categories.get(pk, ())))
+
+
+def _documents(kind, pks):
+    '''
+    Document ids of the given objects, creating missing documents.
+    '''
+    documents = dict(SearchDocument.objects.filter(
+        kind=kind, object_id__in=pks).values_list('object_id', 'id'))
+
+    missing = [pk for pk in pks if pk not in documents]
+    if missing:
+        SearchDocument.objects.bulk_create([
+            SearchDocument(kind=kind, object_id=pk) for pk in missing])
+        documents.update(SearchDocument.objects.filter(
+            kind=kind, object_id__in=missing).values_list('object_id', 'id'))
+
+    return documents
+
+
+def _index(kind, rows):
+    rows = dict(rows)
+    if not rows:
+        return
+
+    with atomic(immediate='search'):
+        documents = _documents(kind, list(rows))
+        ids = [documents[pk] for pk in rows]
+
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (
+                TABLE, ', '.join(['%s'] * len(ids))), ids)
+            cursor.executemany(
+                'INSERT INTO %s (rowid, %s) VALUES (%s)' % (
+                    TABLE, ', '.join(COLUMNS),
+                    ', '.join(['%s'] * (len(COLUMNS) + 1))),
+                [(documents[pk], ) + tuple(v or '' for v in values)
+                 for pk, values in rows.items()])
+
+
+def index_programs(pks):
+    '''
+    Add Programs to the index, or update them.
+    '''
+    if not available():
+        return
+
+    for chunk in chunks(pks):
+        _index(SearchDocument.KIND_PROGRAM, _program_rows(chunk))
+
+
+def index_media(pks):
+    '''
+    Add Media to the index, or update them.
+    '''
+    if not available():
+        return
+
+    for chunk in chunks(pks):
+        _index(SearchDocument.KIND_MEDIA, _media_rows(chunk))
+
+
+def remove(kind, pks):
+    if not available():
+        return
+
+    for chunk in chunks(pks):
+        with atomic(immediate='search'):
+            documents = SearchDocument.objects.filter(
+                kind=kind, object_id__in=chunk)
+            ids = list(documents.values_list('id', flat=True))
+            if not ids:
+                continue
+
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (
+                    TABLE, ', '.join(['%s'] * len(ids))), ids)
+            documents.delete()
+
+
+def update(full=False, progress=None):
+    '''
+    Index Programs and Media that are not, and remove documents of deleted
+    ones. With full, rebuild the index.
+    '''
+    if not available():
+        return
+
+    if full:
+        with atomic(immediate='search'):
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM %s' % TABLE)
+            SearchDocument.objects.all().delete()
+
+    for kind, model, index in (
+            (SearchDocument.KIND_PROGRAM, Program, index_programs),
+            (SearchDocument.KIND_MEDIA, Media, index_media)):
+        indexed = SearchDocument.objects.filter(kind=kind)
+        remove(kind, list(indexed.exclude(
+            object_id__in=model.objects.values('pk')).values_list(
+                'object_id', flat=True)))
+
+        pks = list(model.objects.exclude(
+            pk__in=indexed.values('object_id')).values_list('pk', flat=True))
+        for i, chunk in enumerate(chunks(pks)):
+            index(chunk)
+            if progress is not None:
+                progress(kind, i * CHUNK_SIZE + len(chunk), len(pks))
+
+
+def _fallback(text, kind, limit, offset):
+    q = Q()
+    for word in re.findall(r'\w+', text):
+        q &= Q(title__icontains=word) | Q(subtitle__icontains=word)
+
+    count, results = 0, []
+    for model_kind, model in (
+            (SearchDocument.KIND_PROGRAM, Program),
+            (SearchDocument.KIND_MEDIA, Media)):
+        if kind not in (None, model_kind):
+            continue
+
+        queryset = model.objects.filter(q).order_by('title')
+        total = queryset.count()
+        start, stop = max(offset - count, 0), offset + limit - count
+        if stop > 0 and start < total:
+            results.extend(
+                (model_kind, pk, 0.0)
+                for pk in queryset.values_list('pk', flat=True)[start:stop])
+        count += total
+
+    return count, results
+
+
+def search(text, kind=None, limit=20, offset=0):
+    '''
+    Returns the number of matches, and a page of (kind, object id, rank),
+    best first. A lower rank is a better match.
+    '''
+    if not re.search(r'\w', text):
+        return 0, []
+
+    if not available():
+        return _fallback(text, kind, limit, offset)
+
+    where, params = '%s MATCH %%s' % TABLE, [match_query(text)]
+    if kind is not None:
+        where += ' AND d.kind = %s'
+        params.append(kind)
+
+    join = 'FROM %s JOIN %s d ON d.id = %s.rowid WHERE %s' % (
+        TABLE, SearchDocument._meta.db_table, TABLE, where)
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT count(*) %s' % join, params)
+        count = cursor.fetchone()[0]
+
+        cursor.execute(
+            'SELECT d.kind, d.object_id, bm25(%s, %s) AS rank %s '
+            'ORDER BY rank LIMIT %%s OFFSET %%s' % (
+                TABLE, ', '.join(map(str, WEIGHTS)), join),
+            params + [limit, offset])
+        results = [
+            (kind, uuid.UUID(object_id), rank)
+            for kind, object_id, rank in cursor.fetchall()]
+
+    return count, results
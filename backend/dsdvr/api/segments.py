@@ -0,0 +1,281 @@
+'''
+Segmented media storage.
+
+A recording is stored as a sequence of numbered chunks next to an index file
+that lists them in order. When a capture is interrupted and restarted, a new
+chunk is started rather than appending to the old one, which keeps the mpegts
+packet alignment of each chunk intact.
+
+The chunks are never concatenated on disk. Readers use SegmentReader, which
+presents them as a single logical file, and ffmpeg is handed the concat:
+protocol.
+
+An index entry may also refer to a byte range of a chunk that belongs to
+another recording. This is how back-to-back recordings on one channel share a
+single capture, each program gets an index of byte offset markers into the
+shared chunks.
+
+Media recorded before segmented storage has no index, in which case the media
+path itself is the one and only chunk.
+'''
+
+import io
+import os
+import json
+import logging
+
+from os.path import join as pathjoin
+from os.path import basename, dirname, isfile, getsize, relpath, normpath
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+INDEX_SUFFIX = '.index'
+
+
+def exists(path):
+    '''
+    Returns True if there is any media stored for the given media path.
+    '''
+    return isfile(path + INDEX_SUFFIX) or isfile(path)
+
+
+class SegmentIndex(object):
+    '''
+    The list of chunks that make up a media path.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+
+    def exists(self):
+        return isfile(self.index_path)
+
+    def load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+
+        except FileNotFoundError:
+            return []
+
+    def save(self, entries):
+        # Write then rename so readers never see a partial index.
+        temp_path = '%s.tmp' % self.index_path
+        with open(temp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(temp_path, self.index_path)
+
+    def next_chunk(self):
+        '''
+        Append a new chunk to the index and return its absolute path.
+        '''
+        entries = self.load()
+        name = '%s.%03i' % (basename(self.path), len(entries))
+        entries.append({'path': name})
+        self.save(entries)
+        return pathjoin(dirname(self.path), name)
+
+    def link(self, path, start):
+        '''
+        Append a byte range of another recording's chunk, starting at `start`
+        and running until seal() is called.
+
+        The chunk is hard linked into our directory where possible, so either
+        recording can be deleted without breaking the other.
+        '''
+        entries = self.load()
+        name = '%s.%03i' % (basename(self.path), len(entries))
+
+        try:
+            os.link(path, pathjoin(dirname(self.path), name))
+
+        except OSError as e:
+            LOGGER.warning('Could not hard link %s: %s', path, e)
+            name = relpath(path, dirname(self.path))
+
+        entries.append({'path': name, 'start': start})
+        self.save(entries)
+
+    def seal(self):
+        '''
+        Mark the end of the last chunk at its current size. Used when a
+        recording ends but the capture writing the chunk continues.
+        '''
+        entries = self.load()
+        if not entries or entries[-1].get('stop') is not None:
+            return
+
+        try:
+            entries[-1]['stop'] = getsize(self.current())
+
+        except OSError:
+            return
+
+        self.save(entries)
+
+    def current(self):
+        '''
+        Returns the absolute path of the last chunk, the one being written.
+        '''
+        chunks = self.chunks()
+        if chunks:
+            return chunks[-1][0]
+
+    def chunks(self):
+        '''
+        Returns (path, start, stop) for all chunks in order. Paths are
+        absolute, stop is None for "until the end of the file".
+        '''
+        if not self.exists():
+            return [(self.path, 0, None)] if isfile(self.path) else []
+
+        parent = dirname(self.path)
+        return [
+            (normpath(pathjoin(parent, entry['path'])),
+             entry.get('start', 0), entry.get('stop'))
+            for entry in self.load()
+        ]
+
+    def size(self):
+        size = 0
+        for path, start, stop in self.chunks():
+            size += _range_size(path, start, stop)
+        return size
+
+    def ffmpeg_input(self):
+        '''
+        Returns a value suitable for ffmpeg's -i option.
+        '''
+        inputs = []
+        for path, start, stop in self.chunks():
+            if start or stop is not None:
+                # An end of 0 means the end of the file.
+                path = 'subfile,,start,%i,end,%i,,:%s' % (
+                    start, stop or 0, path)
+            inputs.append(path)
+
+        if not inputs:
+            return self.path
+
+        elif len(inputs) == 1:
+            return inputs[0]
+
+        # mpegts can be joined byte for byte.
+        return 'concat:%s' % '|'.join(inputs)
+
+
+def _range_size(path, start, stop):
+    try:
+        size = getsize(path)
+
+    except OSError:
+        return 0
+
+    if stop is not None:
+        size = min(size, stop)
+
+    return max(size - start, 0)
+
+
+class SegmentReader(io.RawIOBase):
+    '''
+    Read-only, seekable file object spanning all chunks of a media path.
+
+    Chunk sizes are re-read whenever a read reaches the known end, so a
+    recording that is still being written can be followed.
+    '''
+
+    def __init__(self, path):
+        super().__init__()
+        self.index = SegmentIndex(path)
+        self.name = path
+        self._chunks = []
+        self._pos = 0
+        self._file = None
+        self._file_path = None
+        self._refresh()
+
+    def _refresh(self):
+        self._chunks = [
+            (path, start, _range_size(path, start, stop))
+            for path, start, stop in self.index.chunks()
+        ]
+
+    def _locate(self, pos):
+        '''
+        Return (path, offset, remaining) for a logical position, or
+        (None, 0, 0) at EOF. Offset is within the chunk file.
+        '''
+        logical = 0
+        for path, start, size in self._chunks:
+            if pos < logical + size:
+                offset = pos - logical
+                return path, start + offset, size - offset
+            logical += size
+        return None, 0, 0
+
+    def size(self):
+        self._refresh()
+        return sum(size for _, _, size in self._chunks)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+
+        elif whence == io.SEEK_END:
+            pos = self.size() + offset
+
+        else:
+            raise ValueError('Invalid whence: %s' % whence)
+
+        if pos < 0:
+            raise ValueError('Negative seek position: %i' % pos)
+
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        path, offset, remaining = self._locate(self._pos)
+
+        if path is None:
+            # Chunks may have grown, or a new one started, since we looked.
+            self._refresh()
+            path, offset, remaining = self._locate(self._pos)
+
+            if path is None:
+                return 0
+
+        if path != self._file_path:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(path, 'rb')
+            self._file_path = path
+
+        # Never read past the end of a byte range.
+        view = memoryview(b)[:remaining]
+        self._file.seek(offset)
+        read = self._file.readinto(view)
+        self._pos += read
+        return read
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
@@ -1,11 +1,13 @@
+import json
 import logging
 import os.path
 
 from collections import OrderedDict
+from datetime import timedelta
 
 from django.utils import timezone
-from django.db import models
-from django.db.transaction import atomic
+from django.db.models import Prefetch
+from django.db.transaction import atomic, on_commit
 from django.urls import reverse, resolve, Resolver404
 
 from rest_framework import serializers
@@ -13,10 +15,12 @@ from drf_queryfields import QueryFieldsMixin
 
 from api.models import (
     Show, Recording, Program, Channel, Tuner, Device, Rating, Category, Movie,
-    Stream, Media, Series, Person, DeviceCursor, User, Image,
+    Stream, Media, Series, Person, DeviceCursor, User, Image, Rule,
+    Schedule,
 )
 from api.tasks import STATUS_NAMES
 from api.tasks.recordings import TaskRecordingManager
+from api.tasks.rules import TaskRuleEvaluate
 
 
 LOGGER = logging.getLogger(__name__)
@@ -39,18 +43,13 @@ class DisplayChoiceField(serializers.ChoiceField):
 class ProgramRelatedField(serializers.ModelSerializer):
     class Meta:
         model = Program
-        fields = ('id', 'title', 'start', 'stop', 'duration', 'poster',
-                  'previously_shown', 'channel', 'season', 'episode',
-                  'category', 'rating')
-        read_only_fields = ('title', 'start', 'stop', 'duration', 'poster',
-                            'previously_shown', 'channel', 'season', 'episode',
-                            'category', 'rating')
+        fields = ('id', 'title', 'subtitle', 'poster', 'previously_shown',
+                  'season', 'episode', 'categories')
+        read_only_fields = ('title', 'subtitle', 'poster', 'previously_shown',
+                            'season', 'episode', 'categories')
 
-    channel = serializers.StringRelatedField(read_only=True)
-    category = serializers.SlugRelatedField(
-        read_only=True, slug_field='name')
-    rating = serializers.SlugRelatedField(
-        read_only=True, slug_field='name')
+    categories = serializers.SlugRelatedField(
+        many=True, read_only=True, slug_field='name')
 
 
 class MediaRelatedField(serializers.ModelSerializer):
@@ -67,14 +66,15 @@ class MediaRelatedField(serializers.ModelSerializer):
         read_only=True, slug_field='name')
 
 
-class ShowSerializer(serializers.ModelSerializer):
+class ShowSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Show
         fields = '__all__'
         read_only_fields = ('id', 'path')
 
     rating = serializers.SlugRelatedField(read_only=True, slug_field='name')
-    category = serializers.SlugRelatedField(read_only=True, slug_field='name')
+    categories = serializers.SlugRelatedField(
+        many=True, read_only=True, slug_field='name')
     type = DisplayChoiceField(
         choices=list(Show.TYPE_NAMES.items()), read_only=True)
     path = serializers.SerializerMethodField()
@@ -83,14 +83,15 @@ class ShowSerializer(serializers.ModelSerializer):
         return obj.abs_path
 
 
-class MovieSerializer(serializers.ModelSerializer):
+class MovieSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Movie
         fields = '__all__'
         read_only_fields = ('id', 'path')
 
     rating = serializers.SlugRelatedField(read_only=True, slug_field='name')
-    category = serializers.SlugRelatedField(read_only=True, slug_field='name')
+    categories = serializers.SlugRelatedField(
+        many=True, read_only=True, slug_field='name')
     type = DisplayChoiceField(
         choices=list(Show.TYPE_NAMES.items()), read_only=True)
     path = serializers.SerializerMethodField()
@@ -99,58 +100,141 @@ class MovieSerializer(serializers.ModelSerializer):
         return obj.abs_path
 
 
-class SeriesSerializer(serializers.ModelSerializer):
+class SeriesSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Series
         fields = '__all__'
         read_only_fields = ('id', 'path')
 
     rating = serializers.SlugRelatedField(read_only=True, slug_field='name')
-    category = serializers.SlugRelatedField(read_only=True, slug_field='name')
+    categories = serializers.SlugRelatedField(
+        many=True, read_only=True, slug_field='name')
     type = DisplayChoiceField(
         choices=list(Show.TYPE_NAMES.items()), read_only=True)
 
 
-class RecordingSerializer(serializers.ModelSerializer):
+class MediaSerializer(QueryFieldsMixin, serializers.ModelSerializer):
+    '''
+    Uses proper serializer for media type.
+    '''
+    class Meta:
+        model = Media
+        fields = '__all__'
+        read_only_fields = ('id', 'path')
+
+    serializer_classes = {
+        Media.TYPE_SHOW: ('show', ShowSerializer),
+        Media.TYPE_MOVIE: ('movie', MovieSerializer),
+        Media.TYPE_SERIES: ('series', SeriesSerializer),
+    }
+
+    # What the serializer of each subtype reads, besides rating.
+    subtype_prefetches = {
+        'show': (Show, ('categories', 'actors', 'images', 'series')),
+        'movie': (Movie, ('categories', 'actors', 'images')),
+        'series': (Series, ('categories', 'actors', 'images')),
+    }
+
+    @classmethod
+    def prefetches(cls, prefix=''):
+        '''
+        Prefetch the subtype of Media, and what its serializer reads. Each
+        subtype is a query (and one per related list) for the whole list of
+        Media, rather than queries per Media. prefix is the path to the Media,
+        for Media related to the listed objects.
+        '''
+        return [
+            Prefetch(prefix + name, queryset=model.objects.select_related(
+                'rating').prefetch_related(*lookups))
+            for name, (model, lookups) in cls.subtype_prefetches.items()]
+
+    @classmethod
+    def prefetch(cls, queryset):
+        '''
+        Load what the serializer reads, for a list of Media.
+        '''
+        return queryset.prefetch_related(*cls.prefetches())
+
+    path = serializers.SerializerMethodField()
+
+    def get_path(self, obj):
+        return obj.abs_path
+
+    def _get_serializer(self, type):
+        # One per type, building a serializer's fields costs more than
+        # serializing an object with them.
+        serializers = self.__dict__.setdefault('_serializers', {})
+        if type not in serializers:
+            attrname, serializer_class = self.serializer_classes[type]
+            # Fields are selected (?fields=) of the Media listed, not of Media
+            # nested in the objects listed.
+            context = self.context if self.root in (self, self.parent) else {}
+            serializers[type] = (attrname, serializer_class(context=context))
+        return serializers[type]
+
+    def to_representation(self, data):
+        attrname, serializer = self._get_serializer(data.type)
+        return serializer.to_representation(getattr(data, attrname))
+
+
+class RecordingSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Recording
-        fields = ('id', 'start', 'stop', 'status', 'show', 'program', 'pid')
-        read_only_fields = ('id', 'status', 'pid')
+        fields = ('id', 'start', 'stop', 'status', 'media', 'program',
+                  'channel', 'pid', 'padding_start', 'padding_stop', 'health')
+        read_only_fields = ('id', 'status', 'pid', 'health')
         extra_kwargs = {
             'start': {'required': False},
             'stop': {'required': False},
         }
 
-    show = ShowSerializer(read_only=True)
+    media = MediaSerializer(read_only=True)
     status = DisplayChoiceField(
         choices=list(Recording.STATUS_NAMES.items()), read_only=True)
     program = ProgramRelatedField()
+    channel = serializers.StringRelatedField(read_only=True)
+    health = serializers.SerializerMethodField()
+
+    @staticmethod
+    def prefetch(queryset):
+        '''
+        Load what the serializer reads, for a list of Recordings.
+        '''
+        return queryset \
+            .select_related('program', 'channel', 'media') \
+            .prefetch_related(
+                'program__categories', *MediaSerializer.prefetches('media__'))
+
+    def get_health(self, obj):
+        # Output metrics sampled by the recording watchdog.
+        if obj.health is not None:
+            return json.loads(obj.health)
 
     def _validate_tuner(self, data):
-        # Find out what is recording during this time slot.
-        start, stop = data['start'], data['stop']
-        q1 = models.Q(
-            channels__programs__recording__start__gt=start,
-            channels__programs__recording__start__lt=stop)
-        q2 = models.Q(
-            channels__programs__recording__stop__gt=start,
-            channels__programs__recording__stop__lt=stop)
-        tuners = Tuner.objects.filter(q1 | q2) \
-            .values_list('id', 'tuner_count')
+        # Find out what is recording during this time slot. Recordings on
+        # the same channel share a capture, so do not use another tuner.
+        start, stop, channel = data['start'], data['stop'], data['channel']
+        tuners = Recording.objects.filter(
+            start__lt=stop, stop__gt=start, channel__isnull=False) \
+            .exclude(channel=channel) \
+            .values_list(
+                'channel__tuner_id', 'channel__tuner__tuner_count',
+                'channel_id') \
+            .distinct()
 
         if not tuners:
             return
 
         # Get the tuner id that will be used for the requested recording.
-        tuner_id = data['program'].channel.tuner_id
+        tuner_id = channel.tuner_id
 
-        # Holds recording count for each tuner.    
+        # Holds recording count for each tuner.
         trecs = {
             # Account for the recording we are trying to create.
             tuner_id: 1,
         }
 
-        for id, tcount in tuners:
+        for id, tcount, _ in tuners:
             # Count recordings on the tuners.
             trec = trecs[id] = trecs.get(id, 0) + 1
 
@@ -161,11 +245,24 @@ class RecordingSerializer(serializers.ModelSerializer):
                     'of them in use at the requested time.' % (id, tcount))
 
     def validate(self, data):
-        # Define start and stop from show if not provided.
+        # The program's next airing, as rules choose (the earliest).
+        schedule = data['program'].schedules \
+            .filter(stop__gt=timezone.now()) \
+            .select_related('channel').order_by('start').first()
+
+        if schedule is None:
+            raise serializers.ValidationError('Program has ended')
+
+        # Recordings on a channel can share its capture.
+        data['channel'] = schedule.channel
+
+        # Define start and stop from the airing if not provided.
         if 'start' not in data:
-            data['start'] = data['program'].start
+            data['start'] = schedule.start - timedelta(
+                seconds=data.get('padding_start', 0))
         if 'stop' not in data:
-            data['stop'] = data['program'].stop
+            data['stop'] = schedule.stop + timedelta(
+                seconds=data.get('padding_stop', 0))
 
         # Validate start and stop times.
         if data['start'] >= data['stop']:
@@ -187,6 +284,10 @@ class RecordingSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Invalid program.id: %s' % data['program.id'])
 
+        for name in ('padding_start', 'padding_stop'):
+            if name in data:
+                ret[name] = self.fields[name].run_validation(data[name])
+
         return ret
 
     @atomic
@@ -199,36 +300,63 @@ class RecordingSerializer(serializers.ModelSerializer):
         return recording
 
 
-class ProgramSerializer(serializers.ModelSerializer):
+class ProgramSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Program
         fields = '__all__'
         read_only_fields = ('id', )
 
     recording = serializers.PrimaryKeyRelatedField(read_only=True)
-    rating = serializers.SlugRelatedField(read_only=True, slug_field='name')
-    category = serializers.SlugRelatedField(read_only=True, slug_field='name')
+    categories = serializers.SlugRelatedField(
+        many=True, read_only=True, slug_field='name')
 
 
-class GuideSerializer(serializers.ModelSerializer):
+class GuideProgramSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Channel
-        fields = '__all__'
+        model = Program
+        fields = ('id', 'program_id', 'title', 'subtitle', 'desc', 'season',
+                  'episode', 'previously_shown', 'poster', 'recording',
+                  'categories')
 
-    programs = serializers.SerializerMethodField()
+    recording = serializers.PrimaryKeyRelatedField(read_only=True)
+    categories = serializers.SlugRelatedField(
+        source='category_list', many=True, read_only=True, slug_field='name')
 
-    def get_programs(self, obj):
-        # TODO: add filtering.
-        queryset = Program.objects.get_upcoming()
-        queryset = queryset.filter(channel=obj)
 
-        serializer = ProgramSerializer(instance=queryset, many=True)
-        return serializer.data
+class ScheduleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Schedule
+        fields = ('id', 'start', 'stop', 'duration', 'rating', 'program')
+
+    rating = serializers.SlugRelatedField(read_only=True, slug_field='name')
+    program = GuideProgramSerializer(read_only=True)
+
+    @staticmethod
+    def prefetch(queryset):
+        '''
+        Load what the serializer reads, for a list of Schedules.
+        '''
+        # Into a list, Django builds a filtered queryset per Program to hold
+        # the prefetched objects of a many to many relation otherwise, which
+        # costs more than the query.
+        return queryset \
+            .select_related('rating', 'program__recording') \
+            .prefetch_related(Prefetch(
+                'program__categories', to_attr='category_list'))
+
+
+class GuideSerializer(QueryFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Channel
+        fields = '__all__'
+
+    # GuideViewSet prefetches them, for the whole page.
+    programs = ScheduleSerializer(source='upcoming', many=True, read_only=True)
 
 
 class TaskSerializer(serializers.Serializer):
     '''
-    Serializer for ephemeral tasks.
+    Serializer for Tasks, and the Jobs that represent them.
     '''
 
     id = serializers.UUIDField()
@@ -244,67 +372,42 @@ class TaskSerializer(serializers.Serializer):
     remaining = serializers.IntegerField()
 
     def get_name(self, obj):
-        return obj.__class__.__name__
-
-
-class MediaSerializer(serializers.ModelSerializer):
-    '''
-    Uses proper serializer for media type.
-    '''
-    class Meta:
-        model = Media
-        fields = '__all__'
-        read_only_fields = ('id', 'path')
-
-    serializer_classes = {
-        Media.TYPE_SHOW: ('show', ShowSerializer),
-        Media.TYPE_MOVIE: ('movie', MovieSerializer),
-        Media.TYPE_SERIES: ('series', SeriesSerializer),
-    }
-
-    path = serializers.SerializerMethodField()
-
-    def get_path(self, obj):
-        return obj.abs_path
-
-    def to_representation(self, data):
-        attrname, serializer_class = self.serializer_classes[data.type]
-        return serializer_class(getattr(data, attrname)).data
+        return obj.name
 
 
 class GuideUploadSerializer(serializers.Serializer):
     file = serializers.FileField()
 
 
-class TunerSerializer(serializers.ModelSerializer):
+class TunerSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Tuner
         fields = '__all__'
         read_only_fields = ('id',)
 
 
-class DeviceSerializer(serializers.ModelSerializer):
+class DeviceSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Device
         fields = '__all__'
         read_only_fields = ('id',)
 
 
-class PersonSerializer(serializers.ModelSerializer):
+class PersonSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Person
         fields = '__all__'
         read_only_fields = ('id',)
 
 
-class RatingSerializer(serializers.ModelSerializer):
+class RatingSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Rating
         fields = '__all__'
         read_only_fields = ('id',)
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
@@ -329,7 +432,7 @@ class CursorField(serializers.DecimalField):
         return {'cursor': value}
 
 
-class StreamSerializer(serializers.ModelSerializer):
+class StreamSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Stream
         fields = '__all__'
@@ -396,7 +499,7 @@ class StreamSerializer(serializers.ModelSerializer):
         dc.update(cursor=cursor)
 
 
-class SeriesSerializer(serializers.ModelSerializer):
+class SeriesSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Series
         fields = '__all__'
@@ -410,19 +513,64 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'email')
 
 
-class ChannelSerializer(serializers.ModelSerializer):
+class ChannelSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Channel
         fields = '__all__'
         read_only_fields = ('id',)
 
-    programs = serializers.SerializerMethodField()
+    # Annotated by ChannelViewSet.
+    programs = serializers.IntegerField(
+        source='program_count', read_only=True)
 
-    def get_programs(self, obj):
-        return Program.objects.filter(channel=obj).count()
 
-
-class ImageSerializer(serializers.ModelSerializer):
+class ImageSerializer(QueryFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Image
         fields = '__all__'
+
+
+class RuleSerializer(QueryFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Rule
+        fields = '__all__'
+        read_only_fields = ('id',)
+
+    def _get_value(self, data, name):
+        # Partial updates only provide changed fields.
+        if name in data:
+            return data[name]
+        return getattr(self.instance, name, None)
+
+    def validate(self, data):
+        criteria = ('series_id', 'title', 'channel')
+        if not any(self._get_value(data, name) for name in criteria):
+            raise serializers.ValidationError(
+                'One of series_id, title or channel is required')
+
+        if (self._get_value(data, 'start_time') is None) != \
+           (self._get_value(data, 'stop_time') is None):
+            raise serializers.ValidationError(
+                'Both start_time and stop_time are required for a window')
+
+        return data
+
+    @staticmethod
+    def _evaluate(rule):
+        # Once the rule is committed, the task may run in another process.
+        on_commit(TaskRuleEvaluate(kwargs={'rules': [rule.id]}).start)
+
+    @atomic
+    def create(self, validated_data):
+        rule = super().create(validated_data)
+
+        # Match the new rule against the existing guide data.
+        self._evaluate(rule)
+
+        return rule
+
+    @atomic
+    def update(self, instance, validated_data):
+        rule = super().update(instance, validated_data)
+        self._evaluate(rule)
+        return rule
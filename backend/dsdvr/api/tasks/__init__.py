@@ -1,5 +1,5 @@
 '''
-Ephemeral tasks.
+Tasks.
 
 Threads that perform functions within the django process. They report their
 status vi an API.
@@ -7,40 +7,51 @@ status vi an API.
 Tasks are started by other API endpoints to handle any work that cannot be
 completed during an HTTP request / response cycle (long running operations).
 
-They are ephemeral as they are not stored anywhere, the are spawned and then
-can be monitored or cancelled. However if the django process restarts, all
-threads stop and all the tasks are forgotten.
+Tasks are persisted as Jobs (see main.taskqueue) when enqueued, so queued
+work survives a restart of the django process. Tasks that fail are retried.
 '''
 
+import time
 import logging
+import hashlib
 import threading
 import uuid
 
 from datetime import datetime, timedelta
 
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.http import Http404
 from django.shortcuts import redirect
 from django.urls import reverse
 
-from main.schedule import TASK_QUEUE
+from main.models import Job, estimate
+from main.metrics import TASKS as TASK_RUNS, TASK_DURATION
+from main.profiling import PROFILES, profile_task
+from main.schedule import TASK_QUEUE, PROCESS_POOL
+from api.events import EVENTS, PROGRESS_INTERVAL
 
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
 LOGGER.addHandler(logging.NullHandler())
 
-# Data store.
-# TODO: locking?
-TASKS = {}
-
 STATUS_NONE = None
-STATUS_QUEUED = 1
-STATUS_RUNNING = 2
-STATUS_DONE = 0
-STATUS_ERROR = 3
-STATUS_TERMINATING = 4
-STATUS_TERMINATED = 5
+STATUS_QUEUED = Job.STATUS_QUEUED
+STATUS_RUNNING = Job.STATUS_RUNNING
+STATUS_DONE = Job.STATUS_DONE
+STATUS_ERROR = Job.STATUS_ERROR
+STATUS_TERMINATING = Job.STATUS_TERMINATING
+STATUS_TERMINATED = Job.STATUS_TERMINATED
+
+PRIORITY_HIGH = Job.PRIORITY_HIGH
+PRIORITY_NORMAL = Job.PRIORITY_NORMAL
+PRIORITY_LOW = Job.PRIORITY_LOW
+
+# Progress is recorded at most every UPDATE_INTERVAL seconds, unless it
+# advances by UPDATE_STEP percent.
+UPDATE_INTERVAL = 0.25
+UPDATE_STEP = 1
 
 STATUS_NAMES = {
     STATUS_NONE: 'none',
@@ -60,6 +71,87 @@ class TaskTerminationException(BaseException):
     pass
 
 
+class TaskStore(object):
+    '''
+    Tasks visible via the API.
+
+    Tasks enqueued by this process are returned as is, their progress is
+    current. All others are represented by their Job, as are all Tasks in
+    processes that do not run them (see main.taskqueue).
+    '''
+
+    def __init__(self):
+        self._live = {}
+
+    def __setitem__(self, key, task):
+        if TASK_QUEUE.serving:
+            self._live[key] = task
+
+    def __getitem__(self, key):
+        try:
+            return self._live[key]
+
+        except KeyError:
+            pass
+
+        try:
+            return Job.objects.get(id=key, background=False)
+
+        except (Job.DoesNotExist, ValidationError):
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        self._live.pop(key, None)
+        try:
+            Job.objects.filter(id=key).delete()
+
+        except ValidationError:
+            raise KeyError(key)
+
+    def values(self):
+        jobs = Job.objects.filter(background=False).order_by('created')
+        return [self._live.get(str(job.id), job) for job in jobs]
+
+    def purge(self, expiration):
+        '''
+        Forget finished Tasks and Jobs without activity since expiration.
+        '''
+        Job.objects.filter(
+            status__in=Job.STATUS_FINISHED, modified__lt=expiration).delete()
+
+        for task in list(self._live.values()):
+            if task.status in (STATUS_NONE, STATUS_DONE, STATUS_ERROR,
+                               STATUS_TERMINATED):
+
+                last_activity = task.modified or task.created
+                if last_activity >= expiration:
+                    continue
+
+                LOGGER.debug('Purging stale task id: %s', task.id)
+                self._live.pop(str(task.id), None)
+
+
+TASKS = TaskStore()
+
+
+def _key_part(value):
+    '''
+    Stable representation of a Task argument, model instances are
+    represented by their primary key.
+    '''
+    if hasattr(value, '_meta') and hasattr(value, 'pk'):
+        return '%s:%s' % (value._meta.label, value.pk)
+
+    elif isinstance(value, (list, tuple, set)):
+        return '[%s]' % ','.join(_key_part(v) for v in value)
+
+    elif isinstance(value, dict):
+        return '{%s}' % ','.join(
+            '%s=%s' % (k, _key_part(v)) for k, v in sorted(value.items()))
+
+    return repr(value)
+
+
 # TODO: move to main.
 class BaseTask(object):
     '''
@@ -68,6 +160,13 @@ class BaseTask(object):
     Refer to the docs of _run() for more details.
     '''
 
+    # Attempts before a failing Task is given up on.
+    max_attempts = Job.MAX_ATTEMPTS
+    # Recording control is PRIORITY_HIGH, guide data PRIORITY_LOW.
+    priority = PRIORITY_NORMAL
+    # CPU bound Tasks run _run() in a worker process (main.processpool).
+    process = False
+
     def __init__(self, args=None, kwargs=None, id=None):
         self.id = id or uuid.uuid4()
         self.args = args or ()
@@ -83,17 +182,46 @@ class BaseTask(object):
         self.elapsed = 0
         self.remaining = 0
         self.exit = threading.Event()
-        # Create a subclass-wide lock to lock all tasks of the same type.
-        self.__class__.lock = threading.Lock()
+        # Set when running in a worker process.
+        self.relay = None
+        self.background = False
+        # Set while running, when profiling (see main.profiling).
+        self.profile = None
+        self._next_update = 0
+
+    @property
+    def name(self):
+        return self.__class__.__name__
+
+    def dedup_key(self):
+        '''
+        Tasks with equal keys are duplicates. Enqueueing a Task while a
+        duplicate is queued returns the queued one, and duplicates never run
+        concurrently.
 
-    def enqueue(self, background=False):
-        TASK_QUEUE.put(self)
+        By default Tasks of the same type and arguments are duplicates. Return
+        None to allow duplicates.
+        '''
+        arguments = _key_part((self.args, self.kwargs)).encode('utf8')
+        return '%s.%s:%s' % (
+            self.__class__.__module__, self.__class__.__qualname__,
+            hashlib.sha1(arguments).hexdigest()[:16])
 
+    def enqueue(self, background=False):
         self.status = STATUS_QUEUED
         self._set_progress(0, 1, 'Awaiting execution.')
 
-        if not background:
+        self.background = background
+        id = TASK_QUEUE.put(self, background=background)
+
+        if id != self.id:
+            # Coalesced into a duplicate.
+            LOGGER.debug('%s coalesced into %s', self.name, id)
+            self.id = id
+
+        elif not background:
             TASKS[str(self.id)] = self
+            self._publish(force=True)
 
         return redirect(reverse('tasks-detail', kwargs={'pk': str(self.id)}))
 
@@ -105,6 +233,7 @@ class BaseTask(object):
         '''
         self.status = STATUS_TERMINATING
         self.exit.set()
+        TASK_QUEUE.stop(self.id)
 
     def _check_exit(self):
         '''
@@ -118,33 +247,36 @@ class BaseTask(object):
         '''
         Calculate runtime stats. Useful for progress notification.
         '''
-        percent = elapsed = remaining = 0
-
-        if self.total:
-            percent = int(self.done / self.total * 100)
-
-        if self.created:
-            # If the task has been started, calculate how many seconds it has
-            # been running.
-            elapsed = (timezone.now() - self.created).total_seconds()
-
-            # Then use the percentage of completion to determine how much more
-            # runtime remains.
-            if percent:
-                # If percentage of completion is 0, then estimate the remaining
-                # runtime by rounding percent up to 1%.
-                at_least_one = max(percent, 1)
-                remaining = elapsed / at_least_one * (100 - at_least_one)
-
-        self.percent = percent
-        self.elapsed = elapsed
-        self.remaining = remaining
+        self.percent, self.elapsed, self.remaining = estimate(
+            self.done, self.total, self.created)
 
     def _set_progress(self, done, total, summary=None):
         '''
         To be called by _run() implementation periodically to provide progress
         notification.
+
+        It is cheap to call for every item processed. Progress is recorded in
+        batches (see UPDATE_INTERVAL), immediately when the summary or the
+        total changes or the Task completes. Passing the same summary on every
+        call is batched too. Cancellation is checked on
+        every call.
         '''
+        # Check if this task has been cancelled and exit if so.
+        self._check_exit()
+
+        if summary in (None, self.summary) and done < total and \
+           total == self.total and \
+           (done - self.done) * 100 < total * UPDATE_STEP and \
+           time.monotonic() < self._next_update:
+            return
+
+        self._next_update = time.monotonic() + UPDATE_INTERVAL
+        self._update_progress(done, total, summary)
+
+        if self.relay is not None:
+            self.relay.progress(done, total, summary)
+
+    def _update_progress(self, done, total, summary=None):
         self.done = done
         self.total = total
         self.modified = timezone.now()
@@ -154,24 +286,50 @@ class BaseTask(object):
         if summary is not None:
             self.summary = summary
 
+            if self.profile is not None:
+                self.profile.phase(summary)
+
         # Calculate some stats.
         self._estimate()
 
-        # Check if this task has been cancelled and exit if so.
-        self._check_exit()
+        self._publish()
 
-    def run(self):
+    def _publish(self, force=False):
         '''
-        Entry point for Task thread.
+        Publish the Task's state. Progress is rate limited, status changes
+        should be published with force.
         '''
-        if not self.lock.acquire(False):
-            LOGGER.debug('Metadata fetch lock acquisition failed')
+        if self.background:
+            return
+
+        # Only running Tasks make progress.
+        if not force and self.status != STATUS_RUNNING:
+            return
+
+        key = 'task:%s' % self.id
+        if not EVENTS.wants(key, 0 if force else PROGRESS_INTERVAL):
             return
 
+        from api.serializers import TaskSerializer
+
+        EVENTS.publish('task', TaskSerializer(self).data)
+
+    def run(self):
+        '''
+        Entry point for Task thread.
+        '''
+        started = time.monotonic()
         try:
             self.status = STATUS_RUNNING
+            self._publish(force=True)
+            self.profile = profile_task(self)
             try:
-                self._run(*self.args, **self.kwargs)
+                if self.process:
+                    PROCESS_POOL.run(self)
+
+                else:
+                    self._run(*self.args, **self.kwargs)
+
                 self.status = STATUS_DONE
 
             except TaskTerminationException:
@@ -184,7 +342,17 @@ class BaseTask(object):
                 self.summary = str(e)
 
         finally:
-            self.lock.release()
+            if self.profile is not None:
+                self.profile.stop(STATUS_NAMES[self.status])
+                PROFILES.add_task(self.profile)
+                self.profile = None
+
+            TASK_DURATION.observe(time.monotonic() - started, task=self.name)
+            TASK_RUNS.inc(task=self.name, status=STATUS_NAMES[self.status])
+
+            TASK_QUEUE.finish(self)
+            self._publish(force=True)
+            EVENTS.forget('task:%s' % self.id)
 
     def _run(self, *args, **kwargs):
         '''
@@ -205,19 +373,12 @@ class TaskCleanup(BaseTask):
     Clean up stale Tasks. Should be scheduled in settings.py.
     '''
 
+    max_attempts = 1
+    priority = PRIORITY_LOW
+
     def _run(self):
         LOGGER.info('Task cleanup...')
         self._set_progress(0, 1, 'Purging stale Tasks...')
-        for task in list(TASKS.values()):
-            if task.status in (STATUS_NONE, STATUS_DONE, STATUS_ERROR,
-                               STATUS_TERMINATED):
-
-                # Leave tasks that have activity within the last 5 minutes
-                # alone.
-                last_activity = task.modified or task.created
-                if last_activity >= timezone.now() - timedelta(minutes=5):
-                    continue
-
-                LOGGER.debug('Purging stale task id: %s', task.id)
-                TASKS.pop(str(task.id))
+        # Leave tasks that have activity within the last 5 minutes alone.
+        TASKS.purge(timezone.now() - timedelta(minutes=5))
         self._set_progress(1, 1, 'Purged stale Tasks.')
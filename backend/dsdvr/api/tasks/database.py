@@ -0,0 +1,38 @@
+import logging
+
+from django.db import connection
+
+from api.tasks import BaseTask, PRIORITY_LOW
+from main import sqlite
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class TaskDatabaseMaintenance(BaseTask):
+    '''
+    Truncate the SQLite WAL and refresh query planner statistics (see
+    main.sqlite). Should be scheduled in settings.py.
+    '''
+
+    max_attempts = 1
+    priority = PRIORITY_LOW
+
+    def _run(self):
+        if connection.vendor != 'sqlite':
+            self._set_progress(1, 1, 'Nothing to do.')
+            return
+
+        self._set_progress(0, 2, 'Checkpointing...')
+        busy, log, checkpointed = sqlite.checkpoint()
+        if busy:
+            # A reader was using the WAL, it is truncated next time.
+            LOGGER.info(
+                'Checkpointed %i of %i WAL pages, busy', checkpointed, log)
+
+        self._set_progress(1, 2, 'Optimizing...')
+        sqlite.optimize()
+
+        self._set_progress(2, 2, 'Database maintained.')
@@ -14,11 +14,14 @@ from django.db.models import Q
 
 from constance import config
 
+from api import search
 from api.models import (
     Channel, Rating, Category, Program, Person, ProgramActor, Image, Tuner,
     Schedule,
 )
-from api.tasks import BaseTask
+from api.tasks import BaseTask, PRIORITY_LOW
+from api.tasks.rules import TaskRuleEvaluate, chunks
+from main.metrics import GUIDE_ROWS
 
 
 LOGGER = logging.getLogger(__name__)
@@ -84,12 +87,17 @@ class TaskGuideImport(BaseTask):
     </tv>
     '''
 
+    priority = PRIORITY_LOW
+    process = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.categories = {}
         self.ratings = {}
+        # Programs touched by this import, used to evaluate recording rules.
+        self.programs = []
 
-    @atomic(immediate=True)
+    @atomic(immediate='guide')
     def _get_category(self, name):
         category = self.categories.get(name)
         if category is None:
@@ -98,7 +106,7 @@ class TaskGuideImport(BaseTask):
             self.categories[name] = category
         return category
 
-    @atomic(immediate=True)
+    @atomic(immediate='guide')
     def _get_rating(self, name):
         rating = self.ratings.get(name)
         if rating is None:
@@ -107,7 +115,7 @@ class TaskGuideImport(BaseTask):
             self.ratings[name] = rating
         return rating
 
-    @atomic(immediate=True)
+    @atomic(immediate='guide')
     def _get_person(self, name):
         actor = self.actors.get(name)
         if actor is None:
@@ -116,7 +124,7 @@ class TaskGuideImport(BaseTask):
             self.actors[name] = person
         return actor
 
-    @atomic(immediate=True)
+    @atomic(immediate='channels')
     def _get_channel(self, number=None, name=None, poster=None, id=None):
         try:
             channel = Channel.objects.get(
@@ -251,7 +259,7 @@ class TaskGuideImport(BaseTask):
                     categories = data.pop('categories', None)
 
                     try:
-                        with atomic(immediate=True):
+                        with atomic(immediate='guide'):
                             program, _ = \
                                 Program.objects.update_or_create(
                                     channel=channel, start=start, stop=stop,
@@ -265,6 +273,9 @@ class TaskGuideImport(BaseTask):
                             if categories:
                                 program.categories.add(*categories)
 
+                        self.programs.append(program.pk)
+                        GUIDE_ROWS.inc(source='xmltv')
+
                     except IntegrityError as e:
                         LOGGER.exception(
                             'Schedule conflict: channel=%s, start=%s, stop=%s'
@@ -285,8 +296,27 @@ class TaskGuideImport(BaseTask):
         finally:
             f.close()
 
+        search.index_programs(self.programs)
+
+        # Only the schedules of programs we touched need to be evaluated.
+        schedules = []
+        for chunk in chunks(self.programs):
+            schedules.extend(
+                Schedule.objects.filter(program__in=chunk)
+                .values_list('pk', flat=True))
+        TaskRuleEvaluate(kwargs={'schedules': schedules}).enqueue()
+
 
 class TaskGuideDownload(BaseTask):
+    priority = PRIORITY_LOW
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Schedules inserted or changed, used to evaluate recording rules.
+        self.schedules = []
+        # Programs inserted or changed, to be indexed for search.
+        self.programs = []
+
     def _get_channel(self, station):
         station_number = station.channel.lstrip('0')
 
@@ -386,7 +416,7 @@ class TaskGuideDownload(BaseTask):
 
         # TODO: clear out the scheduling window by deleting conflicts?
         try:
-            return Schedule.objects.update_or_create(
+            schedule_obj, _ = Schedule.objects.update_or_create(
                 channel=channel_obj, start=start, defaults=defaults
             )
 
@@ -396,6 +426,9 @@ class TaskGuideDownload(BaseTask):
                 channel_obj.callsign, start, stop)
             raise
 
+        self.schedules.append(schedule_obj.pk)
+        return schedule_obj
+
     def _run(self):
         self._set_progress(0, 1, 'Downloading guide data...')
 
@@ -419,14 +452,20 @@ class TaskGuideDownload(BaseTask):
         for program in sd.get_programs():
             # We don't create channels, that is done when tuners are
             # discovered.
-            with atomic(immediate=True):
+            with atomic(immediate='guide'):
                 program_obj = self._get_program(program)
 
                 for schedule in program.schedules:
                     self._get_schedule(program_obj, schedule)
 
+            self.programs.append(program_obj.pk)
+
             count += 1
+            GUIDE_ROWS.inc(source='schedulesdirect')
             self._set_progress(
                 count, len(sd._program_ids), 'Downloading guide data...')
 
+        search.index_programs(self.programs)
         self._set_progress(1, 1, 'Guide data downloaded.')
+
+        TaskRuleEvaluate(kwargs={'schedules': self.schedules}).enqueue()
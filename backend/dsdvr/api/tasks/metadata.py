@@ -9,7 +9,9 @@ from django.db.transaction import atomic
 
 from constance import config
 
+from api import search
 from api.tasks import BaseTask
+from api.segments import SegmentIndex
 from api.models import (
     Media, Series, Category, Rating, Episode, Person, MediaActor,
 )
@@ -40,7 +42,7 @@ def ffprobe(media):
     try:
         metadata = {}
         try:
-            info = ffmpeg.probe(media.abs_path)
+            info = ffmpeg.probe(SegmentIndex(media.abs_path).ffmpeg_input())
 
         except FfmpegError as e:
             LOGGER.warning(e.stderr, exc_info=True)
@@ -122,6 +124,7 @@ def omdb(media):
         series.categories.add(*categories)
         for person in actors:
             MediaActor.objects.get_or_create(media=series, person=person)
+        search.index_media([series.pk])
 
         # The OMDB poster is typically of higher quality...
         media.update(poster=metadata['poster'])
@@ -141,6 +144,9 @@ class TaskMetadataFetch(BaseTask):
     Fetch metadata for a media item.
     '''
 
+    process = True
+
     def _run(self, media):
         ffprobe(media)
         omdb(media)
+        search.index_media([media.pk])
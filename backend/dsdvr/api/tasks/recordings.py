@@ -1,4 +1,7 @@
 import os
+import json
+import fcntl
+import atexit
 import logging
 import threading
 import subprocess
@@ -7,8 +10,8 @@ import time
 import signal
 import select
 
-from datetime import timedelta
 
+from contextlib import contextmanager
 from os.path import join as pathjoin
 from os.path import dirname
 
@@ -18,16 +21,34 @@ import daemon
 from django.utils import timezone
 from django.db.transaction import atomic
 
-from api.models import Recording, Media
-from api.tasks import BaseTask, metadata
+from constance import config
+
+from api import search
+from api.models import Recording, Media, Stream
+from api.tasks import BaseTask, PRIORITY_HIGH, metadata
+from api.tasks.retention import purge_recordings, RECORDING_EXPIRATION
+from api.segments import SegmentIndex
+from main.metrics import RECORDING_BYTES
+from main.schedule import Election, LEADER_HEARTBEAT
+from main.storage import STORAGE, MEDIA, TEMP, walk
 
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
 LOGGER.addHandler(logging.NullHandler())
 
+# How often (seconds) the watchdog samples active recordings.
+WATCHDOG_INTERVAL = 5
+# How long (seconds) a recording may go without growing before the capture is
+# restarted.
+WATCHDOG_STALL = 30
+
 
 def _tail(command, path):
+    # Each capture writes a new chunk. Appending to a chunk left behind by an
+    # interrupted capture could break mpegts packet alignment.
+    chunk_path = SegmentIndex(path).next_chunk()
+
     log_file = open(
         pathjoin(dirname(path), 'ffmpeg.stderr'), 'ab')
     log_file.write(b'\n%s\n\n' % (' '.join(command).encode('utf8')))
@@ -37,7 +58,7 @@ def _tail(command, path):
         command, stderr=log_file, stdout=subprocess.PIPE, shell=False)
 
     written = 0
-    with open(path, 'ab') as output:
+    with open(chunk_path, 'wb') as output:
         while process.poll() is None:
             input_readable = \
                 select.select([process.stdout], [], [], 1.0)[0]
@@ -58,26 +79,68 @@ def _daemonize(command, pid_file, path):
         _tail(command, path)
 
 
+@contextmanager
+def _capture_lock(name):
+    '''
+    Serializes starting captures on a channel, across processes. Spawning
+    ffmpeg takes a while, the database write lock is not held meanwhile.
+    '''
+    os.makedirs(config.STORAGE_TEMP, exist_ok=True)
+    path = pathjoin(config.STORAGE_TEMP, '.capture-%s.lock' % name)
+
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 class RecordingControl(object):
     def __init__(self, recording):
         self.recording = recording
 
-    @atomic(immediate=True)
     def _start_recording(self):
+        # Recordings on a channel share its capture, whoever starts first
+        # starts it.
+        with _capture_lock(self.recording.channel_id or self.recording.id):
+            self._start_capture()
+
+    def _start_capture(self):
         from api.views.streams import Pidfile
 
-        # TODO: Setup wizard or similar must make user configure a library for
-        # recordings... Perhaps we use a sane default? Can't think of one...
-        # In any case, the first Library may not be the right one.
-        media, _ = Media.objects.get_or_create_from_program(
-            self.recording.program)
+        # Another process may have started the capture while we waited.
+        self.recording.refresh_from_db()
+        if self.recording.status == Recording.STATUS_RECORDING and \
+           self._get_process() is not None:
+            return
+
+        with atomic(immediate='recordings'):
+            # TODO: Setup wizard or similar must make user configure a
+            # library for recordings... Perhaps we use a sane default? Can't
+            # think of one... In any case, the first Library may not be the
+            # right one.
+            media, created = Media.objects.get_or_create_from_program(
+                self.recording.program, rule=self.recording.rule)
+            if created:
+                search.index_media([media.pk])
+
+            # Back-to-back or overlapping recordings on the same channel
+            # share a capture, this saves a tuner re-lock and the video lost
+            # during it.
+            capture = self._find_capture()
+            if capture is not None:
+                return self._join_capture(capture, media)
 
         # Just to be safe, this is our working dir...
         os.makedirs(dirname(media.abs_path), exist_ok=True)
 
+        channel = self._get_channel()
+
         command = [
             'ffmpeg', '-loglevel', 'error', '-y', '-i',
-            self.recording.program.channel.stream, '-c:v', 'copy', '-pix_fmt',
+            channel.stream, '-c:v', 'copy', '-pix_fmt',
             'yuv420p', '-c:a', 'aac', '-profile:a', 'aac_low', '-f', 'mpegts',
             'pipe:1',
         ]
@@ -89,6 +152,7 @@ class RecordingControl(object):
 
         LOGGER.info('Spawning: "%s"', " ".join(command))
 
+        # Outside of the transaction, this takes a while.
         pid_file = Pidfile(pathjoin(dirname(media.abs_path), 'ffmpeg.pid'))
         t_rec = multiprocessing.Process(
             target=_daemonize, args=(command, pid_file, media.abs_path))
@@ -100,6 +164,73 @@ class RecordingControl(object):
         self.recording.update(
             media=media, status=Recording.STATUS_RECORDING, pid=pid)
 
+    def _get_channel(self):
+        # Recordings created by a Rule know which airing they are for.
+        channel = self.recording.channel
+        if channel is None:
+            channel = self.recording.program.channel
+        return channel
+
+    def _find_capture(self):
+        '''
+        Returns an active Recording on the same channel whose capture can be
+        shared.
+        '''
+        if self.recording.channel_id is None:
+            return
+
+        queryset = Recording.objects.filter(
+            channel_id=self.recording.channel_id,
+            status=Recording.STATUS_RECORDING, pid__isnull=False,
+            media__isnull=False).exclude(pk=self.recording.pk)
+
+        for recording in queryset:
+            if RecordingControl(recording)._get_process() is not None:
+                return recording
+
+    def _join_capture(self, capture, media):
+        '''
+        Record the current byte offset of the shared capture as the start of
+        this recording.
+        '''
+        path = SegmentIndex(capture.media.abs_path).current()
+        LOGGER.info(
+            'Recording %s sharing capture pid %i of recording %s',
+            self.recording.id, capture.pid, capture.id)
+
+        SegmentIndex(media.abs_path).link(path, os.path.getsize(path))
+        self.recording.update(
+            media=media, status=Recording.STATUS_RECORDING, pid=capture.pid)
+
+    def _get_sharers(self):
+        '''
+        Returns other active Recordings using this Recording's capture.
+        '''
+        if self.recording.pid is None:
+            return Recording.objects.none()
+
+        return Recording.objects.filter(
+            pid=self.recording.pid, status=Recording.STATUS_RECORDING) \
+            .exclude(pk=self.recording.pk)
+
+    def _hand_off(self, now):
+        '''
+        Let Recordings on this channel that are due to start join our capture
+        before it is stopped. Returns True if any of them did.
+        '''
+        if self.recording.channel_id is None:
+            return False
+
+        queryset = Recording.objects.filter(
+            channel_id=self.recording.channel_id,
+            status=Recording.STATUS_NONE, start__lte=now, stop__gt=now) \
+            .exclude(pk=self.recording.pk)
+
+        for recording in queryset:
+            RecordingControl(recording)._start_recording()
+
+        return self._get_sharers().exists()
+
     def _get_process(self):
         '''
         Retrives a psutil.Process instance for recording.pid. Sets
@@ -127,13 +258,60 @@ class RecordingControl(object):
             self.recording.update(pid=None)
             pass
 
+    def _kill_process(self, process, timeout=10):
+        '''
+        Interrupt the recording daemon and ffmpeg, escalate to SIGKILL for any
+        process that does not exit in time. A capture stuck on a dead stream
+        will often ignore SIGINT.
+        '''
+        try:
+            processes = [process] + process.children(recursive=True)
+
+        except psutil.NoSuchProcess:
+            return
+
+        for p in processes:
+            try:
+                p.send_signal(signal.SIGINT)
+
+            except psutil.NoSuchProcess:
+                pass
+
+        _, alive = psutil.wait_procs(processes, timeout=timeout)
+        for p in alive:
+            LOGGER.warning('Killing unresponsive pid: %i', p.pid)
+            try:
+                p.kill()
+
+            except psutil.NoSuchProcess:
+                pass
+
+    def restart(self):
+        '''
+        Restart capture of a recording whose output has stalled, for all the
+        Recordings sharing it.
+        '''
+        sharers = list(self._get_sharers())
+        process = self._get_process()
+
+        if process is not None:
+            self._kill_process(process)
+
+        self.recording.update(pid=None)
+        for recording in sharers:
+            recording.update(pid=None)
+
+        self._start_recording()
+        # They join the new capture.
+        for recording in sharers:
+            RecordingControl(recording)._start_recording()
+
     def _finalize_recording(self):
         '''
         Do any post-processing necessary.
 
-        For interrupted recordings, new files are created. Here we concatenate
-        all the files together into the Show's path. This works because we use
-        mpegts as a container.
+        Interrupted recordings consist of several chunks. These are not
+        concatenated, readers use api.segments to see them as one file.
         '''
         # TODO: Here is where we would skip commercials etc.
         try:
@@ -145,6 +323,14 @@ class RecordingControl(object):
     def _stop_recording(self, process=None):
         process = self._get_process()
 
+        # Leave a shared capture running for the other Recordings using it.
+        if process is not None and (self._get_sharers().exists() or
+                                    self._hand_off(timezone.now())):
+            LOGGER.info(
+                'Recording %s done, capture pid %i continues',
+                self.recording.id, process.pid)
+            process = None
+
         if process is not None:
             process.send_signal(signal.SIGINT)
             try:
@@ -155,6 +341,11 @@ class RecordingControl(object):
                 # iteration will retry.
                 LOGGER.exception(e)
 
+        # Mark where this program ends within the chunk, the capture may keep
+        # writing to it.
+        if self.recording.media is not None:
+            SegmentIndex(self.recording.media.abs_path).seal()
+
         self.recording.update(pid=None, status=Recording.STATUS_DONE)
 
         self._finalize_recording()
@@ -182,17 +373,274 @@ class RecordingControl(object):
                 self.recording.update(status=Recording.STATUS_ERROR)
 
 
+class RecordingHealth(object):
+    '''
+    Output statistics for a single active recording.
+    '''
+
+    def __init__(self, now):
+        self.size = None
+        self.sampled = now
+        self.last_growth = now
+        self.written = 0
+        self.rate = 0.0
+        self.gaps = 0
+        self.gap_seconds = 0.0
+        self.restarts = 0
+        self.stalled = False
+
+    def sample(self, size, now):
+        elapsed = now - self.sampled
+        growth = 0 if self.size is None else size - self.size
+
+        # A restarted capture may begin a smaller file.
+        if growth < 0:
+            growth = 0
+
+        if growth:
+            self.last_growth = now
+            self.stalled = False
+
+        elif self.size is not None:
+            # Count each run of samples without growth as one gap.
+            if not self.stalled:
+                self.gaps += 1
+            self.stalled = True
+            self.gap_seconds += elapsed
+
+        if elapsed > 0 and self.size is not None:
+            self.rate = growth / elapsed
+
+        self.written += growth
+        self.size = size
+        self.sampled = now
+
+    def stalled_for(self, now):
+        return now - self.last_growth
+
+    def as_dict(self):
+        return {
+            'size': self.size,
+            'written': self.written,
+            'rate': round(self.rate, 2),
+            'bitrate': int(self.rate * 8),
+            'gaps': self.gaps,
+            'gap_seconds': round(self.gap_seconds, 2),
+            'restarts': self.restarts,
+            'stalled': self.stalled,
+        }
+
+
+class RecordingWatchdog(object):
+    '''
+    Samples the output file of each active recording every few seconds.
+
+    A live recorder pid is not proof that anything is being recorded. ffmpeg
+    will happily sit on a dead tuner stream. Instead we watch the media file
+    grow, and restart the capture when it does not. Recordings sharing a
+    capture stall, and are restarted, together.
+
+    The growth of the chunks being written, and of transcoded streams, is also
+    accounted to storage (see main.storage). Shared chunks are hard linked
+    into each recording's directory, they are counted once by inode.
+
+    The health of each recording is saved to its row, for the API.
+
+    It starts in every process that runs TaskRecordingManager, but only the
+    process elected to lead it checks, so growth is accounted and captures
+    are restarted once.
+    '''
+
+    def __init__(self, interval=WATCHDOG_INTERVAL, stall=WATCHDOG_STALL):
+        self.interval = interval
+        self.stall = stall
+        self.election = Election('watchdog')
+        self.campaigned = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self._forget()
+
+    def _forget(self):
+        self.health = {}
+        # Stream id: (bytes, files) accounted.
+        self.streams = {}
+        # (st_dev, st_ino) of the chunks being written: bytes accounted.
+        self.chunks = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+
+            LOGGER.info('Starting recording watchdog')
+            self.thread = threading.Thread(target=self._loop)
+            self.thread.daemon = True
+            self.thread.start()
+            # Let another process take over right away on shutdown.
+            atexit.register(self.election.resign)
+
+    def _campaign(self):
+        try:
+            self.election.campaign()
+
+        except Exception as e:
+            LOGGER.warning('Could not elect recording watchdog: %s', e)
+            self.election.elected = False
+
+        if not self.election.elected:
+            # Another process accounts meanwhile, start over from fresh
+            # samples when elected again.
+            self._forget()
+
+    def tick(self):
+        '''
+        Renew the lease when due, and check if this process leads.
+        '''
+        if self.campaigned is None or \
+           time.monotonic() - self.campaigned >= LEADER_HEARTBEAT:
+            self.campaigned = time.monotonic()
+            self._campaign()
+
+        if self.election.elected:
+            self.check()
+
+    def _loop(self):
+        while True:
+            try:
+                self.tick()
+
+            except Exception as e:
+                LOGGER.exception(e)
+
+            time.sleep(self.interval)
+
+    def check(self):
+        self._check_recordings()
+        self._check_streams()
+
+    def _check_streams(self):
+        '''
+        Account for the output of transcoders, and for deleted streams.
+        '''
+        streams, size, files = {}, 0, 0
+        for id, path in Stream.objects.filter(
+                path__isnull=False).values_list('id', 'path'):
+            key = str(id)
+            streams[key] = walk(path)
+
+            # Output from before the first sample was reconciled.
+            last = self.streams.get(key, streams[key])
+            size += streams[key][0] - last[0]
+            files += streams[key][1] - last[1]
+
+        for key in set(self.streams) - set(streams):
+            size -= self.streams[key][0]
+            files -= self.streams[key][1]
+
+        self.streams = streams
+        STORAGE.add(TEMP, size, files)
+
+    def _check_recordings(self):
+        now, active = time.time(), set()
+        # Capture pid: [(Recording, RecordingHealth)].
+        captures, chunks = {}, {}
+        queryset = Recording.objects.filter(
+            status=Recording.STATUS_RECORDING, media__isnull=False) \
+            .select_related('media')
+
+        for recording in queryset:
+            key = str(recording.id)
+            active.add(key)
+
+            index = SegmentIndex(recording.media.abs_path)
+
+            health = self.health.get(key)
+            if health is None:
+                health = self.health[key] = RecordingHealth(now)
+
+            health.sample(index.size(), now)
+            captures.setdefault(recording.pid or key, []).append(
+                (recording, health))
+
+            try:
+                stat = os.stat(index.current())
+
+            except (TypeError, OSError):
+                continue
+
+            chunks[stat.st_dev, stat.st_ino] = stat.st_size
+
+        self._account(chunks)
+
+        for recordings in captures.values():
+            self._check_capture(recordings, now)
+
+            for recording, health in recordings:
+                Recording.objects.filter(pk=recording.pk).update(
+                    health=json.dumps(health.as_dict()))
+
+        # Forget recordings that are no longer active.
+        for key in set(self.health) - active:
+            self.health.pop(key, None)
+
+    def _account(self, chunks):
+        '''
+        Account for the growth of the chunks being written since the last
+        check.
+        '''
+        written = 0
+
+        # The first check only takes note of the sizes.
+        if self.chunks is not None:
+            for key, size in chunks.items():
+                # A chunk begun since the last check counts from 0.
+                written += max(size - self.chunks.get(key, 0), 0)
+
+        self.chunks = chunks
+        RECORDING_BYTES.inc(written)
+        STORAGE.add(MEDIA, written)
+
+    def _check_capture(self, recordings, now):
+        '''
+        Restart a capture once it has stalled for all the Recordings sharing
+        it, those that joined it recently have not watched it for long.
+        '''
+        stalled = min(health.stalled_for(now) for _, health in recordings)
+        if stalled < self.stall:
+            return
+
+        recording = recordings[0][0]
+        LOGGER.warning(
+            'Recording %s stalled for %is, restarting capture of %i '
+            'recording(s)', recording.id, stalled, len(recordings))
+        try:
+            RecordingControl(recording).restart()
+
+        except Exception as e:
+            LOGGER.exception(e)
+            for recording, _ in recordings:
+                recording.update(status=Recording.STATUS_ERROR)
+
+        for _, health in recordings:
+            health.restarts += 1
+            # Give the new capture a full stall period to produce output.
+            health.last_growth = time.time()
+
+
+WATCHDOG = RecordingWatchdog()
+
+
 class TaskRecordingManager(BaseTask):
+    # Scheduled every minute, a failed run is not worth retrying.
+    max_attempts = 1
+    priority = PRIORITY_HIGH
+
     def _run(self, purge=False):
+        WATCHDOG.start()
+
         if purge:
             try:
-                expiration = timezone.now() - timedelta(hours=2)
-                queryset = Recording.objects.filter(
-                    status=Recording.STATUS_DONE, stop__lte=expiration)
-                LOGGER.debug(
-                    'Deleting %i recording(s) older than %s', len(queryset),
-                    expiration)
-                queryset.delete()
+                purge_recordings(timezone.now() - RECORDING_EXPIRATION)
 
             except Exception as e:
                 # This operation is not critical, but should be logged and
@@ -0,0 +1,237 @@
+'''
+Recording retention.
+
+Deletes old Recording rows and recorded media according to the retention
+policies: the number of episodes each Rule keeps, and the maximum size of the
+media library (config.STORAGE_MEDIA_MAX).
+
+Rows are deleted in bounded batches so a large purge never holds the database
+write lock for long. Media directories are removed by a background thread, the
+bytes freed are accounted to storage (see main.storage).
+'''
+
+import os
+import queue
+import shutil
+import logging
+import threading
+
+from os.path import dirname, isdir
+from os.path import join as pathjoin
+from datetime import timedelta
+
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from constance import config
+
+from api import search
+from api.models import (
+    Recording, Media, Show, Movie, Rule, Stream, SearchDocument,
+)
+from api.tasks import BaseTask, PRIORITY_LOW
+from main.storage import STORAGE, MEDIA
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+# Rows deleted per transaction.
+BATCH_SIZE = 200
+# Finished Recording rows are kept this long.
+RECORDING_EXPIRATION = timedelta(hours=2)
+
+
+class MediaRemover(object):
+    '''
+    Removes media directories in a background thread.
+    '''
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def remove(self, path):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop)
+                self.thread.daemon = True
+                self.thread.start()
+
+        self.queue.put(path)
+
+    def _loop(self):
+        while True:
+            path = self.queue.get()
+            try:
+                self._remove(path)
+
+            except Exception as e:
+                LOGGER.exception(e)
+
+    def _remove(self, path):
+        if not isdir(path):
+            return
+
+        freed, unlinked = 0, 0
+        for root, _, names in os.walk(path):
+            for name in names:
+                try:
+                    stat = os.stat(pathjoin(root, name))
+
+                except OSError:
+                    continue
+
+                # Chunks hard linked by another recording stay on disk.
+                if stat.st_nlink == 1:
+                    freed += stat.st_size
+                    unlinked += 1
+
+        shutil.rmtree(path, ignore_errors=True)
+        LOGGER.debug('Removed %s, freed %i bytes', path, freed)
+        STORAGE.remove(MEDIA, freed, unlinked)
+
+
+REMOVER = MediaRemover()
+
+
+def purge_recordings(expiration):
+    '''
+    Delete finished Recording rows older than expiration. Returns the number
+    of rows deleted.
+
+    delete() loads the rows and sends post_delete for each of them (api.events
+    publishes recording.deleted), batches keep that within short
+    transactions.
+    '''
+    queryset = Recording.objects.filter(
+        status=Recording.STATUS_DONE, stop__lte=expiration)
+
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:BATCH_SIZE])
+        if not pks:
+            break
+
+        with atomic(immediate='recordings'):
+            count, _ = Recording.objects.filter(pk__in=pks).delete()
+        deleted += count
+
+    LOGGER.debug(
+        'Deleted %i recording(s) older than %s', deleted, expiration)
+    return deleted
+
+
+def delete_media(pks):
+    '''
+    Delete the given Media and queue their directories for removal.
+    '''
+    paths = set()
+    for model in (Show, Movie):
+        for media in model.objects.filter(pk__in=pks):
+            paths.add(dirname(media.abs_path))
+
+    # Stop transcoders, a queryset delete() would not.
+    for stream in Stream.objects.filter(media__in=pks):
+        stream.delete()
+
+    with atomic(immediate='recordings'):
+        Media.objects.filter(pk__in=pks).delete()
+    search.remove(SearchDocument.KIND_MEDIA, pks)
+
+    for path in paths:
+        REMOVER.remove(path)
+
+
+def _expendable():
+    '''
+    Recorded Media that may be deleted, oldest first.
+    '''
+    return Media.objects \
+        .filter(type__in=(Media.TYPE_SHOW, Media.TYPE_MOVIE)) \
+        .exclude(recording__status=Recording.STATUS_RECORDING) \
+        .order_by('created')
+
+
+def apply_keep_episodes():
+    '''
+    Delete the oldest recordings of Rules that keep a limited number of
+    episodes. Returns the number of Media deleted.
+    '''
+    deleted = 0
+    for rule in Rule.objects.filter(keep_episodes__isnull=False):
+        queryset = _expendable().filter(rule=rule)
+        excess = queryset.count() - rule.keep_episodes
+
+        while excess > 0:
+            pks = list(queryset.values_list(
+                'pk', flat=True)[:min(excess, BATCH_SIZE)])
+            delete_media(pks)
+            excess -= len(pks)
+            deleted += len(pks)
+
+    return deleted
+
+
+def _get_usage():
+    # Sizes are recorded by ffprobe when a recording is finalized.
+    usage = 0
+    for model in (Show, Movie):
+        usage += model.objects.aggregate(usage=Sum('size'))['usage'] or 0
+    return usage
+
+
+def apply_max_usage():
+    '''
+    Delete the oldest recordings until the library fits within
+    config.STORAGE_MEDIA_MAX. Returns the number of Media deleted.
+    '''
+    maximum = config.STORAGE_MEDIA_MAX * 1024 ** 3
+    if not maximum:
+        return 0
+
+    excess, deleted = _get_usage() - maximum, 0
+    while excess > 0:
+        batch = []
+        # Media not yet sized do not count toward usage, deleting them
+        # would not reduce it.
+        queryset = _expendable() \
+            .annotate(size=Coalesce('show__size', 'movie__size')) \
+            .filter(size__isnull=False)
+        for pk, size in queryset.values_list('pk', 'size')[:BATCH_SIZE]:
+            batch.append(pk)
+            excess -= size
+            if excess <= 0:
+                break
+
+        if not batch:
+            break
+
+        delete_media(batch)
+        deleted += len(batch)
+
+    return deleted
+
+
+class TaskRetention(BaseTask):
+    '''
+    Apply retention policies. Should be scheduled in settings.py.
+    '''
+
+    priority = PRIORITY_LOW
+
+    def _run(self):
+        self._set_progress(0, 3, 'Purging finished recordings...')
+        purge_recordings(timezone.now() - RECORDING_EXPIRATION)
+
+        self._set_progress(1, 3, 'Applying episode limits...')
+        deleted = apply_keep_episodes()
+
+        self._set_progress(2, 3, 'Applying storage limit...')
+        deleted += apply_max_usage()
+
+        self._set_progress(3, 3, 'Deleted %i recording(s).' % deleted)
@@ -0,0 +1,119 @@
+import logging
+
+from datetime import timedelta
+
+from django.utils import timezone
+from django.db.transaction import atomic
+
+from api.models import Rule, Schedule, Recording
+from api.tasks import BaseTask
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+# Keep IN (...) clauses under SQLite's host parameter limit.
+CHUNK_SIZE = 500
+
+
+def chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+@atomic(immediate='recordings')
+def evaluate(schedules, rules=None):
+    '''
+    Create Recordings for Schedules matched by Rules.
+
+    `schedules` is a Schedule queryset, typically limited to the Schedules a
+    guide import inserted or changed. `rules` is a Rule queryset, all enabled
+    Rules are used if omitted.
+
+    A Program can only be recorded once, so Recordings are deduplicated by
+    Program. If a Program airs more than once, the earliest upcoming airing
+    the Rule matches wins, whether or not it is in `schedules`.
+    Returns the number of Recordings created.
+    '''
+    if rules is None:
+        rules = Rule.objects.all()
+    rules = list(rules.filter(enabled=True))
+
+    if not rules:
+        return 0
+
+    upcoming = Schedule.objects.filter(stop__gt=timezone.now())
+    schedules = schedules.filter(stop__gt=timezone.now())
+
+    # program_id -> (Schedule, Rule)
+    matches = {}
+    for rule in rules:
+        program_ids = schedules.filter(rule.get_query()) \
+            .exclude(program__recording__isnull=False) \
+            .values_list('program_id', flat=True).distinct()
+
+        # Of all the airings of the Programs, not only those in schedules,
+        # so the earliest wins however the caller splits the schedules.
+        for chunk in chunks(program_ids):
+            queryset = upcoming.filter(rule.get_query()) \
+                .filter(program_id__in=chunk) \
+                .only('id', 'start', 'stop', 'channel_id', 'program_id') \
+                .order_by('start')
+
+            for schedule in queryset:
+                if not rule.is_in_window(schedule.start):
+                    continue
+
+                match = matches.get(schedule.program_id)
+                if match is None or schedule.start < match[0].start:
+                    matches[schedule.program_id] = (schedule, rule)
+
+    if not matches:
+        return 0
+
+    # bulk_create() bypasses save(), so timestamps are set here.
+    now = timezone.now()
+    recordings = [
+        Recording(
+            program_id=program_id, channel_id=schedule.channel_id,
+            rule=rule,
+            start=schedule.start - timedelta(seconds=rule.padding_start),
+            stop=schedule.stop + timedelta(seconds=rule.padding_stop),
+            padding_start=rule.padding_start, padding_stop=rule.padding_stop,
+            created=now, modified=now)
+        for program_id, (schedule, rule) in matches.items()
+    ]
+    Recording.objects.bulk_create(recordings, batch_size=CHUNK_SIZE)
+
+    LOGGER.info('Rules created %i recording(s)', len(recordings))
+    return len(recordings)
+
+
+class TaskRuleEvaluate(BaseTask):
+    '''
+    Evaluate Rules against the given Schedules (by id) or against all upcoming
+    Schedules if none are given.
+    '''
+
+    def _run(self, schedules=None, rules=None):
+        if rules is not None:
+            rules = Rule.objects.filter(pk__in=rules)
+
+        if schedules is None:
+            self._set_progress(0, 1, 'Evaluating recording rules...')
+            created = evaluate(Schedule.objects.all(), rules)
+            self._set_progress(1, 1, 'Created %i recording(s).' % created)
+            return
+
+        done, total, created = 0, len(schedules), 0
+        self._set_progress(done, total, 'Evaluating recording rules...')
+
+        for chunk in chunks(schedules):
+            created += evaluate(Schedule.objects.filter(pk__in=chunk), rules)
+            done += len(chunk)
+            self._set_progress(done, total)
+
+        self._set_progress(
+            total, total, 'Created %i recording(s).' % created)
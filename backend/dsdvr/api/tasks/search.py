@@ -0,0 +1,34 @@
+import logging
+
+from api import search
+from api.models import SearchDocument
+from api.tasks import BaseTask, PRIORITY_LOW
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class TaskSearchIndex(BaseTask):
+    '''
+    Index Programs and Media missing from the search index, and drop those
+    deleted (see api.search). With full=True, rebuild the index. Should be
+    scheduled in settings.py.
+    '''
+
+    max_attempts = 1
+    priority = PRIORITY_LOW
+
+    def _progress(self, kind, done, total):
+        self._set_progress(done, total, 'Indexing %s...' % (
+            SearchDocument.KIND_NAMES[kind]))
+
+    def _run(self, full=False):
+        if not search.available():
+            self._set_progress(1, 1, 'No search index.')
+            return
+
+        self._set_progress(0, 1, 'Indexing...')
+        search.update(full=full, progress=self._progress)
+        self._set_progress(1, 1, 'Search index updated.')
@@ -0,0 +1,33 @@
+import logging
+
+from constance import config
+
+from api.tasks import BaseTask, PRIORITY_LOW
+from main.storage import STORAGE, MEDIA, TEMP
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class TaskStorageReconcile(BaseTask):
+    '''
+    Correct storage totals by walking each storage area (see main.storage).
+    Should be scheduled in settings.py.
+    '''
+
+    max_attempts = 1
+    priority = PRIORITY_LOW
+
+    def _run(self):
+        media, temp = config.STORAGE_MEDIA, config.STORAGE_TEMP
+        # Media may be kept within temp, it is accounted separately.
+        areas = ((MEDIA, media, ()), (TEMP, temp, (media, )))
+
+        for i, (name, path, exclude) in enumerate(areas):
+            self._set_progress(
+                i, len(areas), 'Reconciling %s storage...' % name)
+            STORAGE.reconcile(name, path, exclude)
+
+        self._set_progress(len(areas), len(areas), 'Storage reconciled.')
@@ -126,7 +126,7 @@ class TaskTunerDiscover(BaseTask):
                 continue
 
             elif el.tag == 'Program':
-                with atomic(immediate=True):
+                with atomic(immediate='channels'):
                     Channel.objects.update_or_create(
                         tuner=tuner, number=data['number'],
                         callsign=data['name'],
@@ -1,3 +1,654 @@
-from django.test import TestCase
+import gc
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
 
-# Create your tests here.
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection, transaction
+from django.db.utils import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from constance.test import override_config
+from rest_framework.test import APIClient
+
+from api.models import (
+    User, Tuner, Channel, Program, Schedule, Recording, Media, Series, Show,
+    Movie, Rule, SearchDocument, EventTicket,
+)
+from api import search
+from api.cache import TTLCache
+from api.renderers import encode
+from api.events import EVENTS
+from api.serializers import RecordingSerializer
+from api.monkeypatch import _lock_key
+from api.tasks import BaseTask, retention, rules
+from api.tasks.recordings import RecordingWatchdog, RecordingControl
+from main.management.commands.querybudget import _populate
+from main.models import Leader
+from main.profiling import PROFILES, Profile
+from main.storage import STORAGE, MEDIA
+
+
+class RecordingCreateTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user('test@localhost', 'test'))
+
+        tuner = Tuner.objects.create(
+            device_id=1, device_ip='127.0.0.1', model='test', tuner_count=1)
+        self.channel = Channel.objects.create(
+            tuner=tuner, number='1', name='1', callsign='C1')
+        self.program = Program.objects.create(program_id='P1', title='P1')
+
+        start = timezone.now() + timedelta(hours=1)
+        # An ended airing, the next one is recorded.
+        Schedule.objects.create(
+            channel=self.channel, program=self.program,
+            start=start - timedelta(days=1),
+            stop=start - timedelta(days=1, minutes=-30), duration=1800)
+        self.schedule = Schedule.objects.create(
+            channel=self.channel, program=self.program, start=start,
+            stop=start + timedelta(minutes=30), duration=1800)
+
+    def _post(self, **data):
+        data['program.id'] = self.program.id
+        return self.client.post('/api/recordings/', data, format='json')
+
+    def test_create(self):
+        response = self._post(padding_start=60, padding_stop=120)
+        self.assertEqual(response.status_code, 201, response.content)
+
+        recording = Recording.objects.get(program=self.program)
+        self.assertEqual(recording.channel, self.channel)
+        self.assertEqual(
+            recording.start, self.schedule.start - timedelta(seconds=60))
+        self.assertEqual(
+            recording.stop, self.schedule.stop + timedelta(seconds=120))
+        self.assertEqual(recording.padding_start, 60)
+        self.assertEqual(recording.padding_stop, 120)
+
+    def test_create_ended(self):
+        self.schedule.delete()
+
+        response = self._post()
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertFalse(Recording.objects.exists())
+
+    def test_tuner_count(self):
+        # The only tuner records another channel at the time.
+        channel = Channel.objects.create(
+            tuner=self.channel.tuner, number='2', name='2', callsign='C2')
+        Recording.objects.create(
+            program=Program.objects.create(program_id='P2', title='P2'),
+            channel=channel, start=self.schedule.start,
+            stop=self.schedule.stop)
+
+        response = self._post()
+        self.assertEqual(response.status_code, 400, response.content)
+
+    def test_tuner_shared(self):
+        # Recordings on the same channel share its capture.
+        Recording.objects.create(
+            program=Program.objects.create(program_id='P2', title='P2'),
+            channel=self.channel, start=self.schedule.start,
+            stop=self.schedule.stop)
+
+        response = self._post()
+        self.assertEqual(response.status_code, 201, response.content)
+
+
+class RuleEvaluateTestCase(TestCase):
+    def test_earliest_airing(self):
+        channel = Channel.objects.create(
+            tuner=Tuner.objects.create(
+                device_id=1, device_ip='127.0.0.1', model='test',
+                tuner_count=1),
+            number='1', name='1', callsign='C1')
+        program = Program.objects.create(program_id='P1', title='P1')
+        now = timezone.now()
+        earliest, later = [
+            Schedule.objects.create(
+                channel=channel, program=program,
+                start=now + timedelta(hours=hours),
+                stop=now + timedelta(hours=hours + 1), duration=3600)
+            for hours in (1, 5)]
+        Rule.objects.create(name='P1', title='P1')
+
+        # The later airing is in another chunk of schedules.
+        self.assertEqual(
+            rules.evaluate(Schedule.objects.filter(pk=later.pk)), 1)
+
+        self.assertEqual(
+            Recording.objects.get(program=program).start, earliest.start)
+
+
+class EventsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user('test@localhost', 'test'))
+
+    def _ticket(self):
+        response = self.client.post('/api/events/ticket/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data['ticket']
+
+    def _events(self, ticket):
+        # The stream is not read.
+        return APIClient().get(
+            '/api/events/', {'ticket': ticket}).status_code
+
+    def test_ticket(self):
+        ticket = self._ticket()
+        self.assertEqual(self._events(ticket), 200)
+        # Only once.
+        self.assertEqual(self._events(ticket), 401)
+
+    def test_ticket_expired(self):
+        ticket = self._ticket()
+        EventTicket.objects.update(expires=timezone.now())
+        self.assertEqual(self._events(ticket), 401)
+
+    @override_settings(EVENTS_MAX_CONNECTIONS=0)
+    def test_max_connections(self):
+        self.assertEqual(self._events(self._ticket()), 503)
+
+    @override_settings(EVENTS_MAX_CONNECTIONS=1)
+    def test_max_connections_reserved(self):
+        # The connection is counted before its stream is read.
+        response = APIClient().get('/api/events/', {'ticket': self._ticket()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(EVENTS.subscribers(), 1)
+        self.assertEqual(self._events(self._ticket()), 503)
+
+        # Dropping the stream, read or not, releases it.
+        del response
+        gc.collect()
+        self.assertEqual(EVENTS.subscribers(), 0)
+
+
+class GZipTestCase(TestCase):
+    def test_secrets_uncompressed(self):
+        User.objects.create_user('test@localhost', 'test', 'password')
+        client = APIClient(HTTP_ACCEPT_ENCODING='gzip')
+
+        response = client.post(
+            '/api/token/', {'email': 'test@localhost', 'password': 'password'},
+            format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertNotIn('Content-Encoding', response)
+
+        response = client.post(
+            '/api/token/refresh/', {'refresh': response.data['refresh']},
+            format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertNotIn('Content-Encoding', response)
+
+        client.credentials(
+            HTTP_AUTHORIZATION='Bearer %s' % response.data['access'])
+        response = client.post('/api/events/ticket/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertNotIn('Content-Encoding', response)
+
+
+class TaskProgressTestCase(TestCase):
+    def test_same_summary_batched(self):
+        task = BaseTask()
+        wraps = task._update_progress
+        with mock.patch.object(
+                task, '_update_progress', wraps=wraps) as update:
+            for i in range(1000):
+                task._set_progress(i, 1000000, 'Downloading')
+
+        # The first call records the summary, the others repeat it.
+        update.assert_called_once_with(0, 1000000, 'Downloading')
+
+        with mock.patch.object(task, '_update_progress') as update:
+            task._set_progress(1000, 1000000, 'Parsing')
+        update.assert_called_once_with(1000, 1000000, 'Parsing')
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser(
+            'test@localhost', 'test', 'test'))
+
+    def test_tasks(self):
+        # Saved by the process that ran the Task, the worker for instance.
+        profile = Profile('TaskTest').start('Downloading')
+        profile.stop('done')
+        PROFILES.add_task(profile)
+
+        stats = self.client.get('/api/profiling/').data
+        self.assertEqual(stats['tasks']['TaskTest']['wall']['count'], 1)
+        self.assertIn('Downloading', stats['tasks']['TaskTest']['phases'])
+        self.assertEqual(stats['recent'][0]['name'], 'TaskTest')
+
+        response = self.client.delete('/api/profiling/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/profiling/').data['tasks'], {})
+
+
+class TTLCacheTestCase(TestCase):
+    def _settle(self, cache):
+        # Wait for background refreshes.
+        deadline = time.monotonic() + 5
+        while cache._flights and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_single_flight(self):
+        cache, calls = TTLCache(60), []
+        started, release = threading.Event(), threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'value'
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(cache.get('key', compute)))
+            for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        # Let the others find the computation in progress.
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 4)
+
+    def test_error_not_cached(self):
+        cache = TTLCache(60)
+
+        def fail():
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            cache.get('key', fail)
+        self.assertEqual(cache.get('key', lambda: 'value'), 'value')
+
+    def test_stale_while_revalidate(self):
+        # Expired as soon as it is cached, but may be served stale.
+        cache = TTLCache(0, stale=60)
+        self.assertEqual(cache.get('key', lambda: 'old'), 'old')
+
+        release = threading.Event()
+
+        def compute():
+            release.wait(5)
+            return 'new'
+
+        # Served without waiting for the refresh.
+        self.assertEqual(cache.get('key', compute), 'old')
+        release.set()
+        self._settle(cache)
+        self.assertEqual(cache.get('key', compute), 'new')
+
+    def test_refresh_failed(self):
+        cache, calls = TTLCache(0, stale=60), []
+        cache.get('key', lambda: 'old')
+
+        def fail():
+            calls.append(1)
+            raise ValueError('failed')
+
+        # The stale value is kept, and the next caller tries again.
+        for attempt in (1, 2):
+            with self.assertLogs('api.cache', 'WARNING'):
+                self.assertEqual(cache.get('key', fail), 'old')
+                self._settle(cache)
+            self.assertEqual(len(calls), attempt)
+
+    def test_lru(self):
+        cache = TTLCache(60, maxsize=2)
+        cache.get('a', lambda: 'a')
+        cache.get('b', lambda: 'b')
+        # Used, b is now the least recently.
+        cache.get('a', lambda: 'a2')
+        cache.get('c', lambda: 'c')
+
+        self.assertEqual(list(cache._values), ['a', 'c'])
+        self.assertEqual(cache.get('a', lambda: 'a2'), 'a')
+        self.assertEqual(cache.get('b', lambda: 'b2'), 'b2')
+
+
+def _decode(document):
+    '''
+    Columnar JSON to what it encodes, see api.renderers.
+    '''
+    strings = document['strings']
+
+    def table(encoded):
+        columns = {
+            name: column(values)
+            for name, values in encoded['$columns'].items()}
+        rows = [
+            {name: values[i] for name, values in columns.items()}
+            for i in range(encoded['$rows'])]
+        for name, indexes in encoded.get('$absent', {}).items():
+            for i in indexes:
+                del rows[i][name]
+        return rows
+
+    def column(encoded):
+        if isinstance(encoded, list):
+            return [value(item) for item in encoded]
+
+        if '$strings' in encoded:
+            return [
+                None if index is None else strings[index]
+                for index in encoded['$strings']]
+
+        if '$table' in encoded:
+            return table(encoded['$table'])
+
+        items, lists = column(encoded['$items']), []
+        for length in encoded['$lengths']:
+            lists.append(items[:length])
+            items = items[length:]
+        return lists
+
+    def value(encoded):
+        if isinstance(encoded, list):
+            return [value(item) for item in encoded]
+
+        if isinstance(encoded, dict):
+            if '$rows' in encoded:
+                return table(encoded)
+            return {name: value(item) for name, item in encoded.items()}
+
+        return encoded
+
+    return value(document['data'])
+
+
+class ColumnarTestCase(TestCase):
+    def test_encode(self):
+        rows = [
+            {'rating': 'TV-G', 'title': 'A', 'poster': None,
+             'categories': ['Comedy'], 'channel': {'number': '1'}},
+            {'rating': 'TV-G', 'title': 'B', 'poster': 'b.jpg',
+             'categories': [], 'channel': {'number': '2'}, 'series': 1},
+        ]
+        document = encode({'results': rows})
+        columns = document['data']['results']['$columns']
+
+        self.assertEqual(document['strings'], ['TV-G'])
+        self.assertEqual(columns['rating'], {'$strings': [0, 0]})
+        # Unique strings are left as they are.
+        self.assertEqual(columns['title'], ['A', 'B'])
+        self.assertEqual(columns['poster'], [None, 'b.jpg'])
+        self.assertEqual(columns['categories']['$lengths'], [1, 0])
+        self.assertIn('$table', columns['channel'])
+        self.assertEqual(columns['series'], [None, 1])
+        self.assertEqual(
+            document['data']['results']['$absent'], {'series': [0]})
+        self.assertEqual(_decode(document), {'results': rows})
+
+    def test_round_trip(self):
+        client = APIClient()
+        client.force_authenticate(
+            User.objects.create_user('test@localhost', 'test'))
+        # A guide and a library, as querybudget fills them.
+        _populate(3, 1)
+        # Nullable columns, null in some rows only.
+        Program.objects.filter(pk__in=Program.objects.filter(
+            recording__isnull=True).values('pk')[:5]).update(poster=None)
+        Media.objects.filter(pk=Media.objects.first().pk).update(
+            rating=None)
+
+        for url in ('/api/guide/', '/api/media/'):
+            expected = client.get(url, {'format': 'json'}).json()
+            response = client.get(url, {'format': 'columnar'})
+            self.assertEqual(
+                response['Content-Type'],
+                'application/vnd.dsdvr.columnar+json')
+            self.assertTrue(expected['results'])
+            self.assertEqual(
+                _decode(json.loads(response.content))['results'],
+                expected['results'])
+
+
+class RetentionTestCase(TestCase):
+    def _media(self, model, size, age):
+        media = model.objects.create(
+            type=model.objects.DEFAULT_TYPE, title=model.__name__,
+            subtitle='', desc='', path='%s.mpeg' % age, size=size)
+        Media.objects.filter(pk=media.pk).update(
+            created=timezone.now() - timedelta(days=age))
+        return media
+
+    @override_config(STORAGE_MEDIA_MAX=3)
+    def test_max_usage(self):
+        series = Series.objects.create(
+            type=Media.TYPE_SERIES, title='Series', subtitle='', desc='')
+        Media.objects.filter(pk=series.pk).update(
+            created=timezone.now() - timedelta(days=4))
+        # Not yet sized, does not count toward usage.
+        unsized = self._media(Show, None, 3)
+        oldest = self._media(Movie, 2 * 1024 ** 3, 2)
+        newest = self._media(Movie, 2 * 1024 ** 3, 1)
+
+        def delete_media(pks):
+            Media.objects.filter(pk__in=pks).delete()
+
+        with mock.patch.object(retention, 'delete_media', delete_media):
+            self.assertEqual(retention.apply_max_usage(), 1)
+
+        self.assertEqual(
+            set(Media.objects.values_list('pk', flat=True)),
+            {series.pk, unsized.pk, newest.pk})
+        self.assertFalse(Media.objects.filter(pk=oldest.pk).exists())
+
+    def test_freed(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        with open(os.path.join(path, 'a.000'), 'wb') as f:
+            f.write(b'a' * 100)
+
+        retention.MediaRemover()._remove(path)
+
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(STORAGE.stats(MEDIA, '/')['freed'], 100)
+
+    def test_delete_media(self):
+        media = self._media(Movie, 1, 1)
+        search.index_media([media.pk])
+
+        with mock.patch.object(retention, 'REMOVER') as remover:
+            retention.delete_media([media.pk])
+
+        remover.remove.assert_called_once_with(
+            os.path.dirname(media.abs_path))
+
+        self.assertFalse(Media.objects.exists())
+        self.assertFalse(SearchDocument.objects.exists())
+        self.assertEqual(search.search('Movie'), (0, []))
+
+
+class RecordingWatchdogTestCase(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        # A capture shared by two recordings, its chunk is hard linked.
+        chunk = os.path.join(self.path, 'a.000')
+        with open(chunk, 'wb') as f:
+            f.write(b'a' * 100)
+        os.link(chunk, os.path.join(self.path, 'b.000'))
+
+        channel = Channel.objects.create(
+            tuner=Tuner.objects.create(
+                device_id=1, device_ip='127.0.0.1', model='test',
+                tuner_count=1),
+            number='1', name='1', callsign='C1')
+        now = timezone.now()
+        for name in ('a', 'b'):
+            Recording.objects.create(
+                program=Program.objects.create(program_id=name, title=name),
+                channel=channel, start=now, stop=now + timedelta(hours=1),
+                status=Recording.STATUS_RECORDING, pid=os.getpid(),
+                media=Show.objects.create(
+                    type=Media.TYPE_SHOW, title=name, subtitle='', desc='',
+                    path=name))
+
+        index = mock.patch('api.tasks.recordings.SegmentIndex', self._index)
+        index.start()
+        self.addCleanup(index.stop)
+
+    def _index(self, path):
+        chunk = os.path.join(self.path, '%s.000' % os.path.basename(path))
+        return mock.Mock(
+            current=lambda: chunk, size=lambda: os.path.getsize(chunk))
+
+    def test_shared_written_once(self):
+        watchdog = RecordingWatchdog()
+
+        with mock.patch('api.tasks.recordings.STORAGE') as storage:
+            watchdog._check_recordings()
+            with open(os.path.join(self.path, 'a.000'), 'ab') as f:
+                f.write(b'a' * 50)
+            watchdog._check_recordings()
+
+        storage.add.assert_called_with(MEDIA, 50)
+        for health in watchdog.health.values():
+            self.assertEqual(health.written, 50)
+
+    def test_elected(self):
+        watchdog, other = RecordingWatchdog(), RecordingWatchdog()
+        other.election.owner = 'other'
+
+        with mock.patch.object(RecordingWatchdog, 'check') as check:
+            watchdog.tick()
+            other.tick()
+
+        check.assert_called_once_with()
+        self.assertIsNone(other.chunks)
+
+    def test_health_saved(self):
+        # The API reads it from the rows, the watchdog runs in the worker.
+        RecordingWatchdog()._check_recordings()
+
+        for recording in Recording.objects.all():
+            health = RecordingSerializer(recording).data['health']
+            self.assertEqual(health['size'], 100)
+            self.assertEqual(health['restarts'], 0)
+
+    def test_shared_restarted_once(self):
+        watchdog = RecordingWatchdog(stall=0)
+
+        with mock.patch.object(RecordingControl, 'restart') as restart:
+            watchdog._check_recordings()
+
+        restart.assert_called_once_with()
+        for health in watchdog.health.values():
+            self.assertEqual(health.restarts, 1)
+
+
+def _in_thread(target, *args):
+    '''
+    Run target on its own database connection, returns its result.
+    '''
+    result = []
+
+    def run():
+        try:
+            result.append(target(*args))
+
+        except Exception as e:
+            result.append(e)
+
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def _locked(name):
+    '''
+    Whether another connection holds the write lock `name`, without waiting
+    for it.
+    '''
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA busy_timeout = 0')
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+
+            except OperationalError:
+                return True
+
+            cursor.execute('ROLLBACK')
+            return False
+
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [_lock_key(name)])
+        if not cursor.fetchone()[0]:
+            return True
+
+        cursor.execute('SELECT pg_advisory_unlock(%s)', [_lock_key(name)])
+        return False
+
+
+class AtomicImmediateTestCase(TransactionTestCase):
+    '''
+    atomic(immediate=...) behaves the same on SQLite and PostgreSQL (run the
+    tests with DSDVR_DB_ENGINE=postgresql, see the Makefile).
+    '''
+
+    def test_lock(self):
+        self.assertFalse(_in_thread(_locked, 'test'))
+
+        with transaction.atomic(immediate='test'):
+            self.assertTrue(_in_thread(_locked, 'test'))
+            # PostgreSQL only serializes transactions using the same lock,
+            # SQLite has a single writer.
+            self.assertEqual(
+                _in_thread(_locked, 'other'), connection.vendor == 'sqlite')
+
+        self.assertFalse(_in_thread(_locked, 'test'))
+
+    def test_serialized(self):
+        # Writers each read how many rows exist, then add the next one.
+        # Unless they are serialized, some read the same count and add the
+        # same row.
+        barrier = threading.Barrier(4)
+
+        def write():
+            barrier.wait()
+            with transaction.atomic(immediate='test'):
+                count = Leader.objects.count()
+                # Let the others read meanwhile, unless they wait.
+                time.sleep(0.05)
+                Leader.objects.create(
+                    name='test%i' % count, owner='test',
+                    lease_until=timezone.now())
+
+        threads = [
+            threading.Thread(target=_in_thread, args=(write, ))
+            for _ in range(barrier.parties)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(
+            set(Leader.objects.values_list('name', flat=True)),
+            {'test%i' % i for i in range(barrier.parties)})
@@ -22,8 +22,12 @@ from api.views.media import MediaViewSet, MediaStreamViewSet, poster, frame0
 from api.views.series import SeriesViewSet
 from api.views.me import MeView
 from api.views.status import StatusView
+from api.views.events import events, EventTicketView
+from api.views.profiling import ProfilingView
+from api.views.search import SearchView
 from api.views.images import ImageViewSet, image
 from api.views.settings import SettingViewSet
+from api.views.rules import RuleViewSet
 
 
 router = DefaultRouter()
@@ -44,6 +48,7 @@ router.register('media', MediaViewSet, base_name='media')
 router.register('series', SeriesViewSet, base_name='series')
 router.register('images', ImageViewSet, base_name='images')
 router.register('settings', SettingViewSet, base_name='settings')
+router.register('rules', RuleViewSet, base_name='rules')
 
 
 urlpatterns = [
@@ -73,6 +78,10 @@ urlpatterns = [
     path('media/<uuid:pk>/frame0.jpg', frame0, name='media-frame0'),
 
     path('status/', StatusView.as_view(), name='status'),
+    path('events/', events, name='events'),
+    path('events/ticket/', EventTicketView.as_view(), name='events-ticket'),
+    path('profiling/', ProfilingView.as_view(), name='profiling'),
+    path('search/', SearchView.as_view(), name='search'),
 
     # Authentication
     path(
@@ -14,3 +14,4 @@ LOGGER.addHandler(logging.NullHandler())
 class CategoryViewSet(viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     queryset = Category.objects.all()
+    query_budget = 1
@@ -1,5 +1,7 @@
 import logging
 
+from django.db.models import Count
+
 from rest_framework import viewsets
 
 from api.models import Channel
@@ -13,4 +15,7 @@ LOGGER.addHandler(logging.NullHandler())
 
 class ChannelViewSet(viewsets.ModelViewSet):
     serializer_class = ChannelSerializer
-    queryset = Channel.objects.all()
+    queryset = Channel.objects.annotate(program_count=Count('programs')) \
+        .prefetch_related('images')
+    ordering = 'number'
+    query_budget = 2
@@ -14,3 +14,4 @@ LOGGER.addHandler(logging.NullHandler())
 class DeviceViewSet(viewsets.ModelViewSet):
     serializer_class = DeviceSerializer
     queryset = Device.objects.all()
+    query_budget = 1
@@ -0,0 +1,130 @@
+'''
+Server-sent events.
+
+Clients subscribe once to /api/events/ rather than polling /api/status/ and
+/api/tasks/<id>/. The stream starts with a `status` event (the same document
+/api/status/ returns), followed by:
+
+ - task: a Task changed state or made progress (rate limited).
+ - recording, recording.deleted: a Recording changed status or was deleted.
+ - stream, stream.deleted: a Stream was started, stopped or deleted.
+ - system: system stats, every SYSTEM_INTERVAL seconds.
+
+EventSource can not send headers. Browsers first POST /api/events/ticket/
+(with their access token) for a ticket, valid once for TICKET_TTL, and give it
+as the `ticket` query parameter. An access token in the URL would end up in
+logs and history. Other clients may send the usual Authorization header.
+
+Each connection holds a web server worker (thread or process) for as long as
+it is open. At most settings.EVENTS_MAX_CONNECTIONS are accepted per process,
+further clients are refused with 503 and should poll instead. Size the web
+server's workers for them.
+'''
+
+import json
+import time
+import queue
+import logging
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+
+from rest_framework import views
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.events import EVENTS
+from api.models import EventTicket
+from api.views.status import get_status, get_system_stats
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+# Seconds between comments that keep idle connections open.
+KEEPALIVE = 15
+# Seconds between system events.
+SYSTEM_INTERVAL = 30
+# How long a ticket may be used after it is issued.
+TICKET_TTL = timedelta(seconds=30)
+
+
+class EventTicketView(views.APIView):
+    def post(self, request):
+        ticket = EventTicket.objects.issue(request.user, ttl=TICKET_TTL)
+        return Response({'ticket': ticket.key, 'expires': ticket.expires})
+
+
+def _authenticate(request):
+    ticket = request.GET.get('ticket')
+    if ticket is not None:
+        return EventTicket.objects.redeem(ticket)
+
+    try:
+        result = JWTAuthentication().authenticate(request)
+        return result[0] if result else None
+
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+def _format(type, data):
+    return 'event: %s\ndata: %s\n\n' % (
+        type, json.dumps(data, cls=DjangoJSONEncoder))
+
+
+def _stream(request, subscription):
+    try:
+        # Started by events(), so closing the response releases the
+        # subscription even if the stream was never read.
+        yield
+        yield _format('status', get_status(request))
+
+        last_system = time.monotonic()
+        while True:
+            try:
+                yield _format(*subscription.get(timeout=KEEPALIVE))
+
+            except queue.Empty:
+                yield ': keepalive\n\n'
+
+            if time.monotonic() - last_system >= SYSTEM_INTERVAL:
+                yield _format('system', get_system_stats())
+                last_system = time.monotonic()
+
+    finally:
+        subscription.close()
+
+
+def events(request):
+    user = _authenticate(request)
+    if user is None:
+        return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=401)
+
+    # Reserve a connection, and subscribe before the status snapshot so no
+    # change falls in between.
+    subscription = EVENTS.subscribe(limit=settings.EVENTS_MAX_CONNECTIONS)
+    if subscription is None:
+        response = JsonResponse(
+            {'detail': 'Too many event streams, poll instead.'}, status=503)
+        response['Retry-After'] = SYSTEM_INTERVAL
+        return response
+
+    request.user = user
+    stream = _stream(request, subscription)
+    next(stream)
+    response = StreamingHttpResponse(
+        stream,
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Don't let a proxy buffer the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
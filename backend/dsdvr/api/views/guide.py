@@ -5,15 +5,19 @@ import shutil
 from datetime import timedelta
 
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 
 from rest_framework import viewsets
 from rest_framework import serializers
 from rest_framework.parsers import MultiPartParser
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 
-from api.models import Channel
-from api.serializers import GuideSerializer, GuideUploadSerializer
+from api.models import Channel, Schedule
+from api.pagination import CursorPagination
+from api.serializers import (
+    GuideSerializer, GuideUploadSerializer, ScheduleSerializer,
+)
 from api.tasks.guide import TaskGuideImport
 
 
@@ -21,10 +25,37 @@ LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
 LOGGER.addHandler(logging.NullHandler())
 
+# Hours of programs in the guide, clients may ask for up to GUIDE_MAX_HOURS
+# with ?hours=.
+GUIDE_HOURS = 2
+GUIDE_MAX_HOURS = 24
+
 
 class GuideViewSet(viewsets.ModelViewSet):
     serializer_class = GuideSerializer
     queryset = Channel.objects.all()
+    ordering = 'number'
+    pagination_class = CursorPagination
+    query_budget = 4
+
+    def get_queryset(self):
+        try:
+            hours = float(self.request.query_params.get('hours', GUIDE_HOURS))
+
+        except ValueError:
+            hours = None
+
+        if hours is None or not hours >= 0:
+            raise ValidationError({'hours': 'Must be a positive number.'})
+
+        # The upcoming programs of the whole page, GuideSerializer reads them
+        # from Channel.upcoming.
+        schedules = ScheduleSerializer.prefetch(Schedule.objects.get_upcoming(
+            timedelta(hours=min(hours, GUIDE_MAX_HOURS))))
+
+        return super().get_queryset().prefetch_related(
+            'images', Prefetch('programs', queryset=schedules,
+                               to_attr='upcoming'))
 
     @action(methods=['post'], detail=False)
     def download(self, request):
@@ -15,6 +15,7 @@ from django.shortcuts import get_object_or_404
 from constance import config
 
 from api.models import Image
+from api.pagination import CursorPagination
 from api.serializers import ImageSerializer
 
 
@@ -26,6 +27,9 @@ LOGGER.addHandler(logging.NullHandler())
 class ImageViewSet(viewsets.ModelViewSet):
     serializer_class = ImageSerializer
     queryset = Image.objects.all()
+    ordering = 'url'
+    pagination_class = CursorPagination
+    query_budget = 1
 
 
 def image(request, pk):
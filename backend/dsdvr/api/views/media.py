@@ -15,6 +15,8 @@ from rest_framework import viewsets
 from rest_framework.response import Response
 
 from api.models import Media, Stream
+from api.segments import SegmentIndex, exists
+from api.pagination import CursorPagination
 from api.serializers import MediaSerializer, StreamSerializer
 from api.views.streams import (
     CreatingStreamSerializer, validate_stream, InvalidStreamError
@@ -43,7 +45,9 @@ def make_frame0(media_path, frame0_path):
 
 class MediaViewSet(viewsets.ModelViewSet):
     serializer_class = MediaSerializer
-    queryset = Media.objects.all()
+    queryset = MediaSerializer.prefetch(Media.objects.all())
+    pagination_class = CursorPagination
+    query_budget = 14
 
 
 class MediaStreamViewSet(viewsets.ModelViewSet):
@@ -88,8 +92,9 @@ def poster(request, pk):
     # with a controlled path to use our "scratch" space. Could use a second
     # small memory cache as well. First cache to avoid hitting upstream too
     # much and second to avoid disk I/O.
-    media = get_object_or_404(Media, pk=pk)
-    poster_url = media.poster if media.poster else static('images/poster.jpg')
+    media = get_object_or_404(Media.objects.select_related('poster'), pk=pk)
+    poster_url = media.poster.url if media.poster \
+        else static('images/poster.jpg')
     return redirect(poster_url)
 
 
@@ -98,11 +103,11 @@ def frame0(request, pk):
     media = get_object_or_404(Media, pk=pk)
     frame0_path = media.frame0_path
 
-    if not isfile(media.abs_path):
+    if not exists(media.abs_path):
         raise Http404()
 
     if not isfile(frame0_path):
-        make_frame0(media.abs_path, frame0_path)
+        make_frame0(SegmentIndex(media.abs_path).ffmpeg_input(), frame0_path)
 
     try:
         frame0_file = open(frame0_path, 'rb')
@@ -3,6 +3,7 @@ import logging
 from rest_framework import serializers, viewsets
 
 from api.models import Movie
+from api.pagination import CursorPagination
 from api.serializers import MovieSerializer
 
 
@@ -13,4 +14,7 @@ LOGGER.addHandler(logging.NullHandler())
 
 class MovieViewSet(viewsets.ModelViewSet):
     serializer_class = MovieSerializer
-    queryset = Movie.objects.all()
+    queryset = Movie.objects.select_related('rating') \
+        .prefetch_related('categories', 'actors', 'images')
+    pagination_class = CursorPagination
+    query_budget = 4
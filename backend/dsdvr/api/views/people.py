@@ -3,6 +3,7 @@ import logging
 from rest_framework import viewsets
 
 from api.models import Person
+from api.pagination import CursorPagination
 from api.serializers import PersonSerializer
 
 
@@ -14,3 +15,6 @@ LOGGER.addHandler(logging.NullHandler())
 class PersonViewSet(viewsets.ModelViewSet):
     serializer_class = PersonSerializer
     queryset = Person.objects.all()
+    ordering = 'name'
+    pagination_class = CursorPagination
+    query_budget = 1
@@ -0,0 +1,35 @@
+'''
+Profiling results, for admins. See main.profiling.
+'''
+
+import logging
+
+from rest_framework import views, status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from django.conf import settings
+
+from main.profiling import PROFILES
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class ProfilingView(views.APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        stats = PROFILES.stats()
+        stats['settings'] = {
+            'tasks': settings.PROFILE_TASKS,
+            'dump': settings.PROFILE_DUMP,
+            'requests': settings.PROFILE_REQUESTS,
+        }
+        return Response(stats)
+
+    def delete(self, request):
+        PROFILES.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
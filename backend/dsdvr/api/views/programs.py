@@ -3,6 +3,7 @@ import logging
 from rest_framework import serializers, viewsets
 
 from api.models import Program
+from api.pagination import CursorPagination
 from api.serializers import ProgramSerializer
 
 
@@ -13,4 +14,7 @@ LOGGER.addHandler(logging.NullHandler())
 
 class ProgramViewSet(viewsets.ModelViewSet):
     serializer_class = ProgramSerializer
-    queryset = Program.objects.all()
+    queryset = Program.objects.select_related('recording') \
+        .prefetch_related('categories', 'actors', 'images')
+    pagination_class = CursorPagination
+    query_budget = 4
@@ -14,3 +14,4 @@ LOGGER.addHandler(logging.NullHandler())
 class RatingViewSet(viewsets.ModelViewSet):
     serializer_class = RatingSerializer
     queryset = Rating.objects.all()
+    query_budget = 1
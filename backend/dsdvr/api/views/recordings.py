@@ -20,7 +20,8 @@ LOGGER.addHandler(logging.NullHandler())
 
 class RecordingViewSet(viewsets.ModelViewSet):
     serializer_class = RecordingSerializer
-    queryset = Recording.objects.all()
+    queryset = RecordingSerializer.prefetch(Recording.objects.all())
+    query_budget = 15
 
     def destroy(self, request, pk=None):
         recording = get_object_or_404(Recording, pk=pk)
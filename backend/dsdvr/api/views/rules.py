@@ -0,0 +1,17 @@
+import logging
+
+from rest_framework import viewsets
+
+from api.models import Rule
+from api.serializers import RuleSerializer
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class RuleViewSet(viewsets.ModelViewSet):
+    serializer_class = RuleSerializer
+    queryset = Rule.objects.all()
+    query_budget = 1
@@ -0,0 +1,126 @@
+'''
+Search over programs and media, see api.search.
+
+GET /api/search/?q=<words>[&type=program|media][&limit=20][&offset=0]
+
+Results are ranked, best first. Program results include their upcoming
+airings.
+'''
+
+import logging
+
+from django.db.models import F
+from django.utils import timezone
+
+from rest_framework import views
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from api import search
+from api.models import Program, Media, Schedule, SearchDocument
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def _int(request, name, default, maximum=None):
+    try:
+        value = int(request.query_params.get(name, default))
+
+    except ValueError:
+        raise ValidationError({name: 'Must be an integer.'})
+
+    if value < 0:
+        raise ValidationError({name: 'Must not be negative.'})
+
+    return value if maximum is None else min(value, maximum)
+
+
+def _programs(pks):
+    programs = {
+        program['id']: dict(program, schedules=[])
+        for program in Program.objects.filter(pk__in=pks).values(
+            'id', 'program_id', 'title', 'subtitle', 'desc', 'season',
+            'episode')
+    }
+
+    for schedule in Schedule.objects.filter(
+            program__in=pks, stop__gte=timezone.now()).order_by(
+                'start').values(
+                    'id', 'program_id', 'channel_id', 'start', 'stop',
+                    channel_number=F('channel__number'),
+                    channel_name=F('channel__name')):
+        programs[schedule.pop('program_id')]['schedules'].append(schedule)
+
+    return programs
+
+
+def _media(pks):
+    media = {}
+    for item in Media.objects.filter(pk__in=pks).values(
+            'id', 'type', 'title', 'subtitle', 'desc', 'year'):
+        item['type'] = Media.TYPE_NAMES[item['type']]
+        media[item['id']] = item
+    return media
+
+
+class SearchView(views.APIView):
+    def get(self, request):
+        text = request.query_params.get('q', '')
+        kind = request.query_params.get('type')
+        if kind is not None:
+            if kind not in search.KINDS:
+                raise ValidationError({'type': 'Must be one of: %s.' % (
+                    ', '.join(search.KINDS))})
+            kind = search.KINDS[kind]
+
+        limit = _int(request, 'limit', DEFAULT_LIMIT, MAX_LIMIT)
+        offset = _int(request, 'offset', 0)
+
+        count, matches = search.search(
+            text, kind=kind, limit=limit, offset=offset)
+
+        objects = {
+            SearchDocument.KIND_PROGRAM: _programs([
+                pk for kind, pk, _ in matches
+                if kind == SearchDocument.KIND_PROGRAM]),
+            SearchDocument.KIND_MEDIA: _media([
+                pk for kind, pk, _ in matches
+                if kind == SearchDocument.KIND_MEDIA]),
+        }
+
+        results = []
+        for kind, pk, rank in matches:
+            obj = objects[kind].get(pk)
+            if obj is None:
+                # Deleted since it was matched.
+                continue
+
+            results.append({
+                'type': SearchDocument.KIND_NAMES[kind],
+                'rank': round(rank, 4),
+                'object': obj,
+            })
+
+        url = request.build_absolute_uri()
+        next = previous = None
+        if offset + limit < count:
+            next = replace_query_param(url, 'offset', offset + limit)
+
+        if offset > 0:
+            previous = remove_query_param(url, 'offset') \
+                if offset <= limit else \
+                replace_query_param(url, 'offset', offset - limit)
+
+        return Response({
+            'count': count,
+            'next': next,
+            'previous': previous,
+            'results': results,
+        })
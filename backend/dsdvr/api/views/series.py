@@ -3,6 +3,7 @@ import logging
 from rest_framework import viewsets
 
 from api.models import Series
+from api.pagination import CursorPagination
 from api.serializers import SeriesSerializer
 
 
@@ -13,4 +14,7 @@ LOGGER.addHandler(logging.NullHandler())
 
 class SeriesViewSet(viewsets.ModelViewSet):
     serializer_class = SeriesSerializer
-    queryset = Series.objects.all()
+    queryset = Series.objects.select_related('rating') \
+        .prefetch_related('categories', 'actors', 'images')
+    pagination_class = CursorPagination
+    query_budget = 4
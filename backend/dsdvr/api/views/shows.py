@@ -3,6 +3,7 @@ import logging
 from rest_framework import serializers, viewsets
 
 from api.models import Show
+from api.pagination import CursorPagination
 from api.serializers import ShowSerializer
 
 
@@ -13,4 +14,7 @@ LOGGER.addHandler(logging.NullHandler())
 
 class ShowViewSet(viewsets.ModelViewSet):
     serializer_class = ShowSerializer
-    queryset = Show.objects.all()
+    queryset = Show.objects.select_related('rating') \
+        .prefetch_related('categories', 'actors', 'images', 'series')
+    pagination_class = CursorPagination
+    query_budget = 5
@@ -26,8 +26,11 @@ from constance import config
 from rest_framework import viewsets
 from rest_framework import status
 
+from api.middleware import device_exempt
 from api.models import Stream
 from api.serializers import StreamSerializer
+from api.segments import SegmentIndex, SegmentReader
+from main.metrics import SEGMENT_BYTES
 
 
 LOGGER = logging.getLogger(__name__)
@@ -35,6 +38,7 @@ LOGGER.setLevel(logging.DEBUG)
 LOGGER.addHandler(logging.NullHandler())
 
 WRITER_PROCESS_NAMES = ('ffmpeg', 'python')
+READ_SIZE = 1024 ** 2 * 3
 
 
 class InvalidStreamError(Exception):
@@ -114,14 +118,31 @@ def find_free_port(interface='localhost'):
         s.close()
 
 
+def _inode(path):
+    try:
+        stat = os.stat(path)
+
+    except OSError:
+        return
+
+    return stat.st_dev, stat.st_ino
+
+
 def _find_writers(path):
     '''
-    Return pids of processes writing to given path. Only considers processes
+    Return pids of processes writing to given path, or any of its chunks (see
+    api.segments). Only considers processes
     whose name is contained within WRITER_PROCESS_NAMES. Such filtering is an
     optimization as scanning all open files for all processes takes a
     considerable amount of time.
+
+    Files are compared by inode, chunks shared with another recording are
+    hard links to the file its capture writes.
     '''
     pids = []
+    inodes = set(map(_inode, [path] + [
+        chunk for chunk, _, _ in SegmentIndex(path).chunks()]))
+    inodes.discard(None)
 
     for p in psutil.process_iter(attrs=['name']):
         # As of now, the only process that should be writing our video is
@@ -139,8 +160,9 @@ def _find_writers(path):
         else:
             # See if the ffmpeg process is writing to our video.
             for file in files:
-                if file.path == path and 'w' in file.mode:
+                if 'w' in file.mode and _inode(file.path) in inodes:
                     pids.append(p.pid)
+                    break
 
     return pids
 
@@ -154,7 +176,7 @@ def _alive(pids):
 
 def _tail(path, process):
     '''
-    Read each path in turn and write it to the given process.
+    Read the chunks of path in turn and write them to the given process.
 
     Don't stop reading a file until no new data has arrived for 5s and no
     writing processes are detected. This allows us to stream a video from disk
@@ -175,17 +197,17 @@ def _tail(path, process):
             'Found %i writers for path "%s": %s', len(pids), path,
             ",".join([str(p) for p in pids]))
 
-        with open(path, 'rb') as input:
+        with SegmentReader(path) as input:
             written, where, last_data = 0, 0, time.time()
 
             while True:
                 # See if our streams are ready for I/O...
-                input_readable = where < os.fstat(input.fileno()).st_size
+                input_readable = where < input.size()
                 output_writable = \
                     select.select([], [process.stdin], [], 1.0)[1]
 
                 if input_readable and output_writable:
-                    data = input.read()
+                    data = input.read(READ_SIZE)
                     if data:
                         written += len(data)
                         where, last_data = input.tell(), time.time()
@@ -328,6 +350,7 @@ class StreamViewSet(viewsets.ModelViewSet):
     queryset = Stream.objects.all()
 
 
+@device_exempt
 def playlist(request, pk):
     # TODO: we may wish to generate or modify this playlist. Although leaving
     # it alone may allow the player to rewind etc. The playlist controls the
@@ -346,6 +369,7 @@ def playlist(request, pk):
     return FileResponse(playlist_file)
 
 
+@device_exempt
 def segment(request, pk, name):
     # TODO: we can use the requested segment and UserAgent to store a cursor
     # for later resuming of playback
@@ -360,4 +384,5 @@ def segment(request, pk, name):
             raise
         raise Http404()
 
+    SEGMENT_BYTES.inc(os.fstat(segment_file.fileno()).st_size)
     return FileResponse(segment_file)
@@ -1,5 +1,5 @@
 '''
-Ephemeral tasks.
+Tasks.
 
 Threads that perform functions within the django process. They report their
 status vi an API.
@@ -7,9 +7,8 @@ status vi an API.
 Tasks are started by other API endpoints to handle any work that cannot be
 completed during an HTTP request / response cycle (long running operations).
 
-They are ephemeral as they are not stored anywhere, the are spawned and then
-can be monitored or cancelled. However if the django process restarts, all
-threads stop and all the tasks are forgotten.
+Tasks are persisted when enqueued, they can be monitored or cancelled and
+queued tasks survive a restart of the django process.
 '''
 
 import logging
@@ -27,7 +26,7 @@ from api.views import (
     ObjectListMixin, ObjectRetrieveMixin,
     ObjectDestroyMixin
 )
-from api.tasks import TASKS
+from api.tasks import TASKS, TaskCleanup
 from api.serializers import TaskSerializer
 
 
@@ -39,7 +38,7 @@ LOGGER.addHandler(logging.NullHandler())
 class TaskViewSet(ObjectListMixin, ObjectRetrieveMixin, ObjectDestroyMixin,
                   viewsets.ViewSet):
     '''
-    API for ephemeral Tasks.
+    API for Tasks.
     '''
 
     serializer_class = TaskSerializer
@@ -19,6 +19,7 @@ LOGGER.addHandler(logging.NullHandler())
 class TunerViewSet(viewsets.ModelViewSet):
     serializer_class = TunerSerializer
     queryset = Tuner.objects.all()
+    query_budget = 1
 
     @action(methods=['post'], detail=False)
     def discover(self, request):
@@ -0,0 +1,14 @@
+'''
+Command line, `python -m dsdvr <command>` (see scripts/dsdvr). Commands are
+those of manage.py, `worker` runs the worker service.
+'''
+
+import os
+import sys
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dsdvr.settings')
+
+    from django.core.management import execute_from_command_line
+    execute_from_command_line(sys.argv)
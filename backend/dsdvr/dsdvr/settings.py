@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+import tempfile
 from os.path import dirname
 from os.path import join as pathjoin
 import sentry_sdk
@@ -57,6 +58,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.ProfilingMiddleware',
+    'api.middleware.GZipMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -92,14 +95,58 @@ WSGI_APPLICATION = 'dsdvr.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': pathjoin(BASE_DIR, 'db.sqlite3'),
-        'OPTIONS': {
-            'timeout': 100,
-        },
+# SQLite by default. PostgreSQL (DSDVR_DB_ENGINE=postgresql) allows concurrent
+# writers, for installs with many recordings or large guides. See
+# api.monkeypatch for how write transactions lock on each.
+DB_ENGINE = os.environ.get('DSDVR_DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DSDVR_DB_NAME', 'dsdvr'),
+            'USER': os.environ.get('DSDVR_DB_USER', 'dsdvr'),
+            'PASSWORD': os.environ.get('DSDVR_DB_PASSWORD', ''),
+            'HOST': os.environ.get('DSDVR_DB_HOST', ''),
+            'PORT': os.environ.get('DSDVR_DB_PORT', ''),
+            'OPTIONS': {
+                # Milliseconds to wait for a lock, like SQLite's timeout.
+                'options': '-c lock_timeout=100000',
+            },
+        }
+    }
+
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get(
+                'DSDVR_DB_NAME', pathjoin(BASE_DIR, 'db.sqlite3')),
+            'OPTIONS': {
+                'timeout': 100,
+            },
+            # Connections to an in-memory database share its cache, and fail
+            # rather than wait for its locks. Tests of concurrent writers
+            # need a file, outside the source tree (with its -wal and -shm).
+            'TEST': {
+                'NAME': os.environ.get(
+                    'DSDVR_TEST_DB_NAME',
+                    pathjoin(tempfile.gettempdir(), 'dsdvr-test.sqlite3')),
+            },
+        }
     }
+
+# Applied to each SQLite connection, see main.sqlite.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # With WAL, only a power loss may lose (but not corrupt) recent commits.
+    'synchronous': 'NORMAL',
+    # Milliseconds to wait for the write lock, same as OPTIONS['timeout'].
+    'busy_timeout': 100000,
+    'mmap_size': 256 * 1024 ** 2,
+    # Negative, in KiB.
+    'cache_size': -32 * 1024,
+    'temp_store': 'MEMORY',
 }
 
 
@@ -193,10 +240,44 @@ LOGGING = {
     },
 }
 
+# Where tasks run:
+#  - embedded: in the web server process, for single process deployments.
+#  - web: in a separate worker service (`dsdvr worker`), so the web server may
+#    run any number of stateless worker processes.
+TASK_MODE = os.environ.get('DSDVR_TASK_MODE', 'embedded')
+# Threads executing queued tasks, by the lowest priority they take (see
+# main.models.Job). The high priority lane is reserved for recording control.
+TASK_WORKERS = {
+    0: int(os.environ.get('DSDVR_TASK_WORKERS_HIGH', 1)),
+    1: int(os.environ.get('DSDVR_TASK_WORKERS_NORMAL', 1)),
+    2: int(os.environ.get('DSDVR_TASK_WORKERS_LOW', 1)),
+}
+# Processes executing CPU bound tasks.
+TASK_PROCESSES = int(os.environ.get('DSDVR_TASK_PROCESSES', 2))
+# Event streams (/api/events/) accepted per web server process, each holds a
+# worker of the web server while it is open.
+EVENTS_MAX_CONNECTIONS = int(os.environ.get('DSDVR_EVENTS_MAX_CONNECTIONS', 8))
+# /metrics answers clients on this host, and others that send this token
+# (`Authorization: Bearer <token>`).
+METRICS_TOKEN = os.environ.get('DSDVR_METRICS_TOKEN') or None
+
+# Profiling, see main.profiling. Time tasks, also dump profiles of tasks
+# ('cprofile' or 'pyinstrument') and the fraction of requests to time.
+PROFILE_TASKS = os.environ.get('DSDVR_PROFILE_TASKS', '') == '1'
+PROFILE_DUMP = os.environ.get('DSDVR_PROFILE_DUMP') or None
+PROFILE_REQUESTS = float(os.environ.get('DSDVR_PROFILE_REQUESTS', 0))
+
+# (schedule, task class[, options]), the schedule is a crontab or a number of
+# seconds. See main.schedule.ScheduledTask for options.
 CRON = (
-    ('*/5 * * * *', 'api.tasks.TaskCleanup'),
+    ('*/5 * * * *', 'api.tasks.TaskCleanup', {'misfire': 'skip'}),
     ('* * * * *',   'api.tasks.recordings.TaskRecordingManager'),
     ('* * */8 * *',   'api.tasks.guide.TaskGuideDownload'),
+    ('*/15 * * * *', 'api.tasks.retention.TaskRetention'),
+    ('0 * * * *', 'api.tasks.storage.TaskStorageReconcile'),
+    ('*/15 * * * *', 'api.tasks.database.TaskDatabaseMaintenance',
+     {'misfire': 'skip'}),
+    ('30 3 * * *', 'api.tasks.search.TaskSearchIndex', {'misfire': 'skip'}),
 )
 
 # Allow application configuration to be edited in admin.
@@ -216,7 +297,12 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
-    )
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'api.renderers.ColumnarJSONRenderer',
+    ),
 }
 
 AUTH_USER_MODEL = 'api.User'
@@ -236,4 +322,7 @@ CONSTANCE_CONFIG = {
                       'Where to store media files.'),
     'STORAGE_TEMP': (os.environ.get('DSDVR_STORAGE_TEMP', '/var/tmp/dsdvr'),
                      'Where to store temporary files.'),
+    'STORAGE_MEDIA_MAX': (int(os.environ.get('DSDVR_STORAGE_MEDIA_MAX', 0)),
+                          'Maximum media storage in GB, oldest recordings '
+                          'are deleted beyond this. 0 is unlimited.'),
 }
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dsdvr.settings')
 
 application = get_wsgi_application()
+
+# Run the scheduler and task workers alongside the API.
+from main.apps import start_embedded  # noqa: E402
+
+start_embedded()
@@ -1,9 +1,13 @@
+import os
+import sys
 import logging
 
 from django.apps import AppConfig
 from django.conf import settings
+from django.db.backends.signals import connection_created
 
-from . import schedule
+from . import schedule, sqlite
+from .processpool import PROCESS_ENV
 
 
 LOGGER = logging.getLogger(__name__)
@@ -11,8 +15,41 @@ LOGGER.setLevel(logging.DEBUG)
 LOGGER.addHandler(logging.NullHandler())
 
 
+def _is_reloader():
+    '''
+    Django runserver forks, the parent only watches for code changes and
+    restarts the child.
+    '''
+    return sys.argv[1:2] == ['runserver'] and \
+        '--noreload' not in sys.argv and \
+        os.environ.get('RUN_MAIN') != 'true'
+
+
+def start_embedded():
+    '''
+    Start the scheduler and task workers in this process, if it serves the
+    API and tasks are embedded (see settings.TASK_MODE).
+
+    Called by the WSGI application, which runserver also loads (in its child
+    process only), so management commands (migrate, shell, test...) do not
+    run tasks. `dsdvr worker` starts them itself.
+    '''
+    # Task processes only run the Tasks handed to them.
+    if os.environ.get(PROCESS_ENV):
+        return
+
+    # Otherwise `dsdvr worker` runs tasks.
+    if settings.TASK_MODE != 'embedded':
+        return
+
+    if _is_reloader():
+        return
+
+    schedule.setup(settings.CRON)
+
+
 class MainConfig(AppConfig):
     name = 'main'
 
     def ready(self):
-        schedule.setup(settings.CRON)
+        connection_created.connect(sqlite.configure)
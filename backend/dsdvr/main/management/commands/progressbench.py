@@ -0,0 +1,66 @@
+'''
+Task progress benchmark.
+
+Times BaseTask._set_progress() called for every item, the way a guide import
+calls it for every programme, with and without an event stream subscribed,
+and with the same summary on every call. The unbatched column records progress on
+every call, as _set_progress() did before progress was batched (see
+api.tasks.UPDATE_INTERVAL).
+'''
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.events import EVENTS
+from api.tasks import BaseTask, STATUS_RUNNING
+
+
+def _unbatched(task, done, total, summary):
+    task._check_exit()
+    task._update_progress(done, total, summary)
+
+
+def _bench(report, calls, subscribed, summary):
+    '''
+    Returns the nanoseconds per call of report(task, done, total, summary).
+    '''
+    task = BaseTask()
+    task.status = STATUS_RUNNING
+    subscription = EVENTS.subscribe() if subscribed else None
+
+    try:
+        started = time.perf_counter()
+        for i in range(calls):
+            report(task, i, calls, summary)
+        return (time.perf_counter() - started) / calls * 1e9
+
+    finally:
+        if subscription is not None:
+            subscription.close()
+
+
+class Command(BaseCommand):
+    help = 'Time reporting Task progress for every item, batched and ' \
+           'unbatched.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=300000)
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Runs of each, the best is reported.')
+
+    def handle(self, *args, **options):
+        calls, repeat = options['calls'], options['repeat']
+
+        self.stdout.write('%-16s %12s %12s' % ('', 'unbatched', 'batched'))
+        for name, subscribed, summary in (
+                ('no subscribers', False, None),
+                ('SSE subscriber', True, None),
+                ('same summary', True, 'Downloading guide data...')):
+            times = [
+                min(_bench(report, calls, subscribed, summary)
+                    for _ in range(repeat))
+                for report in (_unbatched, BaseTask._set_progress)]
+            self.stdout.write('%-16s %9.0f ns %9.0f ns' % (
+                name, times[0], times[1]))
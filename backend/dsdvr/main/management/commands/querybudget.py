@@ -0,0 +1,175 @@
+'''
+Query count budgets of the API's lists.
+
+Lists each ModelViewSet registered in api.urls, against a scratch database
+filled with a guide and a library, and counts the queries of one page. A
+viewset's `query_budget` is the most queries one page of its list may run, it
+must not depend on the number of rows. Each list is requested at two sizes of
+the data, to also catch lists without a budget that grow with it.
+
+Fails if a list is over budget, or grows.
+'''
+
+from datetime import timedelta
+
+from django.db import connection, reset_queries
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    CaptureQueriesContext, setup_test_environment, teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import mixins
+from rest_framework.test import APIClient
+
+from api.models import (
+    User, Tuner, Channel, Program, Schedule, ProgramActor, MediaActor, Person,
+    Rating, Category, Image, Media, Show, Movie, Series, Episode, Recording,
+    Rule, Device,
+)
+from api.urls import router
+
+
+def _populate(n, offset):
+    '''
+    Add n channels, each with 10 programs, a recording and its media.
+    '''
+    now = timezone.now()
+    rating = Rating.objects.create(name='TV-%i' % offset)
+    categories = [
+        Category.objects.create(name='Category %i' % (offset + i))
+        for i in range(3)]
+    people = [
+        Person.objects.create(name='Person %i' % (offset + i))
+        for i in range(3)]
+    tuner = Tuner.objects.create(
+        device_id=offset, device_ip='127.0.0.1', model='querybudget',
+        tuner_count=2)
+    series = Series.objects.create(
+        type=Media.TYPE_SERIES, title='Series %i' % offset, subtitle='',
+        desc='', rating=rating)
+    Rule.objects.create(name='Rule %i' % offset, title='Series %i' % offset)
+
+    for i in range(offset, offset + n):
+        image = Image.objects.create(url='http://localhost/%i.jpg' % i)
+        channel = Channel.objects.create(
+            tuner=tuner, number=str(i), name=str(i), callsign='C%i' % i,
+            poster=image)
+        channel.images.add(image)
+        Device.objects.create(user_agent='querybudget/%i' % i)
+
+        for j in range(10):
+            program = Program.objects.create(
+                program_id='QB%i.%i' % (i, j), title='Program %i.%i' % (i, j),
+                poster=image)
+            program.categories.add(*categories)
+            program.images.add(image)
+            ProgramActor.objects.create(program=program, person=people[j % 3])
+            start = now + timedelta(minutes=30 * j - 15)
+            Schedule.objects.create(
+                channel=channel, program=program, rating=rating, start=start,
+                stop=start + timedelta(minutes=30), duration=1800)
+
+        media_class = Show if i % 2 else Movie
+        media = media_class.objects.create(
+            type=media_class.objects.DEFAULT_TYPE, program=program,
+            title=program.title, subtitle='', desc='', rating=rating,
+            poster=image, path='querybudget-%i.mpeg' % i)
+        media.categories.add(*categories)
+        media.images.add(image)
+        MediaActor.objects.create(media=media, person=people[0])
+        if media_class is Show:
+            Episode.objects.create(series=series, show=media)
+        Recording.objects.create(
+            program=program, channel=channel, media=media, start=start,
+            stop=start + timedelta(minutes=30),
+            status=Recording.STATUS_DONE)
+
+
+def _lists():
+    for prefix, viewset, basename in router.registry:
+        if issubclass(viewset, mixins.ListModelMixin):
+            yield prefix, viewset, reverse('%s-list' % basename)
+
+
+def _count(client, url):
+    # The log is limited, it may be full of _populate()'s queries.
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+
+    if response.status_code != 200:
+        raise AssertionError('%s: %i %s' % (
+            url, response.status_code, response.content[:200]))
+
+    return len(queries)
+
+
+def check(rows):
+    '''
+    Fill the database, with `rows` then 10 times as many, and count the
+    queries of each list. Returns (prefix, counts, budget, result) for each
+    list, result is 'ok', 'OVER' or 'GROWS'.
+
+    Also run by the test suite (main.tests).
+    '''
+    client = APIClient()
+    client.force_authenticate(User.objects.create_user(
+        'querybudget@localhost', 'querybudget'))
+
+    _populate(rows, 1)
+    small = {url: _count(client, url) for _, _, url in _lists()}
+    # More rows than fit in a page.
+    _populate(rows * 10, rows + 1)
+
+    results = []
+    for prefix, viewset, url in _lists():
+        budget = getattr(viewset, 'query_budget', None)
+        counts = small[url], _count(client, url)
+
+        if budget is not None and max(counts) > budget:
+            result = 'OVER'
+
+        elif counts[1] > counts[0]:
+            result = 'GROWS'
+
+        else:
+            result = 'ok'
+
+        results.append((prefix, counts, budget, result))
+
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Check the query count of each API list against its viewset\'s ' \
+           'query_budget.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=20,
+            help='Channels (and media) to start with, 10 times as many '
+                 'programs.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True)
+
+        try:
+            results = check(options['rows'])
+
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        failed = 0
+        for prefix, counts, budget, result in results:
+            failed += result != 'ok'
+            self.stdout.write('%-12s %4i %4i %6s  %s' % (
+                prefix, counts[0], counts[1],
+                '-' if budget is None else budget, result))
+
+        if failed:
+            raise CommandError('%i lists over budget' % failed)
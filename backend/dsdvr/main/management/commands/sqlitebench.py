@@ -0,0 +1,97 @@
+'''
+SQLite read latency benchmark.
+
+Times reads while another connection imports rows, the way a guide import
+does, with SQLite's defaults and with settings.SQLITE_PRAGMAS. Runs against a
+scratch database, not DSDVR's.
+'''
+
+import time
+import sqlite3
+import tempfile
+import multiprocessing
+
+from os.path import join as pathjoin
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.sqlite import apply_pragmas
+
+
+def _connect(path, pragmas):
+    db = sqlite3.connect(path, timeout=100, isolation_level=None)
+    apply_pragmas(db, pragmas)
+    return db
+
+
+def _import(path, pragmas, stop, batch):
+    # Many rows per transaction, like the guide import. In another process,
+    # like the worker, so it does not compete for the GIL.
+    db, n = _connect(path, pragmas), 0
+    while not stop.is_set():
+        db.execute('BEGIN IMMEDIATE')
+        db.executemany(
+            'INSERT INTO program (channel, title) VALUES (?, ?)',
+            [(i % 100, 'Program %i' % (n + i)) for i in range(batch)])
+        db.execute('COMMIT')
+        n += batch
+
+
+def _bench(path, pragmas, rows, batch, duration):
+    db = _connect(path, pragmas)
+    db.execute(
+        'CREATE TABLE program (id INTEGER PRIMARY KEY, channel INTEGER, '
+        'title TEXT)')
+    db.execute('CREATE INDEX program_channel ON program (channel)')
+    db.executemany(
+        'INSERT INTO program (channel, title) VALUES (?, ?)',
+        [(i % 100, 'Program %i' % i) for i in range(rows)])
+
+    stop = multiprocessing.Event()
+    writer = multiprocessing.Process(
+        target=_import, args=(path, pragmas, stop, batch))
+    writer.start()
+    # Let it start importing.
+    time.sleep(0.5)
+
+    reads, ends = [], time.monotonic() + duration
+    try:
+        while time.monotonic() < ends:
+            started = time.perf_counter()
+            db.execute(
+                'SELECT id, title FROM program WHERE channel = ? '
+                'ORDER BY id DESC LIMIT 50', (len(reads) % 100, )).fetchall()
+            reads.append(time.perf_counter() - started)
+
+    finally:
+        stop.set()
+        writer.join()
+
+    return sorted(reads)
+
+
+class Command(BaseCommand):
+    help = 'Time reads during a concurrent import, with and without ' \
+           'settings.SQLITE_PRAGMAS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--batch', type=int, default=5000)
+        parser.add_argument('--duration', type=float, default=10)
+
+    def handle(self, *args, **options):
+        profiles = (
+            ('defaults', {}),
+            ('tuned', settings.SQLITE_PRAGMAS),
+        )
+        with tempfile.TemporaryDirectory() as path:
+            for name, pragmas in profiles:
+                reads = _bench(
+                    pathjoin(path, '%s.sqlite3' % name), pragmas,
+                    options['rows'], options['batch'], options['duration'])
+                self.stdout.write(
+                    '%-8s %6i reads, p50 %.2fms, p99 %.2fms, max %.2fms' % (
+                        name, len(reads), reads[len(reads) // 2] * 1000,
+                        reads[len(reads) * 99 // 100] * 1000,
+                        reads[-1] * 1000))
@@ -0,0 +1,57 @@
+'''
+Worker service.
+
+Runs the scheduler and task workers, for deployments where web server
+processes do not (see settings.TASK_MODE). Several may run, they share the
+task queue and elect one of them to run the scheduler.
+
+Tasks' metrics are recorded in the worker, --metrics-port exports them (see
+main.metrics).
+'''
+
+import sys
+import time
+import signal
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main import schedule
+from main.metrics import serve
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class Command(BaseCommand):
+    help = 'Run the scheduler and task workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--metrics-port', type=int,
+            help='Export metrics at http://<address>:<port>/metrics.')
+        parser.add_argument(
+            '--metrics-address', default='127.0.0.1',
+            help='Address to export metrics at, other hosts must send '
+                 'DSDVR_METRICS_TOKEN.')
+
+    def handle(self, *args, **options):
+        # Exit normally on stop, so the scheduler resigns its leadership.
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+        if options['metrics_port']:
+            serve(options['metrics_port'], options['metrics_address'])
+
+        schedule.setup(settings.CRON)
+        self.stdout.write('Running %i task worker(s), ctrl-c to stop.' % (
+            sum(settings.TASK_WORKERS.values())))
+
+        try:
+            while True:
+                time.sleep(3600)
+
+        except KeyboardInterrupt:
+            pass
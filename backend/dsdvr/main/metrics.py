@@ -0,0 +1,293 @@
+'''
+Metrics.
+
+Counters, gauges and histograms kept in process, exported at /metrics in the
+Prometheus text format. Recording them is a dict update under a lock, cheap
+enough for any code path. Gauges that reflect database state are set by
+collectors, when scraped.
+
+Like all in process state, metrics are per process. Counters incremented in
+task processes are added to those of the worker that ran the Task (see
+main.processpool). Web server processes export theirs at /metrics (see
+main.views), the worker service has no web server and exports those of Tasks
+(durations, guide rows, recording bytes...) with `dsdvr worker
+--metrics-port`, see serve(). Scrape both.
+'''
+
+import hmac
+import logging
+import ipaddress
+import threading
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from django.conf import settings
+
+from main.profiling import BUCKETS, Histogram as Buckets
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+
+    return repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        # Report metrics without labels from the start.
+        if not self.labels:
+            self._values[()] = self._zero()
+
+    def _zero(self):
+        return 0
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        '''
+        Returns (name, labels, value) tuples.
+        '''
+        with self._lock:
+            values = dict(self._values)
+
+        for key, value in sorted(values.items()):
+            yield self.name, tuple(zip(self.labels, key)), value
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.help),
+            '# TYPE %s %s' % (self.name, self.type),
+        ]
+        for name, labels, value in self.samples():
+            lines.append('%s%s %s' % (
+                name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def _zero(self):
+        return Buckets()
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            buckets = self._values.get(key)
+            if buckets is None:
+                buckets = self._values[key] = Buckets()
+            buckets.observe(value)
+
+    def samples(self):
+        with self._lock:
+            values = {
+                key: (list(buckets.counts), buckets.count, buckets.sum)
+                for key, buckets in self._values.items()
+            }
+
+        for key, (counts, count, sum) in sorted(values.items()):
+            labels = tuple(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                cumulative += bucket
+                yield '%s_bucket' % self.name, \
+                    labels + (('le', _format_value(float(bound))), ), \
+                    cumulative
+            yield '%s_sum' % self.name, labels, sum
+            yield '%s_count' % self.name, labels, count
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, function):
+        '''
+        Register a function that updates metrics before they are rendered.
+        '''
+        self.collectors.append(function)
+        return function
+
+    def counters(self, since=None):
+        '''
+        Counter values, or their increase since an earlier snapshot.
+        '''
+        since = since or {}
+        counters = {}
+        for metric in self.metrics:
+            if not isinstance(metric, Counter):
+                continue
+
+            with metric._lock:
+                values = dict(metric._values)
+
+            for key, value in values.items():
+                value -= since.get((metric.name, key), 0)
+                if value:
+                    counters[(metric.name, key)] = value
+
+        return counters
+
+    def add_counters(self, counters):
+        '''
+        Add counter values, from another process.
+        '''
+        metrics = {metric.name: metric for metric in self.metrics}
+        for (name, key), value in counters.items():
+            metric = metrics[name]
+            metric.inc(value, **dict(zip(metric.labels, key)))
+
+    def render(self):
+        for collector in self.collectors:
+            try:
+                collector()
+
+            except Exception as e:
+                LOGGER.exception(e)
+
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def allowed(address, authorization):
+    '''
+    Whether a scraper may read metrics: it runs on this host, or it sends
+    settings.METRICS_TOKEN (`Authorization: Bearer <token>`).
+    '''
+    try:
+        if ipaddress.ip_address(address).is_loopback:
+            return True
+
+    except ValueError:
+        pass
+
+    if not settings.METRICS_TOKEN:
+        return False
+
+    return hmac.compare_digest(
+        authorization or '', 'Bearer %s' % settings.METRICS_TOKEN)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.partition('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        if not allowed(
+                self.client_address[0], self.headers.get('Authorization')):
+            self.send_error(403)
+            return
+
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format, *args)
+
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(port, address='127.0.0.1'):
+    '''
+    Export metrics at http://address:port/metrics, for processes without a
+    web server. Returns the server, it runs in a background thread.
+    '''
+    server = _MetricsServer((address, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    LOGGER.info('Exporting metrics at %s:%i/metrics', address, port)
+    return server
+
+TASK_DURATION = REGISTRY.register(Histogram(
+    'dsdvr_task_duration_seconds', 'Task run time.', ('task', )))
+TASKS = REGISTRY.register(Counter(
+    'dsdvr_tasks_total', 'Task runs by outcome.', ('task', 'status')))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'dsdvr_queue_depth', 'Queued tasks.', ('priority', )))
+RECORDINGS_ACTIVE = REGISTRY.register(Gauge(
+    'dsdvr_recordings_active', 'Recordings in progress.'))
+RECORDING_BYTES = REGISTRY.register(Counter(
+    'dsdvr_recording_bytes_total', 'Bytes written by recordings.'))
+TRANSCODE_SESSIONS = REGISTRY.register(Gauge(
+    'dsdvr_transcode_sessions', 'Streams being transcoded.'))
+SEGMENT_BYTES = REGISTRY.register(Counter(
+    'dsdvr_segment_bytes_total', 'Bytes of stream segments served.'))
+GUIDE_ROWS = REGISTRY.register(Counter(
+    'dsdvr_guide_rows_total', 'Guide programs imported.', ('source', )))
+DB_LOCK_WAIT = REGISTRY.register(Histogram(
+    'dsdvr_db_lock_wait_seconds',
+    'Time waiting for the database write lock (atomic(immediate=...)).'))
+DB_LOCKED = REGISTRY.register(Counter(
+    'dsdvr_db_locked_total',
+    'Transactions that gave up waiting for the database write lock.'))
+PROCESS_CPU = REGISTRY.register(Gauge(
+    'dsdvr_process_cpu_percent', 'CPU use of DSDVR processes.', ('kind', )))
+PROCESS_RESIDENT = REGISTRY.register(Gauge(
+    'dsdvr_process_resident_bytes', 'Resident memory of DSDVR processes.',
+    ('kind', )))
+PROCESS_IO = REGISTRY.register(Gauge(
+    'dsdvr_process_io_bytes_per_second', 'Disk I/O of DSDVR processes.',
+    ('kind', 'op')))
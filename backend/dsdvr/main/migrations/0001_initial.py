@@ -0,0 +1,39 @@
+# Generated by Django 2.1.7 on 2026-10-19 02:06
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('task_class', models.CharField(max_length=128)),
+                ('arguments', models.BinaryField()),
+                ('background', models.BooleanField(default=False)),
+                ('status', models.SmallIntegerField(default=1)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=1)),
+                ('available_at', models.DateTimeField()),
+                ('started', models.DateTimeField(null=True)),
+                ('lease_until', models.DateTimeField(null=True)),
+                ('done', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('summary', models.TextField(default='')),
+                ('created', models.DateTimeField()),
+                ('modified', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'available_at'], name='main_job_status_853f09_idx'),
+        ),
+    ]
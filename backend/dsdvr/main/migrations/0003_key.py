@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-19 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='key',
+            field=models.CharField(db_index=True, max_length=128, null=True),
+        ),
+    ]
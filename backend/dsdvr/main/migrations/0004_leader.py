@@ -0,0 +1,21 @@
+# Generated by Django 2.1.7 on 2026-10-19 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Leader',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('owner', models.CharField(max_length=128)),
+                ('lease_until', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.1.7 on 2026-10-19 02:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_leader'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('usage', models.BigIntegerField(default=0)),
+                ('files', models.BigIntegerField(default=0)),
+                ('reconciled', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
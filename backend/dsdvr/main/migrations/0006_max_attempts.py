@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-19 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='max_attempts',
+            field=models.PositiveSmallIntegerField(default=3),
+        ),
+    ]
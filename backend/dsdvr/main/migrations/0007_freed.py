@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-19 03:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_max_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storageusage',
+            name='freed',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
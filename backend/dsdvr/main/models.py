@@ -0,0 +1,173 @@
+import uuid
+import pickle
+import logging
+
+from django.db import models
+from django.utils import timezone
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+
+def estimate(done, total, created):
+    '''
+    Calculate (percent, elapsed, remaining) for a task's progress.
+    '''
+    percent = elapsed = remaining = 0
+
+    if total:
+        percent = int(done / total * 100)
+
+    if created:
+        # If the task has been started, calculate how many seconds it has
+        # been running.
+        elapsed = (timezone.now() - created).total_seconds()
+
+        # Then use the percentage of completion to determine how much more
+        # runtime remains.
+        if percent:
+            # If percentage of completion is 0, then estimate the remaining
+            # runtime by rounding percent up to 1%.
+            at_least_one = max(percent, 1)
+            remaining = elapsed / at_least_one * (100 - at_least_one)
+
+    return percent, elapsed, remaining
+
+
+class Job(models.Model):
+    '''
+    A persisted Task.
+
+    Rows are claimed by workers for a limited time (a lease), the lease is
+    renewed while the Task runs. A Job whose lease expires, because the
+    process died, is delivered again.
+    '''
+
+    STATUS_QUEUED = 1
+    STATUS_RUNNING = 2
+    STATUS_DONE = 0
+    STATUS_ERROR = 3
+    STATUS_TERMINATING = 4
+    STATUS_TERMINATED = 5
+
+    STATUS_FINISHED = (STATUS_DONE, STATUS_ERROR, STATUS_TERMINATED)
+
+    # Lower runs first.
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_LOW = 2
+
+    PRIORITY_NAMES = {
+        PRIORITY_HIGH: 'high',
+        PRIORITY_NORMAL: 'normal',
+        PRIORITY_LOW: 'low',
+    }
+
+    # Attempts before a failing Task is given up on, unless the Task says.
+    MAX_ATTEMPTS = 3
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'priority', 'available_at']),
+        ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    task_class = models.CharField(max_length=128)
+    arguments = models.BinaryField()
+    key = models.CharField(max_length=128, null=True, db_index=True)
+    background = models.BooleanField(default=False)
+    priority = models.SmallIntegerField(default=PRIORITY_NORMAL)
+    status = models.SmallIntegerField(default=STATUS_QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=MAX_ATTEMPTS)
+    available_at = models.DateTimeField()
+    started = models.DateTimeField(null=True)
+    lease_until = models.DateTimeField(null=True)
+    done = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    summary = models.TextField(default='')
+    created = models.DateTimeField()
+    modified = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return '%s %s' % (self.name, self.id)
+
+    @property
+    def name(self):
+        return self.task_class.rpartition('.')[2]
+
+    def get_arguments(self):
+        return pickle.loads(self.arguments)
+
+    def set_arguments(self, args, kwargs):
+        self.arguments = pickle.dumps((tuple(args), dict(kwargs)))
+
+    @property
+    def percent(self):
+        return estimate(self.done, self.total, self.created)[0]
+
+    @property
+    def elapsed(self):
+        return estimate(self.done, self.total, self.created)[1]
+
+    @property
+    def remaining(self):
+        return estimate(self.done, self.total, self.created)[2]
+
+    def stop(self):
+        '''
+        Signal the worker running this Job to terminate it.
+        '''
+        Job.objects.filter(id=self.id, status=Job.STATUS_RUNNING).update(
+            status=Job.STATUS_TERMINATING, modified=timezone.now())
+        # Queued Jobs never get to run.
+        Job.objects.filter(id=self.id, status=Job.STATUS_QUEUED).update(
+            status=Job.STATUS_TERMINATED, modified=timezone.now())
+
+
+class Leader(models.Model):
+    '''
+    A role held by one process at a time, such as running the scheduler.
+
+    The owner holds a lease on the row and renews it, when it stops doing so
+    another process may take over.
+    '''
+
+    name = models.CharField(max_length=32, primary_key=True)
+    owner = models.CharField(max_length=128)
+    lease_until = models.DateTimeField()
+
+    def __str__(self):
+        return '%s %s' % (self.name, self.owner)
+
+
+class StorageUsage(models.Model):
+    '''
+    Running totals of a storage area (see main.storage).
+    '''
+
+    name = models.CharField(max_length=32, primary_key=True)
+    usage = models.BigIntegerField(default=0)
+    files = models.BigIntegerField(default=0)
+    # Bytes removed, by the media remover for instance.
+    freed = models.BigIntegerField(default=0)
+    reconciled = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return self.name
+
+
+class TaskProfile(models.Model):
+    '''
+    A profiled Task run (see main.profiling), the API reads those of all
+    processes from here.
+    '''
+
+    name = models.CharField(max_length=128)
+    # Profile.as_dict(), JSON.
+    profile = models.TextField()
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,199 @@
+'''
+Process pool for CPU bound Tasks.
+
+Tasks that set `process = True` have their _run() executed in a pool of worker
+processes instead of the worker thread, so that parsing does not compete with
+request handling for the GIL. The worker thread waits for the result, relaying
+progress from the process and cancellation to it, the Task object in TASKS is
+updated as if it ran locally.
+
+Processes are spawned rather than forked and set up django themselves, they do
+not run the scheduler or task workers (see main.apps).
+'''
+
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+
+import psutil
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from main.metrics import REGISTRY
+from main.profiling import Profile
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+# Set in task processes.
+PROCESS_ENV = 'DSDVR_TASK_PROCESS'
+# Seconds between progress updates and checks for cancellation.
+RELAY_INTERVAL = 0.5
+
+
+class ProcessTaskError(Exception):
+    pass
+
+
+class Relay(object):
+    '''
+    Task side of the connection to the worker thread. Progress is sent at
+    most every RELAY_INTERVAL, unless the summary changes, and the exit event
+    is polled from a thread so _check_exit() stays cheap.
+    '''
+
+    def __init__(self, messages, exit):
+        self.messages = messages
+        self.exit = exit
+        self.sent = 0
+        self.running = True
+
+    def progress(self, done, total, summary=None):
+        now = time.time()
+        if summary is None and now - self.sent < RELAY_INTERVAL:
+            return
+
+        self.messages.put(('progress', done, total, summary))
+        self.sent = now
+
+    def watch(self, task):
+        def _watch():
+            while self.running:
+                if self.exit.is_set():
+                    task.exit.set()
+                    break
+                time.sleep(RELAY_INTERVAL)
+
+        watcher = threading.Thread(target=_watch)
+        watcher.daemon = True
+        watcher.start()
+
+
+def _initialize():
+    os.environ[PROCESS_ENV] = '1'
+
+    import django
+    django.setup()
+
+
+def _execute(task_class, args, kwargs, id, messages, exit):
+    from api.tasks import TaskTerminationException
+
+    messages.put(('pid', os.getpid()))
+
+    task = import_string(task_class)(args=args, kwargs=kwargs, id=id)
+    task.relay = Relay(messages, exit)
+    task.relay.watch(task)
+
+    # Counters this task increments are sent back to the worker.
+    counters = REGISTRY.counters()
+
+    # Phases are timed by the worker thread, from the progress relayed.
+    profile = None
+    if settings.PROFILE_TASKS:
+        profile = Profile(task.name, dump=settings.PROFILE_DUMP).start()
+
+    try:
+        task._run(*args, **kwargs)
+        status = 'done'
+
+    except TaskTerminationException:
+        status = 'terminated'
+
+    except Exception as e:
+        LOGGER.debug('Error in task process', exc_info=True)
+        status = 'error'
+        task.summary = str(e)
+
+    finally:
+        task.relay.running = False
+        if profile is not None:
+            profile.stop()
+
+    usage = profile.usage() if profile is not None else None
+    return status, task.done, task.total, task.summary, usage, \
+        REGISTRY.counters(since=counters)
+
+
+class ProcessPool(object):
+    '''
+    Started on first use, sized by settings.TASK_PROCESSES.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._manager = None
+
+    def _start(self):
+        with self._lock:
+            if self._pool is None:
+                LOGGER.debug(
+                    'Starting %i task process(es)', settings.TASK_PROCESSES)
+                context = multiprocessing.get_context('spawn')
+                self._manager = context.Manager()
+                self._pool = context.Pool(
+                    settings.TASK_PROCESSES, initializer=_initialize)
+
+            return self._pool, self._manager
+
+    def run(self, task):
+        '''
+        Execute task._run() in a process, blocking until it is complete.
+
+        Raises TaskTerminationException if the task was stopped, and
+        ProcessTaskError if it failed.
+        '''
+        from api.tasks import TaskTerminationException
+
+        pool, manager = self._start()
+        messages, exit = manager.Queue(), manager.Event()
+        task_class = '%s.%s' % (
+            task.__class__.__module__, task.__class__.__qualname__)
+        result = pool.apply_async(
+            _execute,
+            (task_class, task.args, task.kwargs, task.id, messages, exit))
+
+        pid = None
+        while True:
+            if task.exit.is_set() and not exit.is_set():
+                exit.set()
+
+            try:
+                message = messages.get(timeout=RELAY_INTERVAL)
+
+            except queue.Empty:
+                if result.ready():
+                    break
+
+                # The pool replaces a process that dies, but the result of
+                # the task it was running never arrives.
+                if pid is not None and not psutil.pid_exists(pid):
+                    raise ProcessTaskError('Task process %i died' % pid)
+
+                continue
+
+            if message[0] == 'pid':
+                pid = message[1]
+
+            elif message[0] == 'progress':
+                task._update_progress(*message[1:])
+
+        status, done, total, summary, usage, counters = result.get()
+        task._update_progress(done, total, summary)
+        REGISTRY.add_counters(counters)
+
+        if usage is not None and task.profile is not None:
+            task.profile.add(usage)
+
+        if status == 'terminated':
+            raise TaskTerminationException('Terminate process')
+
+        elif status == 'error':
+            raise ProcessTaskError(summary)
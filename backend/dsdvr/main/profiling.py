@@ -0,0 +1,406 @@
+'''
+Profiling.
+
+Opt-in instrumentation, to find where the time of a slow Task or request goes
+without attaching a debugger:
+
+ - settings.PROFILE_TASKS: time Task runs (wall and CPU), count their queries
+   and query time, and time their phases. A phase is the time between two
+   summaries the Task reports via _set_progress().
+ - settings.PROFILE_DUMP: also profile Task runs with cProfile ('cprofile')
+   or pyinstrument ('pyinstrument', when installed). The latest dump of each
+   Task class is written to STORAGE_TEMP/profiles/.
+ - settings.PROFILE_REQUESTS: the fraction of requests that is timed.
+
+Admins fetch results via /api/profiling/. Task runs are saved to the database
+(main.models.TaskProfile), Tasks may run in another process than the API (the
+worker service, see settings.TASK_MODE). Request timings are kept in memory
+by the process that served them (PROFILES), so they are those of the web
+server process that answers.
+'''
+
+import os
+import re
+import json
+import time
+import bisect
+import cProfile
+import logging
+import threading
+
+from os.path import join as pathjoin
+
+from django.conf import settings
+from django.db import connection
+
+from constance import config
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+# Upper bounds (seconds) of histogram buckets.
+BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900,
+    3600, float('inf'),
+)
+# Task runs listed in full.
+RECENT = 50
+# Task runs kept in the database, the stats are of these.
+KEPT = 1000
+# Phases tracked per Task class, the rest are counted as OTHER_PHASE.
+MAX_PHASES = 50
+OTHER_PHASE = '...'
+
+# Python < 3.7 has no per thread CPU clock.
+_thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+def _phase_name(summary):
+    # 'Imported 10 of 200' and 'Imported 20 of 200' are the same phase.
+    return re.sub(r'\d+', '#', summary)
+
+
+class Histogram(object):
+    '''
+    Distribution of observed values, over BUCKETS.
+    '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        '''
+        Estimate, the upper bound of the bucket holding the q quantile.
+        '''
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return min(bound, self.max)
+
+        return 0.0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / max(self.count, 1), 6),
+            'max': round(self.max, 6),
+            'p50': round(self.quantile(0.5), 6),
+            'p95': round(self.quantile(0.95), 6),
+        }
+
+
+class QueryCounter(object):
+    '''
+    Counts the queries, and their time, made on the current thread's
+    connection while entered.
+    '''
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - started
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self._wrapper.__exit__(*args)
+        self._wrapper = None
+
+
+class Profile(object):
+    '''
+    A single Task run.
+    '''
+
+    def __init__(self, name, dump=None):
+        self.name = name
+        self.dump = dump
+        self.status = None
+        self.wall = self.cpu = 0.0
+        self.phases = {}
+        self.dumped = None
+        self._counter = QueryCounter()
+        self._profiler = None
+        self._phase = None
+
+    def start(self, summary=None):
+        self._started = time.perf_counter()
+        self._cpu = _thread_time()
+        self._counter.__enter__()
+        self._start_dump()
+        if summary:
+            self.phase(summary)
+        return self
+
+    def phase(self, summary):
+        '''
+        The Task moved on to a new phase.
+        '''
+        now, name = time.perf_counter(), _phase_name(summary)
+        if self._phase is not None:
+            if name == self._phase[0]:
+                return
+
+            self._end_phase(now)
+
+        self._phase = (name, now)
+
+    def _end_phase(self, now):
+        name, started = self._phase
+        self.phases[name] = self.phases.get(name, 0.0) + now - started
+
+    def stop(self, status=None):
+        now = time.perf_counter()
+        if self._phase is not None:
+            self._end_phase(now)
+            self._phase = None
+
+        self.status = status
+        self.wall = now - self._started
+        self.cpu += _thread_time() - self._cpu
+        self._counter.__exit__(None, None, None)
+        self._stop_dump()
+
+    def usage(self):
+        '''
+        Resources used, for a Profile in another process to add().
+        '''
+        return {
+            'cpu': self.cpu,
+            'queries': self._counter.queries,
+            'query_time': self._counter.query_time,
+            'dumped': self.dumped,
+        }
+
+    def add(self, usage):
+        self.cpu += usage['cpu']
+        self._counter.queries += usage['queries']
+        self._counter.query_time += usage['query_time']
+        self.dumped = usage['dumped'] or self.dumped
+
+    @property
+    def queries(self):
+        return self._counter.queries
+
+    @property
+    def query_time(self):
+        return self._counter.query_time
+
+    def _dump_path(self, extension):
+        path = pathjoin(config.STORAGE_TEMP, 'profiles')
+        os.makedirs(path, exist_ok=True)
+        return pathjoin(path, '%s.%s' % (self.name, extension))
+
+    def _start_dump(self):
+        if self.dump == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+        elif self.dump == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+
+            except ImportError:
+                LOGGER.warning('pyinstrument is not installed')
+                return
+
+            self._profiler = Profiler()
+            self._profiler.start()
+
+    def _stop_dump(self):
+        if self._profiler is None:
+            return
+
+        profiler, self._profiler = self._profiler, None
+        try:
+            if self.dump == 'cprofile':
+                profiler.disable()
+                self.dumped = self._dump_path('prof')
+                profiler.dump_stats(self.dumped)
+
+            else:
+                profiler.stop()
+                self.dumped = self._dump_path('html')
+                with open(self.dumped, 'w') as f:
+                    f.write(profiler.output_html())
+
+        except Exception as e:
+            LOGGER.warning('Could not write profile of %s: %s', self.name, e)
+            self.dumped = None
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'status': self.status,
+            'wall': round(self.wall, 6),
+            'cpu': round(self.cpu, 6),
+            'queries': self.queries,
+            'query_time': round(self.query_time, 6),
+            'phases': sorted(
+                ({'name': name, 'time': round(seconds, 6)}
+                 for name, seconds in self.phases.items()),
+                key=lambda phase: phase['time'], reverse=True),
+            'dump': self.dumped,
+        }
+
+
+class TaskStats(object):
+    def __init__(self):
+        self.wall = Histogram()
+        self.cpu = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.phases = {}
+        self.dump = None
+
+    def add(self, profile):
+        '''
+        Add a Task run, Profile.as_dict().
+        '''
+        self.wall.observe(profile['wall'])
+        self.cpu += profile['cpu']
+        self.queries += profile['queries']
+        self.query_time += profile['query_time']
+        self.dump = profile['dump'] or self.dump
+
+        for phase in profile['phases']:
+            name = phase['name']
+            if name not in self.phases and len(self.phases) >= MAX_PHASES:
+                name = OTHER_PHASE
+            self.phases.setdefault(name, Histogram()).observe(phase['time'])
+
+    def as_dict(self):
+        runs = max(self.wall.count, 1)
+        return {
+            'wall': self.wall.as_dict(),
+            'cpu': round(self.cpu / runs, 6),
+            'queries': round(self.queries / runs, 2),
+            'query_time': round(self.query_time / runs, 6),
+            'phases': {
+                name: histogram.as_dict()
+                for name, histogram in self.phases.items()
+            },
+            'dump': self.dump,
+        }
+
+
+class RequestStats(object):
+    def __init__(self):
+        self.wall = Histogram()
+        self.queries = 0
+        self.query_time = 0.0
+
+    def add(self, wall, counter):
+        self.wall.observe(wall)
+        self.queries += counter.queries
+        self.query_time += counter.query_time
+
+    def as_dict(self):
+        requests = max(self.wall.count, 1)
+        return {
+            'wall': self.wall.as_dict(),
+            'queries': round(self.queries / requests, 2),
+            'query_time': round(self.query_time / requests, 6),
+        }
+
+
+class Profiles(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.since = time.time()
+        self.requests = {}
+
+    def reset(self):
+        '''
+        Forget Task runs, and this process' requests.
+        '''
+        from main.models import TaskProfile
+
+        TaskProfile.objects.all().delete()
+        with self._lock:
+            self.since = time.time()
+            self.requests = {}
+
+    def add_task(self, profile):
+        '''
+        Save a Task run, keeps the latest KEPT.
+        '''
+        from main.models import TaskProfile
+
+        try:
+            saved = TaskProfile.objects.create(
+                name=profile.name, profile=json.dumps(profile.as_dict()))
+            TaskProfile.objects.filter(id__lte=saved.id - KEPT).delete()
+
+        except Exception as e:
+            LOGGER.warning('Could not save profile of %s: %s', profile.name, e)
+
+    def add_request(self, key, wall, counter):
+        with self._lock:
+            self.requests.setdefault(key, RequestStats()).add(wall, counter)
+
+    def stats(self):
+        from main.models import TaskProfile
+
+        tasks, recent = {}, []
+        for profile in TaskProfile.objects.order_by('-id') \
+                .values_list('profile', flat=True).iterator():
+            profile = json.loads(profile)
+            tasks.setdefault(profile['name'], TaskStats()).add(profile)
+            if len(recent) < RECENT:
+                recent.append(profile)
+
+        with self._lock:
+            return {
+                'since': self.since,
+                'pid': os.getpid(),
+                'tasks': {
+                    name: stats.as_dict() for name, stats in tasks.items()
+                },
+                'recent': recent,
+                'requests': {
+                    key: stats.as_dict()
+                    for key, stats in self.requests.items()
+                },
+            }
+
+
+PROFILES = Profiles()
+
+
+def profile_task(task):
+    '''
+    Start profiling a Task run, returns None unless enabled.
+    '''
+    if not settings.PROFILE_TASKS:
+        return None
+
+    # Task processes profile _run() themselves.
+    dump = None if task.process else settings.PROFILE_DUMP
+    return Profile(task.name, dump=dump).start(task.summary)
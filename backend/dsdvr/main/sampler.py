@@ -0,0 +1,285 @@
+'''
+Process sampler.
+
+Samples the CPU, memory and I/O of DSDVR's processes every few seconds, from a
+background thread, and keeps a short history of each:
+
+ - this process (and the worker, when tasks run in `dsdvr worker` on this
+   host).
+ - recorders, Recording.pid.
+ - transcoders, Stream.pid.
+
+The status endpoint and the metrics exporter read the samples, so neither
+pays for psutil calls when serving a request. CPU percent is measured between
+two samples, it is 0 until a process was sampled twice.
+'''
+
+import os
+import time
+import socket
+import logging
+import threading
+
+from collections import deque
+
+import psutil
+
+from main.metrics import PROCESS_CPU, PROCESS_RESIDENT, PROCESS_IO
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+# How often (seconds) processes are sampled.
+SAMPLER_INTERVAL = 5
+# Samples kept per process (and of the totals), 5 minutes.
+SAMPLER_HISTORY = 60
+
+KIND_MAIN = 'main'
+KIND_WORKER = 'worker'
+KIND_RECORDER = 'recorder'
+KIND_TRANSCODER = 'transcoder'
+KINDS = (KIND_MAIN, KIND_WORKER, KIND_RECORDER, KIND_TRANSCODER)
+
+
+def _worker_pid():
+    '''
+    The pid of the worker holding the scheduler, if it runs on this host.
+    '''
+    from main.models import Leader
+
+    owner = Leader.objects.filter(name='scheduler') \
+        .values_list('owner', flat=True).first()
+    if owner is None:
+        return None
+
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return None
+
+    return int(pid)
+
+
+def _find_pids():
+    from api.models import Recording, Stream
+
+    pids = {os.getpid(): KIND_MAIN}
+    worker = _worker_pid()
+    if worker is not None:
+        pids.setdefault(worker, KIND_WORKER)
+
+    for pid in Recording.objects.filter(
+            pid__isnull=False).values_list('pid', flat=True):
+        pids.setdefault(pid, KIND_RECORDER)
+
+    for pid in Stream.objects.filter(
+            pid__isnull=False).values_list('pid', flat=True):
+        pids.setdefault(pid, KIND_TRANSCODER)
+
+    return pids
+
+
+class Sample(object):
+    __slots__ = ('time', 'cpu_percent', 'rss', 'read_bytes', 'write_bytes')
+
+    def __init__(self, time, cpu_percent=0.0, rss=0, read_bytes=0,
+                 write_bytes=0):
+        self.time = time
+        self.cpu_percent = cpu_percent
+        self.rss = rss
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+
+    def as_dict(self):
+        return {
+            'time': round(self.time, 2),
+            'cpu_percent': round(self.cpu_percent, 2),
+            'mem_usage': self.rss,
+            'read_bytes': self.read_bytes,
+            'write_bytes': self.write_bytes,
+        }
+
+
+class SampledProcess(object):
+    def __init__(self, process, kind, history=SAMPLER_HISTORY):
+        self.process = process
+        self.kind = kind
+        # Identifies the process, in case the pid is reused.
+        self.created = process.create_time()
+        self.samples = deque(maxlen=history)
+        self.cpu_times = (0.0, 0.0)
+
+    def sample(self, now):
+        process = self.process
+        with process.oneshot():
+            # The first call only starts the measurement.
+            sample = Sample(
+                now, process.cpu_percent(), process.memory_info().rss)
+            self.cpu_times = tuple(process.cpu_times()[:2])
+
+            try:
+                io = process.io_counters()
+                sample.read_bytes = io.read_bytes
+                sample.write_bytes = io.write_bytes
+
+            except (AttributeError, psutil.AccessDenied):
+                # Not supported on all platforms, or not our process.
+                pass
+
+        self.samples.append(sample)
+        return sample
+
+    def rates(self):
+        '''
+        I/O bytes per second, between the last two samples.
+        '''
+        if len(self.samples) < 2:
+            return 0.0, 0.0
+
+        first, last = self.samples[-2], self.samples[-1]
+        elapsed = max(last.time - first.time, 0.001)
+        return (
+            max(last.read_bytes - first.read_bytes, 0) / elapsed,
+            max(last.write_bytes - first.write_bytes, 0) / elapsed,
+        )
+
+
+class ProcessSampler(object):
+    def __init__(self, interval=SAMPLER_INTERVAL, history=SAMPLER_HISTORY):
+        self.interval = interval
+        self.history = history
+        # pid: SampledProcess
+        self.processes = {}
+        # Sums over all processes, per sample, oldest first.
+        self.totals = deque(maxlen=history)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+
+            LOGGER.info('Starting process sampler')
+            self.thread = threading.Thread(target=self._loop)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.sample()
+
+            except Exception as e:
+                LOGGER.exception(e)
+
+            time.sleep(self.interval)
+
+    def _track(self, pids):
+        processes = {}
+        for pid, kind in pids.items():
+            sampled = self.processes.get(pid)
+            try:
+                if sampled is None or sampled.created != \
+                        sampled.process.create_time():
+                    sampled = SampledProcess(
+                        psutil.Process(pid), kind, self.history)
+
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+
+            sampled.kind = kind
+            processes[pid] = sampled
+
+        return processes
+
+    def sample(self):
+        processes = self._track(_find_pids())
+        now = time.time()
+        # kind: [cpu_percent, rss, read/s, write/s]
+        usage = {kind: [0.0, 0, 0.0, 0.0] for kind in KINDS}
+
+        for pid, sampled in list(processes.items()):
+            try:
+                sample = sampled.sample(now)
+
+            except (psutil.NoSuchProcess, psutil.ZombieProcess,
+                    psutil.AccessDenied) as e:
+                LOGGER.debug('Could not sample %i: %s', pid, e)
+                processes.pop(pid)
+                continue
+
+            read, write = sampled.rates()
+            kind = usage[sampled.kind]
+            kind[0] += sample.cpu_percent
+            kind[1] += sample.rss
+            kind[2] += read
+            kind[3] += write
+
+        cpu, rss, read, write = map(sum, zip(*usage.values()))
+        total = {
+            'time': round(now, 2),
+            'cpu_percent': round(cpu, 2),
+            'mem_usage': rss,
+            'read_rate': round(read),
+            'write_rate': round(write),
+        }
+
+        with self.lock:
+            self.processes = processes
+            self.totals.append(total)
+
+        for kind, (cpu, rss, read, write) in usage.items():
+            PROCESS_CPU.set(cpu, kind=kind)
+            PROCESS_RESIDENT.set(rss, kind=kind)
+            PROCESS_IO.set(read, kind=kind, op='read')
+            PROCESS_IO.set(write, kind=kind, op='write')
+
+    def get(self, pid):
+        '''
+        Samples of a single process, oldest first.
+        '''
+        with self.lock:
+            sampled = self.processes.get(pid)
+            if sampled is None:
+                return []
+
+            return [sample.as_dict() for sample in sampled.samples]
+
+    def stats(self):
+        self.start()
+
+        with self.lock:
+            processes = list(self.processes.values())
+            totals = list(self.totals)
+
+        stats = {
+            'uptime': 0,
+            'count': len(processes),
+            'cpu_percent': 0,
+            'cpu_usage': {'user': 0, 'system': 0},
+            'mem_percent': 0.0,
+            'mem_usage': 0,
+            'history': totals,
+        }
+
+        memory = psutil.virtual_memory().total
+        for sampled in processes:
+            if not sampled.samples:
+                continue
+
+            if sampled.kind == KIND_MAIN:
+                stats['uptime'] = round(time.time() - sampled.created, 2)
+
+            sample = sampled.samples[-1]
+            stats['cpu_percent'] += round(sample.cpu_percent, 2)
+            stats['mem_percent'] += round(100.0 * sample.rss / memory, 2)
+            stats['mem_usage'] += sample.rss
+            stats['cpu_usage']['user'] += sampled.cpu_times[0]
+            stats['cpu_usage']['system'] += sampled.cpu_times[1]
+
+        return stats
+
+
+SAMPLER = ProcessSampler()
@@ -1,154 +1,415 @@
+'''
+Scheduler and task workers.
+
+The scheduler enqueues the Tasks in settings.CRON as they fall due, workers
+run queued Tasks. Either may run in several processes, the queue is shared via
+the database (see main.taskqueue) and only the process elected leader runs
+scheduled Tasks.
+'''
+
 import os
 import time
+import heapq
+import atexit
+import socket
 import logging
+import itertools
 import threading
-import fcntl
-import errno
-import tempfile
-import queue
 
-from os.path import join as pathjoin
+from datetime import datetime, timedelta
 
-from datetime import datetime
-
-import psutil
 from croniter import croniter
 
+from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.module_loading import import_string
 
+from main.taskqueue import TaskQueue, POLL_INTERVAL
+from main.processpool import ProcessPool
+
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
 LOGGER.addHandler(logging.NullHandler())
 
-SCHEDULE = {}
+SCHEDULE = []
 SCHEDULER = None
-SCHEDULER_LOCK = 'dsdvr.lock'
-TASK_QUEUE = queue.Queue()
+TASK_QUEUE = TaskQueue()
+PROCESS_POOL = ProcessPool()
 TASK_THREADPOOL = []
 
+MISFIRE_SKIP = 'skip'
+MISFIRE_ONCE = 'once'
+MISFIRE_ALL = 'all'
+# Seconds a run may be late before the misfire policy applies.
+MISFIRE_GRACE = 60
+# Most missed runs MISFIRE_ALL catches up on.
+CATCHUP_LIMIT = 10
+# Seconds an elected leader (the scheduler, the recording watchdog) leads
+# without renewal.
+LEADER_LEASE = 30
+# Seconds between renewals, or attempts to be elected.
+LEADER_HEARTBEAT = 10
+
 
 class Cron(object):
+    '''
+    Fires according to a crontab, in the local timezone.
+    '''
+
     def __init__(self, crontab):
         self.crontab = crontab
-        self._cron = croniter(crontab)
-        self._next = self._cron.get_next(datetime)
+        # Validate.
+        croniter(crontab)
 
-    def is_due(self):
-        curr_time = datetime.now()  # + timedelta(minutes=1)
-        curr_time = curr_time.replace(second=0, microsecond=0)
+    def next(self, after):
+        return croniter(
+            self.crontab, timezone.localtime(after)).get_next(datetime)
 
-        # Is this task due?
-        if self._next > curr_time:
-            return False
+    def __str__(self):
+        return self.crontab
 
-        self._next = self._cron.get_next(datetime)
-        return True
 
-    def is_every_minute(self):
-        return self.crontab.replace(' ', '') == '*****'
+class Interval(object):
+    '''
+    Fires every so many seconds.
+    '''
 
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError('Interval must be positive')
+        self.seconds = seconds
 
-def _is_parent_python():
-    pprocess = psutil.Process().parent()
-    return pprocess.name() == 'python'
+    def next(self, after):
+        return after + timedelta(seconds=self.seconds)
 
+    def __str__(self):
+        return 'every %ss' % self.seconds
 
-def _check_schedule():
+
+class ScheduledTask(object):
     '''
-    Runs each minute in order to execute any due Tasks.
+    A Task class and when to enqueue it.
+
+    Options:
+     - misfire: what to do when the scheduler is more than `grace` seconds
+       late for a run, MISFIRE_SKIP it, MISFIRE_ONCE run it once for all
+       missed runs (default), or MISFIRE_ALL run it once for each missed run
+       (at most CATCHUP_LIMIT).
+     - grace: seconds a run may be late and still count as on time.
+     - startup: run once when the scheduler starts (default).
     '''
-    first = True
 
-    def _inner():
-        for cron, task_class in SCHEDULE.items():
-            # On the first iteration, run all tasks.
-            if first:
-                LOGGER.info('Running startup task...')
+    def __init__(self, trigger, task_class, misfire=None, grace=None,
+                 startup=True):
+        if misfire is None:
+            misfire = MISFIRE_ONCE
+
+        if misfire not in (MISFIRE_SKIP, MISFIRE_ONCE, MISFIRE_ALL):
+            raise ValueError('Invalid misfire policy "%s"' % misfire)
+
+        self.trigger = trigger
+        self.task_class = task_class
+        self.misfire = misfire
+        self.grace = MISFIRE_GRACE if grace is None else grace
+        self.startup = startup
+        self.due = None
+        # Stats.
+        self.fires = 0
+        self.runs = 0
+        self.misfires = 0
+        self.lateness = 0.0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+
+    def fire(self, now):
+        '''
+        Enqueue the Task as many times as the misfire policy says, then
+        schedule the next run. Returns the number of runs.
+        '''
+        lateness = (now - self.due).total_seconds()
+        runs = 1
+
+        if lateness > self.grace:
+            self.misfires += 1
+
+            # Count the runs we missed.
+            missed, due = 0, self.due
+            while due <= now and missed < CATCHUP_LIMIT:
+                missed += 1
+                due = self.trigger.next(due)
+
+            if self.misfire == MISFIRE_SKIP:
+                runs = 0
+
+            elif self.misfire == MISFIRE_ALL:
+                runs = missed
+
+            LOGGER.warning(
+                '%s is %.1fs late, missed %i run(s), running %i',
+                self.task_class, lateness, missed, runs)
+
+        self.fires += 1
+        self.lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.total_lateness += lateness
+
+        for _ in range(runs):
+            LOGGER.info('Running task %s', self.task_class)
+            import_string(self.task_class)().enqueue()
+        self.runs += runs
+
+        # Next run follows the scheduled time, not now, so there is no drift.
+        # But never schedule a run in the past.
+        self.due = self.trigger.next(self.due)
+        if self.due <= now:
+            self.due = self.trigger.next(now)
+
+        return runs
+
+    def stats(self):
+        return {
+            'task': self.task_class,
+            'schedule': str(self.trigger),
+            'due': self.due,
+            'runs': self.runs,
+            'misfires': self.misfires,
+            'lateness': round(self.lateness, 3),
+            'max_lateness': round(self.max_lateness, 3),
+            'avg_lateness': round(
+                self.total_lateness / max(self.fires, 1), 3),
+        }
+
+
+class Election(object):
+    '''
+    Elects one process to a role, by lease on a Leader row (see
+    main.models.Leader).
 
-            elif not cron.is_due():
-                continue
+    `term` counts the times this process took the role from another (or
+    first took it). Renewing a lease, even one that lapsed without another
+    process taking it, continues the term.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.owner = '%s:%i' % (socket.gethostname(), os.getpid())
+        self.elected = False
+        self.term = 0
+
+    def campaign(self):
+        '''
+        Take or renew the lease, returns True while this process leads.
+        '''
+        from main.models import Leader
+
+        now = timezone.now()
+        lease_until = now + timedelta(seconds=LEADER_LEASE)
+
+        with transaction.atomic(immediate='leader'):
+            owner = Leader.objects.filter(name=self.name) \
+                .values_list('owner', flat=True).first()
+
+            elected = Leader.objects.filter(
+                Q(owner=self.owner) | Q(lease_until__lt=now),
+                name=self.name).update(
+                    owner=self.owner, lease_until=lease_until)
+
+            if not elected:
+                _, elected = Leader.objects.get_or_create(
+                    name=self.name, defaults={
+                        'owner': self.owner, 'lease_until': lease_until})
 
-            LOGGER.info('Running task %s', task_class)
-            task_class = import_string(task_class)
-            task_class().enqueue()
+        if elected and owner != self.owner:
+            self.term += 1
 
-    while True:
+        if elected != self.elected:
+            LOGGER.info(
+                '%s %s leader in pid %i', self.name,
+                'elected' if elected else 'no longer', os.getpid())
+        self.elected = bool(elected)
+        return self.elected
+
+    def resign(self):
+        from main.models import Leader
+
+        if self.elected:
+            Leader.objects.filter(name=self.name, owner=self.owner).delete()
+            self.elected = False
+
+
+class Scheduler(object):
+    '''
+    Keeps ScheduledTasks in a heap ordered by their next run, and sleeps
+    until the earliest one is due.
+    '''
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.election = Election('scheduler')
+        self.wakeup = threading.Event()
+        self.thread = None
+        self._heap = []
+        self._seq = itertools.count()
+
+    def _push(self, task):
+        heapq.heappush(self._heap, (task.due, next(self._seq), task))
+
+    def _reset(self):
+        '''
+        Schedule the next runs, from now.
+        '''
+        now = timezone.now()
+        self._heap = []
+        for task in self.tasks:
+            task.due = now if task.startup else task.trigger.next(now)
+            self._push(task)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+        # Let another process take over right away on shutdown.
+        atexit.register(self.election.resign)
+
+    def _campaign(self):
         try:
-            _inner()
+            return self.election.campaign()
 
         except Exception as e:
-            LOGGER.exception(e)
+            # The leader table does not exist until migrations are run.
+            LOGGER.warning('Could not elect scheduler: %s', e)
+            self.election.elected = False
+            return False
 
-        first = False
-        time.sleep(60)
+    def _loop(self):
+        campaigned, term = 0, 0
+        while True:
+            if time.monotonic() - campaigned >= LEADER_HEARTBEAT:
+                campaigned = time.monotonic()
+                if self._campaign() and self.election.term != term:
+                    # The previous leader ran the schedule until now. When
+                    # this process leads again after failing to renew, it
+                    # carries on with its own schedule.
+                    term = self.election.term
+                    self._reset()
+
+            if not self.election.elected or not self._heap:
+                self.wakeup.wait(LEADER_HEARTBEAT)
+                self.wakeup.clear()
+                continue
 
+            due, _, task = self._heap[0]
+            delay = (due - timezone.now()).total_seconds()
+            if delay > 0:
+                self.wakeup.wait(min(
+                    delay, campaigned + LEADER_HEARTBEAT - time.monotonic()))
+                self.wakeup.clear()
+                continue
 
-def _start_scheduler():
-    # Django runserver forks. We don't want our scheduler running in the parent
-    # since it survives auto-restart. This is a temporary workaround...
-    if not _is_parent_python():
-        return
+            heapq.heappop(self._heap)
+            try:
+                task.fire(timezone.now())
 
-    lock_file = pathjoin(tempfile.gettempdir(), SCHEDULER_LOCK)
-    fd = os.open(lock_file, os.O_CREAT | os.O_RDWR)
-    try:
-        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        LOGGER.info('Scheduler lock obtained')
+            except Exception as e:
+                LOGGER.exception(e)
+                # Try again at the next scheduled time.
+                task.due = task.trigger.next(timezone.now())
+
+            self._push(task)
+
+    def stats(self):
+        return [task.stats() for task in self.tasks]
 
-    except IOError as e:
-        if e.errno != errno.EAGAIN:
-            raise
-        LOGGER.info('Scheduler lock held by another process')
-        return
+
+def _start_scheduler():
+    global SCHEDULER
 
     LOGGER.info('Starting scheduler in pid %i', os.getpid())
-    SCHEDULER = threading.Thread(target=_check_schedule)
-    SCHEDULER.daemon = True
+    SCHEDULER = Scheduler(SCHEDULE)
     SCHEDULER.start()
 
 
 def _start_threadpool():
-    def _worker():
+    def _worker(priority):
         while True:
             LOGGER.debug('Wating for task...')
-            task = TASK_QUEUE.get()
+            try:
+                task = TASK_QUEUE.get(priority)
+
+            except Exception as e:
+                # The job table does not exist until migrations are run.
+                LOGGER.warning('Could not get task: %s', e)
+                time.sleep(POLL_INTERVAL)
+                continue
+
             LOGGER.debug('Got task: %s', task.__class__.__name__)
             task.run()
 
-    # TODO: configure thread pool size?
-    LOGGER.debug('Starting thread pool')
-    for _ in range(2):
-        worker = threading.Thread(target=_worker)
-        worker.daemon = True
-        worker.start()
-        TASK_THREADPOOL.append(worker)
+    # Tasks put by this process are kept to be run by its workers.
+    TASK_QUEUE.serving = True
+
+    # Each lane takes tasks of its priority or higher.
+    for priority, count in sorted(settings.TASK_WORKERS.items()):
+        LOGGER.debug(
+            'Starting %i worker(s) for priority %i', count, priority)
+        for _ in range(count):
+            worker = threading.Thread(target=_worker, args=(priority,))
+            worker.daemon = True
+            worker.start()
+            TASK_THREADPOOL.append(worker)
+
+
+def schedule_stats():
+    '''
+    Run counts and lateness (seconds past due when enqueued) of scheduled
+    tasks. Empty in processes that do not lead the scheduler.
+    '''
+    if SCHEDULER is None or not SCHEDULER.election.elected:
+        return []
+
+    return SCHEDULER.stats()
 
 
 def setup(config):
     '''
-    Accept a list of crontab tuples consisting of:
+    Accept a list of schedule tuples consisting of:
+
+        (schedule, module_name.Class[, options])
 
-        (cron_schedule, module_name.Class)
+    and schedule them to run. The schedule is a crontab or a number of
+    seconds, options are those of ScheduledTask. Also starts the task workers.
 
-    and schedule them to run.
+    Runs once per process.
     '''
-    for crontab, task_class in config:
+    if SCHEDULER is not None:
+        return
+
+    for entry in config:
+        schedule, task_class = entry[:2]
+        options = entry[2] if len(entry) > 2 else {}
+
         try:
-            cron = Cron(crontab)
+            if isinstance(schedule, (int, float)):
+                trigger = Interval(schedule)
+
+            else:
+                trigger = Cron(schedule)
 
         except ValueError:
             raise ImproperlyConfigured(
-                '"%s" is an invalid cron schedule' % crontab)
+                '"%s" is an invalid schedule' % schedule)
 
         try:
             # Store the class string, defer import...
-            SCHEDULE[cron] = task_class
+            SCHEDULE.append(ScheduledTask(trigger, task_class, **options))
 
-        except ImportError as e:
+        except (TypeError, ValueError) as e:
             raise ImproperlyConfigured(
-                '"%s" is an invalid module_name.Class. %s' % (task_class, e))
+                'Invalid options for "%s". %s' % (task_class, e))
 
     _start_scheduler()
     _start_threadpool()
@@ -0,0 +1,74 @@
+'''
+SQLite tuning.
+
+Applies settings.SQLITE_PRAGMAS to each new SQLite connection. Most important
+is the WAL journal: readers then read a snapshot while a writer holds the
+write lock (api.monkeypatch begins most writes with BEGIN IMMEDIATE), instead
+of waiting for guide imports and recording updates to commit.
+
+WAL grows until a checkpoint copies it back into the database. SQLite
+checkpoints as it goes, but can only reset the WAL when no reader is using
+it. TaskDatabaseMaintenance (api.tasks.database) truncates it, and runs
+PRAGMA optimize, periodically.
+'''
+
+import logging
+
+from django.conf import settings
+from django.db import connection
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+_logged = False
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+def effective_pragmas(cursor, pragmas):
+    effective = {}
+    for name in pragmas:
+        cursor.execute('PRAGMA %s' % name)
+        # In-memory databases (tests) have no mmap_size.
+        row = cursor.fetchone()
+        effective[name] = None if row is None else row[0]
+    return effective
+
+
+def configure(sender, connection, **kwargs):
+    '''
+    Receives connection_created.
+    '''
+    global _logged
+
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, settings.SQLITE_PRAGMAS)
+
+        if not _logged:
+            _logged = True
+            LOGGER.info('SQLite %s', ', '.join(
+                '%s=%s' % item for item in effective_pragmas(
+                    cursor, settings.SQLITE_PRAGMAS).items()))
+
+
+def checkpoint(mode='TRUNCATE'):
+    '''
+    Copy the WAL into the database, returns the (busy, log, checkpointed)
+    pages.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA wal_checkpoint(%s)' % mode)
+        return cursor.fetchone()
+
+
+def optimize():
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA optimize')
@@ -0,0 +1,149 @@
+'''
+Storage accounting.
+
+Keeps running totals of the bytes and files in each storage area, so storage
+stats never need to walk a directory tree. Code that writes or deletes files
+reports the change:
+
+ - The recording watchdog, as recordings and transcoded streams grow and as
+   streams are deleted (api.tasks.recordings).
+ - The media remover, as recordings are deleted (api.tasks.retention).
+
+Changes nobody reports (files created or deleted by hand, a crash between
+writing and reporting) are corrected by a periodic walk, see reconcile() and
+api.tasks.storage. Free space comes from the filesystem.
+
+Totals, and the bytes freed by removing files, are stored in the database, so
+all processes share them.
+'''
+
+import os
+import logging
+
+from os.path import join as pathjoin
+
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+MEDIA = 'media'
+TEMP = 'temp'
+
+
+def walk(path, exclude=()):
+    '''
+    Returns the (bytes, files) under path, except under the directories in
+    exclude. Hard linked files are counted once.
+    '''
+    exclude = set(map(os.path.abspath, exclude))
+    size, files, linked = 0, 0, set()
+    for root, dirs, names in os.walk(path):
+        dirs[:] = [
+            d for d in dirs
+            if os.path.abspath(pathjoin(root, d)) not in exclude]
+
+        for name in names:
+            try:
+                stat = os.stat(pathjoin(root, name))
+
+            except OSError:
+                # Deleted while walking.
+                continue
+
+            if stat.st_nlink > 1:
+                if (stat.st_dev, stat.st_ino) in linked:
+                    continue
+                linked.add((stat.st_dev, stat.st_ino))
+
+            size += stat.st_size
+            files += 1
+
+    return size, files
+
+
+class StorageAccounts(object):
+    def add(self, name, size, files=0, freed=0):
+        '''
+        Account for bytes and files written, negative for those deleted.
+        '''
+        from main.models import StorageUsage
+
+        if not size and not files and not freed:
+            return
+
+        updated = StorageUsage.objects.filter(name=name).update(
+            usage=F('usage') + size, files=F('files') + files,
+            freed=F('freed') + freed)
+
+        if not updated:
+            try:
+                StorageUsage.objects.create(
+                    name=name, usage=size, files=files, freed=freed)
+
+            except IntegrityError:
+                # Created concurrently.
+                self.add(name, size, files, freed)
+
+    def remove(self, name, size, files=0):
+        '''
+        Account for bytes and files removed, they also count as freed.
+        '''
+        self.add(name, -size, -files, size)
+
+    def reconcile(self, name, path, exclude=()):
+        '''
+        Walk path and correct the totals. Changes reported during the walk
+        are kept.
+        '''
+        from main.models import StorageUsage
+
+        usage, _ = StorageUsage.objects.get_or_create(name=name)
+        size, files = walk(path, exclude)
+
+        StorageUsage.objects.filter(name=name).update(
+            usage=F('usage') - usage.usage + size,
+            files=F('files') - usage.files + files,
+            reconciled=timezone.now())
+
+        LOGGER.info(
+            'Reconciled %s storage, %i bytes (%+i) in %i files (%+i)', name,
+            size, size - usage.usage, files, files - usage.files)
+
+    def stats(self, name, path):
+        from main.models import StorageUsage
+
+        usage = StorageUsage.objects.filter(name=name).first()
+        stats = {
+            'usage': 0,
+            'count': 0,
+            'freed': 0,
+            'free': None,
+            'total': None,
+            'reconciled': None,
+        }
+
+        if usage is not None:
+            stats.update({
+                'usage': max(usage.usage, 0),
+                'count': max(usage.files, 0),
+                'freed': usage.freed,
+                'reconciled': usage.reconciled,
+            })
+
+        try:
+            fs = os.statvfs(path)
+            stats['free'] = fs.f_bavail * fs.f_frsize
+            stats['total'] = fs.f_blocks * fs.f_frsize
+
+        except OSError as e:
+            LOGGER.debug('Could not stat %s: %s', path, e)
+
+        return stats
+
+
+STORAGE = StorageAccounts()
@@ -0,0 +1,365 @@
+'''
+Persistent task queue.
+
+Tasks are stored as Job rows so that queued work survives a restart. A worker
+claims a Job by taking a lease on it, the lease is renewed by a background
+thread while the Task runs. If the process dies, the lease expires and the Job
+is delivered again (at-least-once delivery). Tasks that fail are retried with
+exponential backoff until they run out of attempts.
+
+Tasks may have a dedup key. A Task enqueued while a duplicate is queued is
+coalesced into it, and a queued Task is not claimed while a duplicate runs.
+
+Jobs are claimed by priority. Each worker serves a lane, taking Jobs of its
+lane's priority or higher, so a long running low priority Task can never hold
+up a higher priority one when lanes are sized with that in mind.
+
+The queue is shared by all processes. Processes that do not run workers (web
+workers of a multi-process deployment, see settings.TASK_MODE) only put Tasks.
+
+Models are imported within functions, this module is loaded while the app
+registry is still being populated.
+'''
+
+import time
+import logging
+import threading
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+LOGGER.addHandler(logging.NullHandler())
+
+# Seconds a claimed Job belongs to a worker without renewal.
+LEASE = 60
+# Seconds between lease renewals.
+HEARTBEAT = 10
+# Seconds an idle worker waits before checking for Jobs again.
+POLL_INTERVAL = 2
+# Delay before the first retry, doubled for each further attempt.
+RETRY_BACKOFF = 30
+# Seconds of queue wait that get a Job logged as late.
+LATE_WAIT = 30
+
+
+def _class_path(task):
+    return '%s.%s' % (task.__class__.__module__, task.__class__.__qualname__)
+
+
+class TaskQueue(object):
+    '''
+    Queue of Tasks backed by the Job table.
+
+    Tasks enqueued in this process are kept in memory until claimed, so the
+    instance that was put is the instance that runs. Tasks enqueued elsewhere
+    are rebuilt from their Job.
+    '''
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._local = {}
+        self._running = {}
+        self._keeper = None
+        # Set when this process runs workers.
+        self.serving = False
+        # Incremented by put(), so puts during a claim are not missed.
+        self._puts = 0
+        # Stats.
+        self.since = time.time()
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        # Per priority: [claimed, total wait, max wait].
+        self.waits = {}
+
+    def put(self, task, background=False):
+        '''
+        Store the Task as a Job, returns the id of the Job, which is that of
+        a queued duplicate if there is one.
+        '''
+        from main.models import Job
+
+        now = timezone.now()
+        key = task.dedup_key()
+
+        with transaction.atomic(immediate='jobs'):
+            duplicate = None
+            if key is not None:
+                duplicate = Job.objects.filter(
+                    key=key, status=Job.STATUS_QUEUED).order_by(
+                        'created').first()
+
+            if duplicate is not None:
+                if not background and duplicate.background:
+                    # Now someone is interested in it.
+                    Job.objects.filter(id=duplicate.id).update(
+                        background=False)
+
+                with self._lock:
+                    self.coalesced += 1
+                return duplicate.id
+
+            job = Job(
+                id=task.id, task_class=_class_path(task), key=key,
+                background=background, priority=task.priority,
+                max_attempts=task.max_attempts, available_at=now,
+                created=task.created, modified=now, summary=task.summary)
+            job.set_arguments(task.args, task.kwargs)
+            job.save(force_insert=True)
+
+        with self._cond:
+            if self.serving:
+                self._local[str(task.id)] = task
+            self._puts += 1
+            # Wake all lanes, some may not accept this priority.
+            self._cond.notify_all()
+
+        return task.id
+
+    def get(self, priority):
+        '''
+        Block until a Job of the given priority or higher can be claimed, and
+        return its Task.
+        '''
+        while True:
+            with self._cond:
+                puts = self._puts
+
+            task = self._claim(priority)
+            if task is not None:
+                return task
+
+            with self._cond:
+                if puts == self._puts:
+                    self._cond.wait(POLL_INTERVAL)
+
+    def stop(self, id):
+        from main.models import Job
+
+        try:
+            Job(id=id).stop()
+
+        except Exception as e:
+            LOGGER.warning('Could not stop job %s: %s', id, e)
+
+    def _candidates(self, now, priority):
+        from main.models import Job
+
+        running = Job.objects.filter(
+            status__in=(Job.STATUS_RUNNING, Job.STATUS_TERMINATING),
+            lease_until__gte=now, key__isnull=False).values('key')
+
+        return Job.objects.filter(
+            Q(status=Job.STATUS_QUEUED, available_at__lte=now) |
+            Q(status__in=(Job.STATUS_RUNNING, Job.STATUS_TERMINATING),
+              lease_until__lt=now),
+            priority__lte=priority
+        ).exclude(
+            # Duplicates wait for the running one.
+            key__in=running
+        ).order_by('priority', 'available_at', 'created')
+
+    def _claim(self, priority):
+        from main.models import Job
+
+        now = timezone.now()
+
+        # Idle workers poll, only take the write lock if there is work.
+        if not self._candidates(now, priority).exists():
+            return
+
+        with transaction.atomic(immediate='jobs'):
+            for job in self._candidates(now, priority)[:10]:
+                if job.status == Job.STATUS_TERMINATING:
+                    # Cancelled, then its worker went away.
+                    job.status = Job.STATUS_TERMINATED
+
+                elif job.status == Job.STATUS_RUNNING and \
+                        job.attempts >= job.max_attempts:
+                    job.status = Job.STATUS_ERROR
+                    job.summary = 'Worker lost, no attempts remaining.'
+
+                else:
+                    break
+
+                LOGGER.warning('Abandoned job %s', job)
+                job.lease_until, job.modified = None, now
+                job.save(update_fields=[
+                    'status', 'summary', 'lease_until', 'modified'])
+
+            else:
+                return
+
+            Job.objects.filter(id=job.id).update(
+                status=Job.STATUS_RUNNING, attempts=F('attempts') + 1,
+                started=now, lease_until=now + timedelta(seconds=LEASE),
+                modified=now)
+
+        with self._cond:
+            task = self._local.pop(str(job.id), None)
+
+        if task is None:
+            try:
+                args, kwargs = job.get_arguments()
+                task = import_string(job.task_class)(
+                    args=args, kwargs=kwargs, id=job.id)
+                task.created = job.created
+                task.background = job.background
+
+            except Exception as e:
+                LOGGER.exception(e)
+                Job.objects.filter(id=job.id).update(
+                    status=Job.STATUS_ERROR, summary=str(e), lease_until=None,
+                    modified=timezone.now())
+                return
+
+        task.attempt = job.attempts + 1
+        wait = max((now - job.available_at).total_seconds(), 0)
+        with self._lock:
+            self._running[str(job.id)] = (task, time.time())
+            self.wait_time += wait
+            waits = self.waits.setdefault(job.priority, [0, 0.0, 0.0])
+            waits[0] += 1
+            waits[1] += wait
+            waits[2] = max(waits[2], wait)
+        self._start_keeper()
+
+        if wait > LATE_WAIT:
+            LOGGER.warning(
+                'Job %s waited %.1fs (%s priority)', job, wait,
+                Job.PRIORITY_NAMES.get(job.priority))
+
+        LOGGER.debug('Claimed job %s, attempt %i', job, task.attempt)
+        return task
+
+    def finish(self, task):
+        '''
+        Record the outcome of a Task. Errors are retried if attempts remain.
+        '''
+        from main.models import Job
+
+        with self._lock:
+            _, claimed = self._running.pop(str(task.id), (None, None))
+            if claimed is not None:
+                self.run_time += time.time() - claimed
+
+        now = timezone.now()
+        attempt = getattr(task, 'attempt', 1)
+        fields = {
+            'done': task.done,
+            'total': task.total,
+            'lease_until': None,
+            'modified': now,
+        }
+
+        if task.status == Job.STATUS_ERROR and attempt < task.max_attempts:
+            delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+            LOGGER.info('Retrying %s in %is', _class_path(task), delay)
+            task.status = Job.STATUS_QUEUED
+            task.summary = 'Retrying in %is: %s' % (delay, task.summary)
+            fields['available_at'] = now + timedelta(seconds=delay)
+            with self._cond:
+                self._local[str(task.id)] = task
+            with self._lock:
+                self.retried += 1
+
+        else:
+            with self._lock:
+                if task.status == Job.STATUS_ERROR:
+                    self.failed += 1
+
+                else:
+                    self.completed += 1
+
+        fields['status'] = task.status
+        fields['summary'] = task.summary
+        Job.objects.filter(id=task.id).exclude(
+            status__in=Job.STATUS_FINISHED).update(**fields)
+
+    def _start_keeper(self):
+        with self._lock:
+            if self._keeper is not None and self._keeper.is_alive():
+                return
+
+            self._keeper = threading.Thread(target=self._keep)
+            self._keeper.daemon = True
+            self._keeper.start()
+
+    def _keep(self):
+        '''
+        Renew the leases of running Jobs, persisting their progress. Tasks
+        whose Job was stopped or deleted are signalled to exit.
+        '''
+        from main.models import Job
+
+        while True:
+            time.sleep(HEARTBEAT)
+
+            with self._lock:
+                running = [task for task, _ in self._running.values()]
+
+            for task in running:
+                try:
+                    now = timezone.now()
+                    updated = Job.objects.filter(
+                        id=task.id, status=Job.STATUS_RUNNING).update(
+                            lease_until=now + timedelta(seconds=LEASE),
+                            done=task.done, total=task.total,
+                            summary=task.summary,
+                            modified=task.modified or now)
+
+                    if not updated:
+                        LOGGER.info('Job %s was stopped', task.id)
+                        task.exit.set()
+
+                except Exception as e:
+                    LOGGER.exception(e)
+
+    def stats(self):
+        from main.models import Job
+
+        with self._lock:
+            running = len(self._running)
+            completed, failed = self.completed, self.failed
+            retried, coalesced = self.retried, self.coalesced
+            wait_time, run_time = self.wait_time, self.run_time
+            waits = {p: list(w) for p, w in self.waits.items()}
+
+        queued = dict(
+            Job.objects.filter(status=Job.STATUS_QUEUED)
+            .values_list('priority').annotate(Count('id')))
+        priorities = {}
+        for priority, name in Job.PRIORITY_NAMES.items():
+            claimed, total, longest = waits.get(priority, (0, 0.0, 0.0))
+            priorities[name] = {
+                'queued': queued.get(priority, 0),
+                'claimed': claimed,
+                'wait': round(total / max(claimed, 1), 2),
+                'max_wait': round(longest, 2),
+            }
+
+        started = completed + failed + retried
+        minutes = max((time.time() - self.since) / 60, 1)
+        return {
+            'queued': sum(queued.values()),
+            'running': running,
+            'completed': completed,
+            'failed': failed,
+            'retried': retried,
+            'coalesced': coalesced,
+            'throughput': round(started / minutes, 2),
+            'wait': round(wait_time / max(started + running, 1), 2),
+            'runtime': round(run_time / max(started, 1), 2),
+            'priorities': priorities,
+        }
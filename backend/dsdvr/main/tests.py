@@ -1,3 +1,174 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
+from urllib.request import urlopen
 
-# Create your tests here.
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from api.tasks import BaseTask, STATUS_DONE, STATUS_ERROR, PRIORITY_LOW
+from main import taskqueue
+from main.management.commands.querybudget import check
+from main.metrics import serve
+from main.models import Job, Leader
+from main.schedule import Election
+from main.taskqueue import TaskQueue
+
+
+class ElectionTestCase(TestCase):
+    def _expire(self):
+        Leader.objects.update(lease_until=timezone.now() - timedelta(1))
+
+    def test_term(self):
+        election = Election('test')
+        self.assertTrue(election.campaign())
+        self.assertEqual(election.term, 1)
+
+        # Renewing, even after a failed renewal, continues the term.
+        self.assertTrue(election.campaign())
+        election.elected = False
+        self._expire()
+        self.assertTrue(election.campaign())
+        self.assertEqual(election.term, 1)
+
+    def test_term_changed_hands(self):
+        election, other = Election('test'), Election('test')
+        other.owner = 'other'
+        self.assertTrue(election.campaign())
+        self.assertFalse(other.campaign())
+
+        self._expire()
+        self.assertTrue(other.campaign())
+        self.assertFalse(election.campaign())
+
+        self._expire()
+        self.assertTrue(election.campaign())
+        self.assertEqual(election.term, 2)
+        self.assertEqual(other.term, 1)
+
+
+class QueueTask(BaseTask):
+    pass
+
+
+class TaskQueueTestCase(TransactionTestCase):
+    '''
+    Each TaskQueue stands for a process sharing the queue.
+    '''
+
+    def setUp(self):
+        # Leases are renewed, or expired, by hand.
+        keeper = mock.patch.object(TaskQueue, '_start_keeper')
+        keeper.start()
+        self.addCleanup(keeper.stop)
+
+        self.queue = TaskQueue()
+        self.queue.serving = True
+
+    def _put(self, max_attempts=Job.MAX_ATTEMPTS):
+        task = QueueTask()
+        task.max_attempts = max_attempts
+        self.queue.put(task)
+        return task
+
+    def _expire(self):
+        Job.objects.update(lease_until=timezone.now() - timedelta(seconds=1))
+
+    def test_leased(self):
+        task = self._put()
+        self.assertIs(self.queue._claim(PRIORITY_LOW), task)
+        self.assertEqual(task.attempt, 1)
+
+        # Running elsewhere, until its lease expires.
+        self.assertIsNone(TaskQueue()._claim(PRIORITY_LOW))
+
+    def test_redelivered(self):
+        task = self._put()
+        self.queue._claim(PRIORITY_LOW)
+
+        # The process died without finishing the Task, another gets it.
+        self._expire()
+        redelivered = TaskQueue()._claim(PRIORITY_LOW)
+        self.assertIsInstance(redelivered, QueueTask)
+        self.assertEqual(redelivered.id, task.id)
+        self.assertEqual(redelivered.attempt, 2)
+
+        redelivered.status = STATUS_DONE
+        self.queue.finish(redelivered)
+        self.assertEqual(Job.objects.get().status, Job.STATUS_DONE)
+
+    def test_lost_no_attempts(self):
+        self._put(max_attempts=1)
+        self.queue._claim(PRIORITY_LOW)
+
+        self._expire()
+        self.assertIsNone(TaskQueue()._claim(PRIORITY_LOW))
+
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.STATUS_ERROR)
+        self.assertIsNone(job.lease_until)
+
+    def test_retry_backoff(self):
+        self._put(max_attempts=3)
+
+        for attempt in (1, 2):
+            task = self.queue._claim(PRIORITY_LOW)
+            self.assertEqual(task.attempt, attempt)
+            task.status = STATUS_ERROR
+            self.queue.finish(task)
+
+            job = Job.objects.get()
+            self.assertEqual(job.status, Job.STATUS_QUEUED)
+            delay = taskqueue.RETRY_BACKOFF * 2 ** (attempt - 1)
+            self.assertAlmostEqual(
+                (job.available_at - job.modified).total_seconds(), delay)
+
+            # Not before its backoff.
+            self.assertIsNone(self.queue._claim(PRIORITY_LOW))
+            Job.objects.update(available_at=timezone.now())
+
+        # Out of attempts.
+        task = self.queue._claim(PRIORITY_LOW)
+        self.assertEqual(task.attempt, 3)
+        task.status = STATUS_ERROR
+        self.queue.finish(task)
+
+        self.assertEqual(Job.objects.get().status, Job.STATUS_ERROR)
+        self.assertIsNone(self.queue._claim(PRIORITY_LOW))
+
+
+class MetricsTestCase(TestCase):
+    def test_local(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_remote(self):
+        self.assertEqual(self.client.get(
+            '/metrics', REMOTE_ADDR='192.0.2.1').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        for token, status in (('secret', 200), ('wrong', 403)):
+            response = self.client.get(
+                '/metrics', REMOTE_ADDR='192.0.2.1',
+                HTTP_AUTHORIZATION='Bearer %s' % token)
+            self.assertEqual(response.status_code, status)
+
+    def test_serve(self):
+        # The worker's listener.
+        server = serve(0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        with urlopen('http://127.0.0.1:%i/metrics' % (
+                server.server_address[1])) as response:
+            self.assertEqual(response.status, 200)
+            self.assertIn(b'dsdvr_tasks_total', response.read())
+
+
+class QueryBudgetTestCase(TestCase):
+    def test_budgets(self):
+        # As `manage.py querybudget` does, with less data.
+        failed = [
+            (prefix, counts, budget, result)
+            for prefix, counts, budget, result in check(2)
+            if result != 'ok']
+        self.assertEqual(failed, [])
@@ -2,10 +2,11 @@
 from django.urls import path
 from django.views.generic.base import TemplateView
 
-from main.views import player
+from main.views import player, metrics
 
 
 urlpatterns = [
     path('', TemplateView.as_view(template_name='index.html')),
     path('player/', player),
+    path('metrics', metrics, name='metrics'),
 ]
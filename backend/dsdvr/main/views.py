@@ -1,6 +1,50 @@
+from django.db.models import Count
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render_to_response
 
+from main.metrics import (
+    REGISTRY, CONTENT_TYPE, QUEUE_DEPTH, RECORDINGS_ACTIVE, TRANSCODE_SESSIONS,
+    allowed,
+)
+from main.sampler import SAMPLER
+
 
 def player(request):
     stream = request.GET.get('stream')
     return render_to_response('player.html', {'stream': stream})
+
+
+@REGISTRY.collector
+def _collect_database():
+    from api.models import Recording, Stream
+    from main.models import Job
+
+    queued = dict(
+        Job.objects.filter(status=Job.STATUS_QUEUED)
+        .values_list('priority').annotate(Count('id')))
+    for priority, name in Job.PRIORITY_NAMES.items():
+        QUEUE_DEPTH.set(queued.get(priority, 0), priority=name)
+
+    RECORDINGS_ACTIVE.set(Recording.objects.filter(
+        status=Recording.STATUS_RECORDING).count())
+    TRANSCODE_SESSIONS.set(Stream.objects.filter(pid__isnull=False).count())
+
+
+@REGISTRY.collector
+def _collect_processes():
+    # Process gauges are set by the sampler, as it samples.
+    SAMPLER.start()
+
+
+def metrics(request):
+    '''
+    Metrics of this process, in the Prometheus text format.
+
+    Only for scrapers on this host, or that send settings.METRICS_TOKEN.
+    '''
+    if not allowed(
+            request.META.get('REMOTE_ADDR'),
+            request.META.get('HTTP_AUTHORIZATION')):
+        return HttpResponseForbidden()
+
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
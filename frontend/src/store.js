@@ -71,7 +71,10 @@ axios.interceptors.response.use(
 class Status {
     constructor() {
         this._subscribers = [];
+        this._taskWatchers = [];
         this._interval = null;
+        this._events = null;
+        this._connecting = false;
         this._status = null;
     }
 
@@ -105,13 +108,121 @@ class Status {
             });
     }
 
+    _startPolling() {
+        // Get data for them right away.
+        this._poll();
+        // Poll every so often while we have subscribers.
+        this._interval = setInterval(this._poll.bind(this), 10000);
+    }
+
+    _replace(key, item) {
+        // Replace (or add) an item in one of the status lists.
+        if (!this._status || !this._status[key])
+            return;
+        this._status[key] = this._status[key]
+            .filter(i => i.id !== item.id)
+            .concat([item]);
+        this._dispatch(this._status);
+    }
+
+    _remove(key, id) {
+        if (!this._status || !this._status[key])
+            return;
+        this._status[key] = this._status[key].filter(i => i.id !== id);
+        this._dispatch(this._status);
+    }
+
+    _listen() {
+        // Changes are pushed as server-sent events, fall back to polling if
+        // that is not possible.
+        if (!window.EventSource) {
+            this._startPolling();
+            return;
+        }
+
+        // EventSource can not send our access token, it is exchanged for a
+        // ticket that opens one stream.
+        this._connecting = true;
+        axios.post('/api/events/ticket/')
+            .then(r => {
+                this._connecting = false;
+                if (this._subscribers.length)
+                    this._open(r.data.ticket);
+            })
+            .catch(() => {
+                this._connecting = false;
+                if (this._subscribers.length)
+                    this._startPolling();
+            });
+    }
+
+    _open(ticket) {
+        const events = new EventSource(
+            `/api/events/?ticket=${encodeURIComponent(ticket)}`);
+        const on = (type, fn) => {
+            events.addEventListener(type, e => fn(JSON.parse(e.data)));
+        };
+        let opened = false;
+
+        on('status', status => {
+            opened = true;
+            this._dispatch(status);
+        });
+        on('system', system => {
+            if (!this._status)
+                return;
+            this._status.system = system;
+            this._dispatch(this._status);
+        });
+        on('task', task => {
+            this._replace('tasks', task);
+            this._taskWatchers.forEach(fn => fn(task));
+        });
+        on('recording', recording => this._replace('recordings', recording));
+        on('recording.deleted', r => this._remove('recordings', r.id));
+        on('stream', stream => this._replace('streams', stream));
+        on('stream.deleted', s => this._remove('streams', s.id));
+
+        events.onerror = () => {
+            // EventSource would reconnect with the used ticket. Get another
+            // if the stream was working, poll if it was refused (expired
+            // token, too many streams etc.)
+            events.close();
+            this._events = null;
+            if (!this._subscribers.length)
+                return;
+            if (opened)
+                this._listen();
+            else
+                this._startPolling();
+        };
+        this._events = events;
+    }
+
+    live() {
+        return this._events !== null;
+    }
+
+    watchTask(fn) {
+        this._taskWatchers.push(fn);
+    }
+
+    unwatchTask(fn) {
+        const index = this._taskWatchers.indexOf(fn);
+        if (index !== -1) {
+            this._taskWatchers.splice(index, 1);
+        }
+    }
+
     subscribe(fn) {
         this._subscribers.push(fn);
-        if (this._interval === null) {
+        if (this._interval === null && this._events === null &&
+            !this._connecting) {
+            this._listen();
+
+        } else if (this._status !== null) {
             // Get data for them right away.
-            this._poll();
-            // Poll every so often while we have subscribers.
-            this._interval = setInterval(this._poll.bind(this), 10000);
+            fn(this._status);
         }
     }
 
@@ -121,9 +232,13 @@ class Status {
             this._subscribers.splice(index, 1);
         }
         if (this._subscribers.length === 0) {
-            // Don't poll if we don't have subscribers.
+            // Don't poll or listen if we don't have subscribers.
             clearInterval(this._interval);
             this._interval = null;
+            if (this._events !== null) {
+                this._events.close();
+                this._events = null;
+            }
         }
     }
 }
@@ -151,8 +266,9 @@ class Store {
             });
     }
 
-    getGuide() {
-        return axios.get('/api/guide/');
+    getGuide(next) {
+        // Paged, next is the URL of the next page (r.data.next).
+        return axios.get(next || '/api/guide/');
     }
 
     downloadGuide(callback) {
@@ -168,6 +284,28 @@ class Store {
     }
 
     pollTask(task, callback) {
+        if (this.status.live()) {
+            // Task events are pushed to us.
+            const watcher = t => {
+                if (t.id !== task.id)
+                    return;
+                if (t.status !== 'running' && t.status !== 'queued')
+                    this.status.unwatchTask(watcher);
+                callback({ data: t });
+            };
+            this.status.watchTask(watcher);
+            // It may have finished before we started watching.
+            axios.get(`/api/tasks/${task.id}/`)
+                .then(r => {
+                    if (r.data.status !== 'running' &&
+                        r.data.status !== 'queued') {
+                        this.status.unwatchTask(watcher);
+                        callback(r);
+                    }
+                });
+            return;
+        }
+
         function poll() {
             axios.get(`/api/tasks/${task.id}/`)
                 .then(r => {
@@ -196,8 +334,9 @@ class Store {
         return axios.delete(`/api/recordings/${recordingId}/`);
     }
 
-    getMedia() {
-        return axios.get('/api/media/');
+    getMedia(next) {
+        // Paged, next is the URL of the next page (r.data.next).
+        return axios.get(next || '/api/media/');
     }
 
     playVideo(media) {